@@ -0,0 +1,162 @@
+"""
+Running reconciliation totals for the admin summary.
+
+Every payment and worker payment record contributes a fixed vector of
+amounts and a few status counts to two scopes: its contractor and the
+overall total. The stores remember each record's last contribution and,
+on every write, apply only the difference, so the summary never has to
+look at individual records.
+"""
+from collections import Counter
+
+# Scope key of the totals across all contractors
+ALL_CONTRACTORS = '*'
+
+# Status count tuples by value; there are only a few distinct ones, so
+# contributions share them rather than keeping a copy per record
+_STATUSES = {}
+
+TOTAL_FIELDS = (
+    'payments', 'total_amount',
+    'worker_payments', 'promised_amount', 'actual_paid',
+    'actual_received_by_worker', 'received_count', 'received_paid',
+)
+
+
+def to_amount(value):
+    """Amount as a float, counting missing or non-numeric values as 0"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def payment_contribution(payment, key, status):
+    """(contractor key, contractor, totals vector, status counts) of a payment"""
+    totals = (1, to_amount(payment['amount']), 0, 0.0, 0.0, 0.0, 0, 0.0)
+    return key, payment['contractor'], totals, _shared((('payment', status),))
+
+
+def worker_payment_contribution(wp, key):
+    """(contractor key, contractor, totals vector, status counts) of a worker payment record"""
+    received = wp.get('actual_received_by_worker')
+    actual_paid = to_amount(wp.get('actual_paid'))
+    if received is None:
+        receipt = (0.0, 0, 0.0)
+    else:
+        receipt = (to_amount(received), 1, actual_paid)
+    totals = (0, 0.0, 1, to_amount(wp.get('promised_amount')), actual_paid) + receipt
+    return (key, wp['contractor'], totals,
+            _shared((('payment_status', wp['payment_status']), ('work_status', wp['work_status']))))
+
+
+def _shared(statuses):
+    return _STATUSES.setdefault(statuses, statuses)
+
+
+def contribution_deltas(old, new):
+    """Yield (scope, contractor, totals delta, status count deltas) between two contributions"""
+    if old == new:
+        return
+    deltas = {}
+    for contribution, sign in ((old, -1), (new, 1)):
+        if contribution is None:
+            continue
+        key, contractor, totals, statuses = contribution
+        for scope in (key, ALL_CONTRACTORS):
+            _, vector, counts = deltas.setdefault(scope, (contractor, [0] * len(TOTAL_FIELDS), Counter()))
+            for index, value in enumerate(totals):
+                vector[index] += sign * value
+            for status in statuses:
+                counts[status] += sign
+    for scope, (contractor, vector, counts) in deltas.items():
+        yield scope, contractor, vector, counts
+
+
+def build_summary(contractor, totals, counts):
+    """Summary response for one scope from its totals vector and status counts"""
+    values = dict(zip(TOTAL_FIELDS, totals))
+    by_status = {'payment': {}, 'payment_status': {}, 'work_status': {}}
+    for (kind, status), count in counts.items():
+        if count:
+            by_status[kind][status] = count
+
+    return {
+        "contractor": contractor,
+        "payments": {
+            "count": values['payments'],
+            "total_amount": round(values['total_amount'], 2),
+            "by_status": by_status['payment'],
+        },
+        "worker_payments": {
+            "count": values['worker_payments'],
+            "promised_amount": round(values['promised_amount'], 2),
+            "actual_paid": round(values['actual_paid'], 2),
+            "actual_received_by_worker": round(values['actual_received_by_worker'], 2),
+            "received_count": values['received_count'],
+            # Promised but not (yet) paid by the contractor
+            "unpaid_amount": round(values['promised_amount'] - values['actual_paid'], 2),
+            # Paid according to the contractor but not received according to
+            # the worker, over records the worker has confirmed
+            "unreceived_amount": round(values['received_paid'] - values['actual_received_by_worker'], 2),
+            "by_payment_status": by_status['payment_status'],
+            "by_work_status": by_status['work_status'],
+        },
+    }
+
+
+class RunningTotals:
+    """In-memory running totals per contractor and overall"""
+
+    def __init__(self):
+        self._totals = {}
+        self._counts = {}
+        self._contributions = {}
+
+    def update(self, record_key, contribution):
+        """Replace the contribution of a record (e.g. ('payment', id))"""
+        old = self._contributions.get(record_key)
+        if old == contribution:
+            return
+        if old is not None:
+            self._add(old, -1)
+        self._add(contribution, 1)
+        self._contributions[record_key] = contribution
+
+    def _add(self, contribution, sign):
+        key, contractor, totals, statuses = contribution
+        for scope in (key, ALL_CONTRACTORS):
+            entry = self._totals.get(scope)
+            if entry is None:
+                entry = self._totals[scope] = [contractor, [0] * len(TOTAL_FIELDS)]
+                self._counts[scope] = Counter()
+            entry[0] = contractor
+            vector = entry[1]
+            for index, value in enumerate(totals):
+                if value:
+                    vector[index] += sign * value
+            counts = self._counts[scope]
+            for status in statuses:
+                counts[status] += sign
+
+    def items(self):
+        """Yield (scope, contractor, totals, status counts) of every scope"""
+        for scope, (contractor, totals) in self._totals.items():
+            yield scope, contractor, totals, self._counts.get(scope, Counter())
+
+    def summary(self, scope=ALL_CONTRACTORS):
+        """Summary of a contractor key, or across all contractors; None if unknown"""
+        entry = self._totals.get(scope)
+        if entry is None:
+            if scope != ALL_CONTRACTORS:
+                return None
+            entry = [None, [0] * len(TOTAL_FIELDS)]
+        name = entry[0] if scope != ALL_CONTRACTORS else None
+        return build_summary(name, entry[1], self._counts.get(scope, Counter()))
+
+    def contractors(self):
+        """Per-contractor summaries, by contractor name"""
+        summaries = [build_summary(name, totals, self._counts.get(scope, Counter()))
+                     for scope, (name, totals) in self._totals.items() if scope != ALL_CONTRACTORS]
+        summaries.sort(key=lambda summary: summary['contractor'].casefold())
+        return summaries
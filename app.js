@@ -3,13 +3,54 @@ const API_BASE = "/api";
 
 // ======== Data Store =========
 let payments = [];
+let paymentsVersion = null; // Server change version the payments list is current to
 let workers = [];
 let currentWorker = null; // For worker authentication
+let adminEvents = null; // Event stream for the admin tab while it is shown
+let workerEvents = null; // Event stream for the logged-in worker
 
 // ======== Utility Functions =========
 function showTab(tab) {
   document.querySelectorAll(".tab-content").forEach(div => div.classList.add("d-none"));
   document.getElementById("tab-" + tab).classList.remove("d-none");
+
+  // Only the admin tab follows every change; a hidden tab holds no stream
+  if (tab === 'admin' && !adminEvents) {
+    adminEvents = subscribeToEvents('', refreshAdmin);
+  } else if (tab !== 'admin' && adminEvents) {
+    closeEvents(adminEvents);
+    adminEvents = null;
+  }
+}
+
+// Idempotency-Key for one submission; its retries reuse the key so the
+// server applies the write once
+function newIdempotencyKey() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+// POST JSON with an Idempotency-Key, retrying network failures (flaky
+// mine-site connections) and busy responses (429/503, after the server's
+// Retry-After) with the same key
+async function postIdempotent(url, body, attempts = 3) {
+  const key = newIdempotencyKey();
+  for (let attempt = 1; ; attempt++) {
+    let delay = 500 * 2 ** (attempt - 1);
+    try {
+      const res = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+        body: JSON.stringify(body)
+      });
+      if ((res.status !== 429 && res.status !== 503) || attempt >= attempts) return res;
+      const retryAfter = Number(res.headers.get('Retry-After'));
+      if (retryAfter > 0) delay = Math.min(retryAfter, 10) * 1000;
+    } catch (err) {
+      if (attempt >= attempts) throw err;
+    }
+    await new Promise(resolve => setTimeout(resolve, delay));
+  }
 }
 
 // ======== ADMIN FUNCTIONS =========
@@ -21,11 +62,7 @@ async function createPayment(e) {
   const amount = Number(document.getElementById('admin_amount').value);
 
   try {
-    const res = await fetch(`${API_BASE}/admin/payments`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ workorder, contractor, amount })
-    });
+    const res = await postIdempotent(`${API_BASE}/admin/payments`, { workorder, contractor, amount });
 
     if (!res.ok) {
       const err = await res.json().catch(() => ({}));
@@ -44,14 +81,40 @@ async function createPayment(e) {
 
 async function loadPayments() {
   try {
+    // Once the full list is loaded, only fetch what changed since then
+    if (paymentsVersion !== null && await applyPaymentChanges()) {
+      renderAdminPayments();
+      return;
+    }
+
     const res = await fetch(`${API_BASE}/admin/payments`);
     payments = await res.json();
+    paymentsVersion = Number(res.headers.get('X-Version'));
     renderAdminPayments();
   } catch (err) {
     console.error("❌ Failed to load payments:", err);
   }
 }
 
+async function applyPaymentChanges() {
+  let hasMore = true;
+  while (hasMore) {
+    const res = await fetch(`${API_BASE}/changes?since=${paymentsVersion}`);
+    if (!res.ok) return false; // e.g. 410 when the change log has moved on
+
+    const delta = await res.json();
+    delta.payments.forEach(changed => {
+      const index = payments.findIndex(p => p.id === changed.id);
+      if (index >= 0) payments[index] = changed;
+      else payments.push(changed);
+    });
+    payments.sort((a, b) => a.id - b.id);
+    paymentsVersion = delta.version;
+    hasMore = delta.has_more;
+  }
+  return true;
+}
+
 function renderAdminPayments() {
   let container = document.getElementById("adminPaymentsList");
   if (payments.length === 0) {
@@ -414,8 +477,10 @@ async function workerLogin() {
     document.getElementById("workerName").textContent = currentWorker.name;
     document.getElementById("workerPhone").textContent = currentWorker.phone;
     
-    // Load worker payments
+    // Load worker payments and reload them whenever the server pushes a change
     await loadWorkerPayments();
+    closeEvents(workerEvents);
+    workerEvents = subscribeToEvents(`phone=${encodeURIComponent(currentWorker.phone)}`, loadWorkerPayments);
     
   } catch (err) {
     alert('❌ Login failed: ' + err.message);
@@ -424,6 +489,8 @@ async function workerLogin() {
 
 function workerLogout() {
   currentWorker = null;
+  closeEvents(workerEvents);
+  workerEvents = null;
   document.getElementById("workerLoginSection").classList.remove("d-none");
   document.getElementById("workerDashboard").classList.add("d-none");
   document.getElementById("worker_login_phone").value = "";
@@ -435,6 +502,8 @@ async function loadWorkerPayments() {
 
   try {
     const res = await fetch(`${API_BASE}/worker/${currentWorker.phone}/payments`);
+    // When rate limited or busy, keep showing the list already loaded
+    if (!res.ok) throw new Error(`Server returned ${res.status}`);
     const workerPayments = await res.json();
     renderWorkerPayments(workerPayments);
     updateDiscrepancyOptions(workerPayments);
@@ -526,15 +595,11 @@ async function verifyPaymentWithAmount(workerPhone, workorder) {
   }
 
   try {
-    const res = await fetch(`${API_BASE}/worker/verify-payment-with-amount`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        worker_phone: workerPhone, 
-        workorder: workorder,
-        actual_received: actualReceived,
-        verified: true 
-      })
+    const res = await postIdempotent(`${API_BASE}/worker/verify-payment-with-amount`, {
+      worker_phone: workerPhone,
+      workorder: workorder,
+      actual_received: actualReceived,
+      verified: true
     });
 
     if (!res.ok) {
@@ -566,15 +631,11 @@ async function reportDiscrepancy(event) {
   const [workerPhone, workorder] = paymentSelection.split('|');
   
   try {
-    const res = await fetch(`${API_BASE}/worker/report-discrepancy`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        worker_phone: workerPhone,
-        workorder: workorder,
-        actual_received: actualReceived,
-        notes: notes
-      })
+    const res = await postIdempotent(`${API_BASE}/worker/report-discrepancy`, {
+      worker_phone: workerPhone,
+      workorder: workorder,
+      actual_received: actualReceived,
+      notes: notes
     });
 
     if (!res.ok) {
@@ -788,11 +849,56 @@ async function markWorkComplete(paymentId) {
   }
 }
 
+// ======== LIVE UPDATES =========
+const PAYMENT_EVENTS = [
+  'payment_created', 'payment_allocated', 'work_completed',
+  'payments_recorded', 'payment_verified', 'payment_disputed'
+];
+
+
+// Milliseconds before reopening a stream the server refused (503)
+const STREAM_RETRY_DELAY = 60000;
+
+// Reload on every pushed change. EventSource reconnects by itself when the
+// connection drops, and the page reloads once it is back to pick up what it
+// missed; a stream the server refused is reopened after a minute.
+function subscribeToEvents(query, onChange) {
+  if (!window.EventSource) return null;
+  const subscription = { source: null, timer: null, missed: false };
+  const open = () => {
+    const source = new EventSource(`${API_BASE}/events${query ? '?' + query : ''}`);
+    PAYMENT_EVENTS.forEach(type => source.addEventListener(type, () => onChange()));
+    source.onopen = () => {
+      if (subscription.missed) onChange();
+      subscription.missed = false;
+    };
+    source.onerror = () => {
+      subscription.missed = true;
+      if (source.readyState === EventSource.CLOSED) subscription.timer = setTimeout(open, STREAM_RETRY_DELAY);
+    };
+    subscription.source = source;
+  };
+  open();
+  return subscription;
+}
+
+function closeEvents(subscription) {
+  if (!subscription) return;
+  subscription.source.close();
+  clearTimeout(subscription.timer);
+}
+
+function refreshAdmin() {
+  loadPayments();
+  loadAllWorkerPayments();
+}
+
 // ======== INITIALIZATION =========
 async function initializeApp() {
   await loadPayments();
   renderWorkers();
   await loadAllWorkerPayments();
+  showTab('admin');
 }
 
 // Initialize the app when page loads
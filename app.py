@@ -1,39 +1,300 @@
-import os
+import atexit
 import logging
+import math
+import time
+import zlib
+from contextlib import contextmanager
+from functools import wraps
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from flask import (
+    Blueprint, Flask, Response, abort, current_app, g, request, jsonify, make_response,
+    stream_with_context,
+)
 from flask_cors import CORS
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging for debugging
-logging.basicConfig(level=logging.DEBUG)
+from asgi import EVENT_LOOP_KEY, EVENT_STREAM_KEY
+from broadcast import STREAM_RETRY_AFTER, Broadcaster
+from bulk import CHUNK_SIZE, RowError, iter_allocations, iter_rows, upload_format
+from config import DEVELOPMENT_SECRET_KEY, load_config
+from events import EventBus, default_sinks
+from export import EXPORT_FORMATS, export_ledger, parquet_available
+from idempotency import (
+    MAX_KEY_LENGTH, HashingReader, IdempotencyCache, IdempotencyInProgress, IdempotencyMismatch,
+    replayable, request_fingerprint, stored_headers, stream_fingerprint,
+)
+from journal import JournalError, open_journal
+from listing import (
+    PAYMENT_STATUSES, WORKER_PAYMENT_STATUSES, ListQueryError, parse_discrepancy_query,
+    parse_fields, parse_list_query, project,
+)
+from metrics import CONTENT_TYPE, STORE_BUCKETS, Registry, instrument_store
+from ratelimit import OVERLOAD_RETRY_AFTER, open_limiter
+from response_cache import ResponseCache
+from serialization import (
+    NDJSON_MIMETYPE, STREAM_MIN_RECORDS, JSONProvider, dumps, iter_json_array, iter_ndjson,
+    wants_ndjson,
+)
+from static_assets import StaticAssets
+from store import (
+    GLOBAL_SCOPE, ChangesExpired, InMemoryStore, StoreConflict, contractor_scope, phone_scope,
+)
 
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
+# The API blueprint; create_app() builds the Flask app around it
+api = Blueprint('api', __name__)
 
-# Enable CORS for all routes
-CORS(app)
+# Per-app state created by create_app(), reachable from handlers as
+# module-level names: the store, the Server-Sent Events fan-out of payment
+# status changes, the bus that hands write events to the audit and
+# notification sinks, the frontend's static assets, the responses kept for
+# idempotency keys, the cached per-worker and per-contractor lists and the
+# rate limits of the worker-facing endpoints
+store = LocalProxy(lambda: current_app.extensions['wpts']['store'])
+broadcaster = LocalProxy(lambda: current_app.extensions['wpts']['broadcaster'])
+event_bus = LocalProxy(lambda: current_app.extensions['wpts']['events'])
+static_assets = LocalProxy(lambda: current_app.extensions['wpts']['static_assets'])
+idempotency_cache = LocalProxy(lambda: current_app.extensions['wpts']['idempotency'])
+response_cache = LocalProxy(lambda: current_app.extensions['wpts']['responses'])
+limiter = LocalProxy(lambda: current_app.extensions['wpts']['limiter'])
 
-# In-memory data storage for MVP
-payments_data = []
-payment_id_counter = 1
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+request_count = metrics.counter(
+    'wpts_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+request_errors = metrics.counter(
+    'wpts_http_request_errors_total', 'HTTP requests answered with a 5xx status', ('method', 'route'))
+request_latency = metrics.histogram(
+    'wpts_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route'))
+requests_in_flight = metrics.gauge(
+    'wpts_http_requests_in_flight', 'HTTP requests currently being handled')
+store_latency = metrics.histogram(
+    'wpts_store_operation_duration_seconds', 'Store operation latency (index lookups, writes, commits)',
+    ('operation',), STORE_BUCKETS)
+metrics.gauge('wpts_store_records', 'Records in the store', ('kind',), function=lambda: {
+    ('payment',): store.count_payments(),
+    ('worker_payment',): store.count_worker_payments(),
+})
+metrics.gauge('wpts_sse_subscribers', 'Connected event streams',
+              function=lambda: {(): broadcaster.subscriber_count()})
+metrics.counter('wpts_sse_rejected_total', 'Event streams refused because the subscriber cap was reached',
+                function=lambda: {(): broadcaster.rejected})
+metrics.gauge('wpts_event_queue_depth', 'Events waiting for the event sinks',
+              function=lambda: {(): event_bus.stats()['queued']})
+metrics.gauge('wpts_event_queue_high_watermark', 'Most events ever waiting for the event sinks',
+              function=lambda: {(): event_bus.stats()['high_watermark']})
+metrics.counter('wpts_events_total', 'Events by outcome (published, delivered, dropped on a full queue)',
+                ('outcome',), function=lambda: {
+                    (outcome,): event_bus.stats()[outcome] for outcome in ('published', 'delivered', 'dropped')
+                })
+metrics.gauge('wpts_worker_requests_active', 'Worker-facing requests in progress',
+              function=lambda: {(): limiter.stats()['active']})
+metrics.counter('wpts_worker_requests_rejected_total',
+                'Worker-facing requests rejected by a rate limit (ip, phone) or the concurrency cap (overload)',
+                ('reason',), function=lambda: worker_rejections(limiter.stats()))
+metrics.counter('wpts_event_sink_errors_total', 'Event batches a sink failed to write', ('sink',),
+                function=lambda: {(sink,): errors for sink, errors in event_bus.stats()['sink_errors'].items()})
 
-# Worker payment records storage
-worker_payments = []
+# Helper function to label the rejected worker-facing requests for /metrics
+def worker_rejections(stats):
+    rejected = {(reason,): count for reason, count in stats['limited'].items()}
+    rejected[('overload',)] = stats['shed']
+    return rejected
 
-# Utility function to generate unique payment IDs
-def generate_payment_id():
-    global payment_id_counter
-    current_id = payment_id_counter
-    payment_id_counter += 1
-    return current_id
+# Helper function to queue an event for subscribers of the admin scope, the
+# contractor and the given worker phones; it is published after commit
+def notify(event, record, contractor, phones=()):
+    scopes = [GLOBAL_SCOPE, contractor_scope(contractor)]
+    scopes.extend(phone_scope(phone) for phone in phones)
+    g.setdefault('pending_events', []).append((event, record, scopes))
+
+# Helper function to commit pending writes, drop the cached responses of the
+# scopes they touched and publish their events to the event streams and the
+# event bus (logging, audit trail, notifications). Returns whether the commit
+# assigned record versions (the SQL store stamps them on commit).
+def commit_writes():
+    stamped = store.commit()
+    for event, record, scopes in g.pop('pending_events', ()):
+        for scope in scopes:
+            response_cache.invalidate(scope)
+        # Serialized once for both the event streams and the event bus
+        payload = dumps(record)
+        version = record.get('version')
+        broadcaster.publish(event, payload, scopes, event_id=version)
+        event_bus.publish(event, payload, scopes, version)
+    return stamped
+
+@api.before_app_request
+def start_request_timer():
+    """Note the request start for the latency metrics"""
+    g.request_started = time.perf_counter()
+    g.in_flight = True
+    requests_in_flight.inc()
+
+# Registered before commit_store so that it runs after it (after_request
+# hooks run in reverse order) and the latency includes the commit
+@api.after_app_request
+def record_request_metrics(response):
+    """Count the request and observe its latency"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - started, request.method, route)
+        request_count.inc(request.method, route, response.status_code)
+        if response.status_code >= 500:
+            request_errors.inc(request.method, route)
+    return response
+
+@api.teardown_app_request
+def finish_request(error):
+    """Count the request out of the in-flight gauge"""
+    # Streamed responses (stream_with_context) tear the request down again
+    # when the stream ends; count it out only once
+    if g.pop('in_flight', False):
+        requests_in_flight.dec()
+    # A request that failed before its response was stored releases its key
+    entry = g.pop('idempotency_entry', None)
+    if entry is not None:
+        idempotency_cache.abandon(entry)
+
+# Registered before commit_store so that only committed responses are kept
+@api.after_app_request
+def store_idempotent_response(response):
+    """Keep the response of a request made with an Idempotency-Key for replay"""
+    entry = g.pop('idempotency_entry', None)
+    if entry is not None:
+        if replayable(response.status_code) and not response.is_streamed:
+            idempotency_cache.complete(
+                entry, response.status_code, stored_headers(response.headers), response.get_data())
+        else:
+            idempotency_cache.abandon(entry)
+    return response
+
+@api.after_app_request
+def commit_store(response):
+    """Commit the request's writes, or roll them back on errors"""
+    if response.status_code >= 400:
+        store.rollback()
+        return response
+    try:
+        stamped = commit_writes()
+    except JournalError as e:
+        # Applied in memory but not on disk; the client must not take it as saved
+        current_app.logger.error("Commit failed: %s", e)
+        return make_response(jsonify({"error": "The change could not be saved"}), 500)
+    if stamped:
+        # Encode the body again so its records show their committed versions
+        source = getattr(response, 'json_source', None)
+        if source is not None:
+            response.set_data(dumps(source) + b"\n")
+    return response
+
+# Helper to look up a payment and hold its workorder lock while it is updated
+@contextmanager
+def locked_payment(payment_id):
+    payment = store.get_payment(payment_id)
+    if not payment:
+        yield None
+        return
+    with store.lock(payment['workorder']):
+        # Re-read under the lock so checks see the latest state
+        yield store.get_payment(payment_id)
+
+# Helper decorator for Idempotency-Key support on mutating endpoints: the
+# first request with a key runs, and retries get its response replayed.
+# With `streamed=True` (uploads parsed from request.stream) the body is
+# hashed while the view reads it instead of being buffered up front.
+def idempotent(view=None, streamed=False):
+    if view is None:
+        return lambda view: idempotent(view, streamed)
+    
+    def mismatch_response():
+        return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key.strip() or len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}), 400
+        
+        fingerprint = None if streamed else request_fingerprint(request.get_data())
+        try:
+            entry, execute = idempotency_cache.begin(f"{request.method} {request.path} {key}", fingerprint)
+        except IdempotencyMismatch:
+            return mismatch_response()
+        except IdempotencyInProgress:
+            return jsonify({"error": "A request with this Idempotency-Key is still being processed"}), 409
+        
+        if not execute:
+            if streamed and stream_fingerprint(request.stream) != entry.fingerprint:
+                return mismatch_response()
+            status, headers, body = entry.response
+            response = current_app.response_class(body, status=status, headers=headers)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        g.idempotency_entry = entry
+        if not streamed:
+            return view(*args, **kwargs)
+        
+        # The view parses the upload from request.stream, which now hashes it
+        reader = HashingReader(request.stream)
+        request.stream = reader
+        try:
+            return view(*args, **kwargs)
+        finally:
+            entry.fingerprint = reader.finish()
+    return wrapper
+
+# Helper function to read a field of the JSON body before the handler runs
+def body_field(name):
+    def field(kwargs):
+        data = request.get_json(silent=True)
+        value = data.get(name) if isinstance(data, dict) else None
+        return str(value).strip() if value else None
+    return field
+
+# Helper decorator for the public worker-facing endpoints: token buckets per
+# client IP and worker phone (`phone_of` reads it from the request), then the
+# cap on concurrent worker requests. Bursts are answered at once with 429 or
+# 503 and Retry-After, before they take the threads the admin endpoints need.
+def worker_limited(phone_of, login=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            reason, wait = limiter.check(request.remote_addr, phone_of(kwargs), login)
+            if reason:
+                response = jsonify({"error": "Too many requests, please retry later"})
+                response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+                return response, 429
+            if not limiter.admit():
+                response = jsonify({"error": "Server is busy, please retry shortly"})
+                response.headers['Retry-After'] = str(OVERLOAD_RETRY_AFTER)
+                return response, 503
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
+
+# Helper function to answer a write that lost a race with another request
+def conflict_response():
+    return jsonify({"error": "The record was changed by another request, please retry"}), 409
+
+# Helper function to copy worker-side updates into the payments that
+# allocate the worker on the workorder
+def mirror_to_allocations(worker_phone, workorder, **fields):
+    for payment in store.payments_allocated_to(worker_phone, workorder):
+        for worker in payment['workers']:
+            if worker['phone'] == worker_phone:
+                worker.update(fields)
+        store.save_payment(payment)
 
 # Helper function to find worker payment record
 def find_worker_payment(worker_phone, workorder):
-    for wp in worker_payments:
-        if wp['worker_phone'] == worker_phone and wp['workorder'] == workorder:
-            return wp
-    return None
+    return store.find_worker_payment(worker_phone, workorder)
 
 # Helper function to update or create worker payment record
 def update_worker_payment(worker_phone, worker_name, workorder, contractor, **kwargs):
@@ -43,6 +304,7 @@ def update_worker_payment(worker_phone, worker_name, workorder, contractor, **kw
         for key, value in kwargs.items():
             wp[key] = value
         wp['updated_at'] = datetime.now().isoformat()
+        store.save_worker_payment(wp)
     else:
         # Create new record
         new_wp = {
@@ -57,20 +319,145 @@ def update_worker_payment(worker_phone, worker_name, workorder, contractor, **kw
             'created_at': datetime.now().isoformat(),
             'updated_at': datetime.now().isoformat()
         }
-        worker_payments.append(new_wp)
+        store.add_worker_payment(new_wp)
+
+# Helper function to validate payment creation data; returns (fields, error)
+def validate_payment_data(data):
+    workorder = data.get('workorder', '')
+    contractor = data.get('contractor', '')
+    amount = data.get('amount')
+    
+    if not isinstance(workorder, str) or not workorder.strip():
+        return None, "WorkOrder is required"
+    if not isinstance(contractor, str) or not contractor.strip():
+        return None, "Contractor name is required"
+    if not amount or isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        return None, "Valid amount is required"
+    
+    return (workorder.strip(), contractor.strip(), amount), None
+
+# Helper function to create and store a new payment
+def create_payment_record(workorder, contractor, amount):
+    # The store assigns the payment ID
+    payment = {
+        "workorder": workorder,
+        "contractor": contractor,
+        "amount": float(amount),
+        "allocated": False,
+        "workers": [],
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat()
+    }
+    
+    store.add_payment(payment)
+    notify('payment_created', payment, contractor)
+    return payment
+
+# Helper function to validate a worker allocation list; returns an error or None
+def validate_workers(workers):
+    if not isinstance(workers, list) or len(workers) == 0:
+        return "At least one worker is required"
+    
+    for worker in workers:
+        if not isinstance(worker, dict):
+            return "Invalid worker data format"
+        if not isinstance(worker.get('name', ''), str) or not worker.get('name', '').strip():
+            return "Worker name is required"
+        if not isinstance(worker.get('phone', ''), str) or not worker.get('phone', '').strip():
+            return "Worker phone is required"
+        # Normalize promised_amount if provided
+        if 'promised_amount' in worker:
+            try:
+                worker['promised_amount'] = float(worker.get('promised_amount') or 0)
+            except (TypeError, ValueError):
+                return "Valid promised amount is required"
+    return None
+
+# Helper function to allocate a payment to validated workers
+def allocate_workers(payment, workers):
+    # Update payment with worker allocations and work status
+    payment['workers'] = workers
+    payment['allocated'] = True
+    payment['work_status'] = 'assigned'  # assigned -> in_progress -> completed
+    payment['updated_at'] = datetime.now().isoformat()
+    store.save_payment(payment)
+    
+    # Create initial worker payment records
+    for worker in workers:
+        update_worker_payment(
+            worker['phone'], worker['name'], payment['workorder'], 
+            payment['contractor'], payment_status='allocated',
+            promised_amount=worker.get('promised_amount', 0),
+            work_status='assigned'
+        )
+    
+    notify('payment_allocated', payment, payment['contractor'],
+           [worker['phone'] for worker in workers])
+
+# Helper function to build a list response with its next-page cursor. Long
+# lists, and any list requested as NDJSON, are streamed in chunks.
+def list_response(records, next_cursor=None):
+    if wants_ndjson(request.accept_mimetypes):
+        response = Response(iter_ndjson(records), mimetype=NDJSON_MIMETYPE)
+    elif len(records) > STREAM_MIN_RECORDS:
+        response = Response(iter_json_array(records), mimetype='application/json')
+    else:
+        response = jsonify(records)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response, 200
+
+# Helper function to answer conditional GETs from the store's change versions.
+# The ETag combines the scope's version with the request URL (filters and
+# projection) and Accept header (JSON or NDJSON), so an unchanged scope is
+# answered with 304 before `build` runs. With `cached`, bodies that are not
+# streamed are kept in the response cache until the scope changes, keyed by
+# the scope rather than the URL so spellings of a contractor name share them.
+def versioned_response(scope, build, cached=False):
+    version, last_modified = store.get_version(scope)
+    variant = f"{request.full_path}|{request.headers.get('Accept', '')}"
+    etag = f"{version}-{zlib.crc32(variant.encode()):08x}"
+    
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        cache_variant = f"{request.query_string.decode()}|{request.headers.get('Accept', '')}"
+        hit = response_cache.get(scope, cache_variant, version) if cached else None
+        if hit is not None:
+            body, mimetype = hit
+            response = current_app.response_class(body, mimetype=mimetype)
+        else:
+            response = make_response(build())
+            if response.status_code != 200:
+                return response
+            if cached and not response.is_streamed:
+                response_cache.put(scope, cache_variant, version, response.get_data(), response.mimetype)
+    
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    response.headers['X-Version'] = str(version)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let browsers cache the body but revalidate it on every fetch
+    response.cache_control.no_cache = True
+    return response
 
-# Static file routes
-@app.route('/')
+# Static file routes, answered from the assets loaded at startup
+@api.route('/')
 def serve_index():
     """Serve the main index.html file"""
-    return send_from_directory('.', 'index.html')
+    return serve_static('index.html')
 
-@app.route('/<path:filename>')
+@api.route('/<path:filename>')
 def serve_static(filename):
     """Serve static files (CSS, JS, images)"""
-    return send_from_directory('.', filename)
+    response = static_assets.response(filename, request)
+    if response is None:
+        abort(404)
+    return response
 
-@app.route('/api/admin/payments', methods=['POST'])
+@api.route('/api/admin/payments', methods=['POST'])
+@idempotent
 def create_payment():
     """Create a new payment entry"""
     try:
@@ -78,34 +465,15 @@ def create_payment():
         
         if not data:
             return jsonify({"error": "No data provided"}), 400
-            
-        workorder = data.get('workorder', '').strip()
-        contractor = data.get('contractor', '').strip()
-        amount = data.get('amount')
         
         # Validation
-        if not workorder:
-            return jsonify({"error": "WorkOrder is required"}), 400
-        if not contractor:
-            return jsonify({"error": "Contractor name is required"}), 400
-        if not amount or not isinstance(amount, (int, float)) or amount <= 0:
-            return jsonify({"error": "Valid amount is required"}), 400
+        fields, error = validate_payment_data(data)
+        if error:
+            return jsonify({"error": error}), 400
+        workorder, contractor, amount = fields
         
         # Create new payment record
-        payment = {
-            "id": generate_payment_id(),
-            "workorder": workorder,
-            "contractor": contractor,
-            "amount": float(amount),
-            "allocated": False,
-            "workers": [],
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        payments_data.append(payment)
-        
-        app.logger.info(f"Payment created: ID {payment['id']}, WorkOrder: {workorder}, Contractor: {contractor}, Amount: {amount}")
+        payment = create_payment_record(workorder, contractor, amount)
         
         return jsonify({
             "message": f"Payment created successfully for {contractor}",
@@ -114,21 +482,30 @@ def create_payment():
         }), 201
         
     except Exception as e:
-        app.logger.error(f"Error creating payment: {str(e)}")
+        current_app.logger.error(f"Error creating payment: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/admin/payments', methods=['GET'])
+@api.route('/api/admin/payments', methods=['GET'])
 def get_all_payments():
-    """Retrieve all payment records"""
+    """Retrieve payment records, optionally filtered, sorted, paginated and projected"""
     try:
-        app.logger.info(f"Retrieving {len(payments_data)} payments")
-        return jsonify(payments_data), 200
+        query = parse_list_query(request.args, PAYMENT_STATUSES)
+        
+        def build():
+            payments, next_cursor = store.query_payments(query)
+            current_app.logger.info("Retrieving %s payments", len(payments))
+            return list_response(project(payments, parse_fields(request.args)), next_cursor)
+        
+        return versioned_response(GLOBAL_SCOPE, build)
         
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"Error retrieving payments: {str(e)}")
+        current_app.logger.error(f"Error retrieving payments: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/admin/payments/<int:payment_id>/record-payments', methods=['POST'])
+@api.route('/api/admin/payments/<int:payment_id>/record-payments', methods=['POST'])
+@idempotent
 def record_actual_payments(payment_id):
     """Record actual payments made to workers"""
     try:
@@ -139,85 +516,165 @@ def record_actual_payments(payment_id):
             
         worker_payment_records = data['worker_payments']
         
-        # Find the payment
-        payment = None
-        for p in payments_data:
-            if p['id'] == payment_id:
-                payment = p
-                break
+        # Find the payment and lock its workorder while updating it
+        with locked_payment(payment_id) as payment:
                 
-        if not payment:
-            return jsonify({"error": "Payment not found"}), 404
+            if not payment:
+                return jsonify({"error": "Payment not found"}), 404
             
-        if not payment['allocated']:
-            return jsonify({"error": "Payment not allocated to workers yet"}), 400
+            if not payment['allocated']:
+                return jsonify({"error": "Payment not allocated to workers yet"}), 400
             
-        if payment.get('work_status') != 'completed':
-            return jsonify({"error": "Work must be completed before recording payments"}), 400
-        
-        # Update payment workers with actual amounts
-        for wp_record in worker_payment_records:
-            worker_phone = wp_record.get('worker_phone')
-            worker_name = wp_record.get('worker_name')
-            promised_amount = wp_record.get('promised_amount', 0)
-            actual_paid = wp_record.get('actual_paid', 0)
-            
-            # Update the worker in the payment record
+            if payment.get('work_status') != 'completed':
+                return jsonify({"error": "Work must be completed before recording payments"}), 400
+        
+            # Index the allocated workers by phone (first allocation wins)
+            workers_by_phone = {}
             for worker in payment['workers']:
-                if worker['phone'] == worker_phone:
+                workers_by_phone.setdefault(worker['phone'], worker)
+        
+            # Update payment workers with actual amounts
+            for wp_record in worker_payment_records:
+                worker_phone = wp_record.get('worker_phone')
+                worker_name = wp_record.get('worker_name')
+                promised_amount = wp_record.get('promised_amount', 0)
+                actual_paid = wp_record.get('actual_paid', 0)
+            
+                # Update the worker in the payment record
+                worker = workers_by_phone.get(worker_phone)
+                if worker:
                     worker['promised_amount'] = promised_amount
                     worker['actual_paid'] = actual_paid
                     worker['payment_status'] = 'pending'
-                    break
             
-            # Update or create worker payment record
-            update_worker_payment(
-                worker_phone, worker_name, payment['workorder'], payment['contractor'],
-                promised_amount=promised_amount, actual_paid=actual_paid, payment_status='pending'
-            )
+                # Update or create worker payment record
+                update_worker_payment(
+                    worker_phone, worker_name, payment['workorder'], payment['contractor'],
+                    promised_amount=promised_amount, actual_paid=actual_paid, payment_status='pending'
+                )
         
-        payment['updated_at'] = datetime.now().isoformat()
+            payment['updated_at'] = datetime.now().isoformat()
+            store.save_payment(payment)
         
-        app.logger.info(f"Recorded actual payments for payment {payment_id}")
+            notify('payments_recorded', payment, payment['contractor'],
+                   [wp_record.get('worker_phone') for wp_record in worker_payment_records])
         
-        return jsonify({
-            "message": f"Payment records updated for {len(worker_payment_records)} workers",
-            "payment": payment
-        }), 200
+            return jsonify({
+                "message": f"Payment records updated for {len(worker_payment_records)} workers",
+                "payment": payment
+            }), 200
         
+    except StoreConflict:
+        return conflict_response()
     except Exception as e:
-        app.logger.error(f"Error recording actual payments: {str(e)}")
+        current_app.logger.error(f"Error recording actual payments: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/admin/worker-payments', methods=['GET'])
+@api.route('/api/admin/worker-payments', methods=['GET'])
 def get_all_worker_payments():
-    """Get all worker payment records for admin view"""
+    """Get worker payment records for admin view, optionally filtered, sorted, paginated and projected"""
     try:
-        app.logger.info(f"Retrieving {len(worker_payments)} worker payment records")
-        return jsonify(worker_payments), 200
+        query = parse_list_query(request.args, WORKER_PAYMENT_STATUSES, allow_worker_phone=True)
         
+        def build():
+            records, next_cursor = store.query_worker_payments(query)
+            current_app.logger.info("Retrieving %s worker payment records", len(records))
+            return list_response(project(records, parse_fields(request.args)), next_cursor)
+        
+        return versioned_response(GLOBAL_SCOPE, build)
+        
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving worker payments: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@api.route('/api/admin/summary', methods=['GET'])
+def get_summary():
+    """Reconciliation totals overall and per contractor, or for one contractor"""
+    try:
+        contractor = request.args.get('contractor')
+
+        def build():
+            if contractor is not None:
+                summary = store.summary(contractor)
+                if summary is None:
+                    return jsonify({"error": "Contractor not found"}), 404
+                return jsonify(summary), 200
+            return jsonify({
+                "totals": store.summary(),
+                "contractors": store.contractor_summaries()
+            }), 200
+
+        # Worker payment writes do not touch the contractor scope, so any
+        # write may change any contractor's totals
+        return versioned_response(GLOBAL_SCOPE, build)
+
     except Exception as e:
-        app.logger.error(f"Error retrieving worker payments: {str(e)}")
+        current_app.logger.error(f"Error building summary: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/payments/contractor/<contractor_name>', methods=['GET'])
+@api.route('/api/admin/discrepancies', methods=['GET'])
+def get_discrepancies():
+    """Open payment discrepancies, largest shortfall first, optionally for one contractor"""
+    try:
+        query = parse_discrepancy_query(request.args)
+
+        def build():
+            entries, next_cursor = store.discrepancies(query)
+            records = [dict(record, shortfall=shortfall) for shortfall, record in entries]
+            return list_response(project(records, parse_fields(request.args)), next_cursor)
+
+        return versioned_response(GLOBAL_SCOPE, build)
+
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving discrepancies: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@api.route('/api/admin/export/ledger', methods=['GET'])
+def export_ledger_file():
+    """Stream the payment ledger (one row per payment and worker) as CSV, NDJSON, columnar or Parquet"""
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+        if export_format == 'parquet' and not parquet_available():
+            return jsonify({"error": "Parquet export is not available on this server"}), 400
+        query = parse_list_query(request.args, PAYMENT_STATUSES)
+        
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        current_app.logger.info("Exporting ledger as %s", export_format)
+        response = Response(stream_with_context(export_ledger(store, query, export_format)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="ledger.{extension}"'
+        return response
+        
+    except ListQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error exporting ledger: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@api.route('/api/payments/contractor/<contractor_name>', methods=['GET'])
 def get_contractor_payments(contractor_name):
     """Get payments for a specific contractor"""
     try:
         contractor_name = contractor_name.strip().lower()
-        contractor_payments = [
-            payment for payment in payments_data 
-            if payment['contractor'].lower() == contractor_name
-        ]
         
-        app.logger.info(f"Found {len(contractor_payments)} payments for contractor: {contractor_name}")
-        return jsonify(contractor_payments), 200
+        def build():
+            contractor_payments = store.payments_for_contractor(contractor_name)
+            current_app.logger.info("Found %s payments for contractor: %s", len(contractor_payments), contractor_name)
+            return list_response(contractor_payments)
+        
+        return versioned_response(contractor_scope(contractor_name), build, cached=True)
         
     except Exception as e:
-        app.logger.error(f"Error retrieving contractor payments: {str(e)}")
+        current_app.logger.error(f"Error retrieving contractor payments: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/payments/<int:payment_id>/allocate', methods=['POST'])
+@api.route('/api/payments/<int:payment_id>/allocate', methods=['POST'])
+@idempotent
 def allocate_payment_to_workers(payment_id):
     """Allocate a payment to workers with specific amounts"""
     try:
@@ -230,97 +687,326 @@ def allocate_payment_to_workers(payment_id):
         if not isinstance(workers, list) or len(workers) == 0:
             return jsonify({"error": "At least one worker is required"}), 400
         
-        # Find the payment
-        payment = None
-        for p in payments_data:
-            if p['id'] == payment_id:
-                payment = p
-                break
+        # Find the payment and lock its workorder while updating it
+        with locked_payment(payment_id) as payment:
                 
-        if not payment:
-            return jsonify({"error": "Payment not found"}), 404
+            if not payment:
+                return jsonify({"error": "Payment not found"}), 404
             
-        # Validate worker data and amounts
-        for worker in workers:
-            if not isinstance(worker, dict):
-                return jsonify({"error": "Invalid worker data format"}), 400
-            if not worker.get('name', '').strip():
-                return jsonify({"error": "Worker name is required"}), 400
-            if not worker.get('phone', '').strip():
-                return jsonify({"error": "Worker phone is required"}), 400
-            # Add promised_amount to worker data if provided
-            if 'promised_amount' in worker:
-                worker['promised_amount'] = float(worker.get('promised_amount', 0))
-        
-        # Update payment with worker allocations and work status
-        payment['workers'] = workers
-        payment['allocated'] = True
-        payment['work_status'] = 'assigned'  # assigned -> in_progress -> completed
-        payment['updated_at'] = datetime.now().isoformat()
-        
-        # Create initial worker payment records
-        for worker in workers:
-            update_worker_payment(
-                worker['phone'], worker['name'], payment['workorder'], 
-                payment['contractor'], payment_status='allocated',
-                promised_amount=worker.get('promised_amount', 0),
-                work_status='assigned'
-            )
+            # Validate worker data and amounts
+            error = validate_workers(workers)
+            if error:
+                return jsonify({"error": error}), 400
         
-        app.logger.info(f"Payment {payment_id} allocated to {len(workers)} workers")
+            allocate_workers(payment, workers)
         
-        return jsonify({
-            "message": f"Payment allocated to {len(workers)} workers successfully",
-            "payment": payment
-        }), 200
+            return jsonify({
+                "message": f"Payment allocated to {len(workers)} workers successfully",
+                "payment": payment
+            }), 200
         
+    except StoreConflict:
+        return conflict_response()
     except Exception as e:
-        app.logger.error(f"Error allocating payment: {str(e)}")
+        current_app.logger.error(f"Error allocating payment: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/payments/<int:payment_id>/mark-complete', methods=['POST'])
+@api.route('/api/payments/<int:payment_id>/mark-complete', methods=['POST'])
+@idempotent
 def mark_work_complete(payment_id):
     """Mark work as completed for a payment"""
     try:
-        # Find the payment
-        payment = None
-        for p in payments_data:
-            if p['id'] == payment_id:
-                payment = p
-                break
+        # Find the payment and lock its workorder while updating it
+        with locked_payment(payment_id) as payment:
                 
-        if not payment:
-            return jsonify({"error": "Payment not found"}), 404
+            if not payment:
+                return jsonify({"error": "Payment not found"}), 404
             
-        if not payment['allocated']:
-            return jsonify({"error": "Payment not allocated to workers yet"}), 400
+            if not payment['allocated']:
+                return jsonify({"error": "Payment not allocated to workers yet"}), 400
         
-        # Update work status to completed
-        payment['work_status'] = 'completed'
-        payment['completed_at'] = datetime.now().isoformat()
-        payment['updated_at'] = datetime.now().isoformat()
+            # Update work status to completed
+            payment['work_status'] = 'completed'
+            payment['completed_at'] = datetime.now().isoformat()
+            payment['updated_at'] = datetime.now().isoformat()
+            store.save_payment(payment)
         
-        # Update worker payment records
-        for worker in payment['workers']:
-            update_worker_payment(
-                worker['phone'], worker['name'], payment['workorder'], 
-                payment['contractor'], work_status='completed'
-            )
+            # Update worker payment records
+            for worker in payment['workers']:
+                update_worker_payment(
+                    worker['phone'], worker['name'], payment['workorder'], 
+                    payment['contractor'], work_status='completed'
+                )
+        
+            notify('work_completed', payment, payment['contractor'],
+                   [worker['phone'] for worker in payment['workers']])
         
-        app.logger.info(f"Work marked as completed for payment {payment_id}")
+            return jsonify({
+                "message": "Work marked as completed. You can now make payments to workers.",
+                "payment": payment
+            }), 200
+        
+    except StoreConflict:
+        return conflict_response()
+    except Exception as e:
+        current_app.logger.error(f"Error marking work complete: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+# Helper function to build the summary of a bulk upload
+def bulk_response(results, succeeded, started, stopped_at=None):
+    elapsed = time.perf_counter() - started
+    rows_per_second = round(len(results) / elapsed, 1) if elapsed > 0 else None
+    
+    message = f"Processed {len(results)} rows: {succeeded} succeeded, {len(results) - succeeded} failed"
+    body = {
+        "message": message,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": rows_per_second,
+        "results": results
+    }
+    if stopped_at is not None:
+        body["message"] = f"{message}; processing stopped at row {stopped_at}, later rows were not read"
+        body["stopped_at_row"] = stopped_at
+    return jsonify(body), 200
+
+# Helper function to tell whether any row of a bulk upload is already saved:
+# rows up to `committed` on a transactional store, every processed row on
+# the in-memory store, which applies writes immediately
+def bulk_saved(results, committed):
+    saved = results[:committed] if store.transactional else results
+    return any(result["status"] != "error" for result in saved)
+
+# Helper function to end a bulk upload that failed part-way, once some rows
+# are saved. Rows of the failed chunk that a rollback discards are reported
+# as errors, as is the row being processed, so the client can resubmit
+# exactly the rows that are missing. Returns the number of saved rows.
+def stop_bulk(results, committed, row_number, error):
+    if isinstance(error, StoreConflict):
+        message = "The record was changed by another request"
+    else:
+        current_app.logger.error(f"Bulk upload failed at row {row_number}: {str(error)}")
+        message = "Internal server error"
+    
+    if store.transactional:
+        store.rollback()
+        g.pop('pending_events', None)
+        for index in range(committed, len(results)):
+            if results[index]["status"] != "error":
+                results[index] = {"row": results[index]["row"], "status": "error",
+                                  "error": f"Not saved: {message}"}
+    if row_number is not None and (not results or results[-1]["row"] != row_number):
+        results.append({"row": row_number, "status": "error", "error": message})
+    return sum(1 for result in results if result["status"] != "error")
+
+@api.route('/api/admin/payments/bulk', methods=['POST'])
+@idempotent(streamed=True)
+def bulk_create_payments():
+    """Create payments from a streamed CSV (workorder,contractor,amount) or NDJSON upload"""
+    try:
+        fmt = upload_format(request.mimetype)
+        if not fmt:
+            return jsonify({"error": "Upload must be text/csv or application/x-ndjson"}), 415
+        
+        started = time.perf_counter()
+        results = []
+        created = 0
+        # Results before this index are committed
+        committed = 0
+        row_number = None
+        
+        try:
+            for row_number, row in iter_rows(request.stream, fmt, numeric_fields=('amount',)):
+                if isinstance(row, RowError):
+                    results.append({"row": row_number, "status": "error", "error": row.message})
+                    continue
+                
+                fields, error = validate_payment_data(row)
+                if error:
+                    results.append({"row": row_number, "status": "error", "error": error})
+                    continue
+                
+                payment = create_payment_record(*fields)
+                results.append({"row": row_number, "status": "created", "payment_id": payment['id']})
+                created += 1
+                
+                # Commit in chunks so a large upload is not one long transaction
+                if created % CHUNK_SIZE == 0:
+                    commit_writes()
+                    committed = len(results)
+            
+            if not results:
+                return jsonify({"error": "No rows provided"}), 400
+            
+            # Commit the last chunk here, so a failure is reported per row too
+            commit_writes()
+        except Exception as e:
+            if not bulk_saved(results, committed):
+                raise
+            created = stop_bulk(results, committed, row_number, e)
+            return bulk_response(results, created, started, stopped_at=row_number)
+        
+        current_app.logger.info("Bulk created %s of %s payments", created, len(results))
+        
+        return bulk_response(results, created, started)
+        
+    except StoreConflict:
+        return conflict_response()
+    except Exception as e:
+        current_app.logger.error(f"Error in bulk payment creation: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@api.route('/api/payments/bulk-allocate', methods=['POST'])
+@idempotent(streamed=True)
+def bulk_allocate_payments():
+    """Allocate payments to workers from a streamed CSV or NDJSON upload
+
+    CSV uploads have one row per worker (payment_id,name,phone,promised_amount);
+    NDJSON uploads have one {"payment_id": ..., "workers": [...]} object per line.
+    """
+    try:
+        fmt = upload_format(request.mimetype)
+        if not fmt:
+            return jsonify({"error": "Upload must be text/csv or application/x-ndjson"}), 415
+        
+        started = time.perf_counter()
+        results = []
+        allocated = 0
+        # Results before this index are committed
+        committed = 0
+        row_number = None
+        
+        try:
+            rows = iter_rows(request.stream, fmt, numeric_fields=('payment_id', 'promised_amount'))
+            for row_number, allocation in iter_allocations(rows):
+                if isinstance(allocation, RowError):
+                    results.append({"row": row_number, "status": "error", "error": allocation.message})
+                    continue
+                
+                workers = allocation.get('workers')
+                error = validate_workers(workers)
+                if error:
+                    results.append({"row": row_number, "status": "error", "error": error})
+                    continue
+                
+                payment_id = allocation.get('payment_id')
+                with locked_payment(payment_id if isinstance(payment_id, int) else None) as payment:
+                    if not payment:
+                        results.append({"row": row_number, "status": "error", "error": "Payment not found"})
+                        continue
+                    allocate_workers(payment, workers)
+                
+                results.append({"row": row_number, "status": "allocated", "payment_id": payment_id,
+                                "workers": len(workers)})
+                allocated += 1
+                
+                if allocated % CHUNK_SIZE == 0:
+                    commit_writes()
+                    committed = len(results)
+            
+            if not results:
+                return jsonify({"error": "No rows provided"}), 400
+            
+            # Commit the last chunk here, so a failure is reported per row too
+            commit_writes()
+        except Exception as e:
+            if not bulk_saved(results, committed):
+                raise
+            allocated = stop_bulk(results, committed, row_number, e)
+            return bulk_response(results, allocated, started, stopped_at=row_number)
+        
+        current_app.logger.info("Bulk allocated %s of %s payments", allocated, len(results))
+        
+        return bulk_response(results, allocated, started)
+        
+    except StoreConflict:
+        return conflict_response()
+    except Exception as e:
+        current_app.logger.error(f"Error in bulk allocation: {str(e)}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@api.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Get payments and worker payment records changed since a version"""
+    try:
+        since = request.args.get('since', type=int)
+        limit = request.args.get('limit', type=int)
+        contractor = request.args.get('contractor')
+        
+        if since is None or since < 0:
+            return jsonify({"error": "A non-negative since version is required"}), 400
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        
+        try:
+            payments, records, version, has_more = store.changes_since(since, limit, contractor)
+        except ChangesExpired:
+            current, _ = store.get_version()
+            return jsonify({
+                "error": "Changes since this version are no longer available, reload the full lists",
+                "version": current
+            }), 410
+        
+        current_app.logger.info("Found %s payment and %s worker payment changes since %s", len(payments), len(records), since)
         
         return jsonify({
-            "message": "Work marked as completed. You can now make payments to workers.",
-            "payment": payment
+            "version": version,
+            "has_more": has_more,
+            "payments": payments,
+            "worker_payments": records
         }), 200
         
     except Exception as e:
-        app.logger.error(f"Error marking work complete: {str(e)}")
+        current_app.logger.error(f"Error retrieving changes: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+@api.route('/api/events', methods=['GET'])
+def stream_events():
+    """Stream payment and verification status changes as Server-Sent Events
+
+    Without parameters the stream carries every event (admin view);
+    `contractor=<name>` or `phone=<worker phone>` narrows it to that scope.
+    Under the ASGI worker the body is sent from its event loop (asgi.py), so
+    the stream holds no thread; elsewhere it is served by this thread.
+    When every stream slot is taken the client is answered with 503.
+    """
+    contractor = request.args.get('contractor', '').strip()
+    phone = request.args.get('phone', '').strip()
+    
+    if contractor and phone:
+        return jsonify({"error": "Use either contractor or phone, not both"}), 400
+    if contractor:
+        scope = contractor_scope(contractor)
+    elif phone:
+        scope = phone_scope(phone)
+    else:
+        scope = GLOBAL_SCOPE
+    
+    loop = request.environ.get(EVENT_LOOP_KEY)
+    subscription = broadcaster.subscribe(scope, loop)
+    if subscription is None:
+        response = jsonify({"error": "Too many open event streams, try again later"})
+        response.headers['Retry-After'] = str(STREAM_RETRY_AFTER)
+        return response, 503
+    current_app.logger.info("Event stream opened for %s", scope)
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if loop is not None:
+        # Only the headers go through WSGI; the ASGI adapter sends the body
+        request.environ[EVENT_STREAM_KEY] = broadcaster.stream_async(subscription)
+        return Response(iter(()), mimetype='text/event-stream', headers=headers)
+    
+    response = Response(broadcaster.stream(subscription), mimetype='text/event-stream', headers=headers)
+    # Free the slot even if the client goes away before the stream starts
+    unsubscribe = broadcaster.unsubscribe
+    response.call_on_close(lambda: unsubscribe(subscription))
+    return response
+
 # Worker Authentication and Payment APIs
 
-@app.route('/api/worker/login', methods=['POST'])
+@api.route('/api/worker/login', methods=['POST'])
+@worker_limited(body_field('phone'), login=True)
 def worker_login():
     """Simple worker authentication using phone and name"""
     try:
@@ -335,21 +1021,11 @@ def worker_login():
         if not phone or not name:
             return jsonify({"error": "Phone and name are required"}), 400
         
-        # Check if worker exists in any payment allocation
-        worker_found = False
-        for payment in payments_data:
-            if payment['allocated']:
-                for worker in payment['workers']:
-                    if worker['phone'] == phone and worker['name'].lower() == name.lower():
-                        worker_found = True
-                        break
-                if worker_found:
-                    break
-        
-        if not worker_found:
+        # Check if worker exists in any payment allocation (worker directory lookup)
+        if not store.is_allocated_worker(phone, name):
             return jsonify({"error": "Worker not found in any payment allocation"}), 404
         
-        app.logger.info(f"Worker login successful: {name} ({phone})")
+        current_app.logger.info("Worker login successful: %s (%s)", name, phone)
         
         return jsonify({
             "message": "Login successful",
@@ -357,27 +1033,30 @@ def worker_login():
         }), 200
         
     except Exception as e:
-        app.logger.error(f"Error in worker login: {str(e)}")
+        current_app.logger.error(f"Error in worker login: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/worker/<phone>/payments', methods=['GET'])
+@api.route('/api/worker/<phone>/payments', methods=['GET'])
+@worker_limited(lambda kwargs: kwargs['phone'].strip())
 def get_worker_payments(phone):
     """Get payment records for a specific worker"""
     try:
         phone = phone.strip()
-        worker_payment_records = [
-            wp for wp in worker_payments 
-            if wp['worker_phone'] == phone
-        ]
         
-        app.logger.info(f"Found {len(worker_payment_records)} payment records for worker: {phone}")
-        return jsonify(worker_payment_records), 200
+        def build():
+            worker_payment_records = store.worker_payments_for_phone(phone)
+            current_app.logger.info("Found %s payment records for worker: %s", len(worker_payment_records), phone)
+            return list_response(worker_payment_records)
+        
+        return versioned_response(phone_scope(phone), build, cached=True)
         
     except Exception as e:
-        app.logger.error(f"Error retrieving worker payments: {str(e)}")
+        current_app.logger.error(f"Error retrieving worker payments: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/worker/verify-payment', methods=['POST'])
+@api.route('/api/worker/verify-payment', methods=['POST'])
+@worker_limited(body_field('worker_phone'))
+@idempotent
 def verify_worker_payment():
     """Worker verifies that payment amount is correct"""
     try:
@@ -393,40 +1072,43 @@ def verify_worker_payment():
         if not worker_phone or not workorder:
             return jsonify({"error": "Worker phone and workorder are required"}), 400
         
-        # Find worker payment record
-        wp = find_worker_payment(worker_phone, workorder)
-        if not wp:
-            return jsonify({"error": "Payment record not found"}), 404
-        
-        # Update payment status
-        if verified:
-            wp['payment_status'] = 'verified'
-        else:
-            wp['payment_status'] = 'pending'
-        
-        wp['updated_at'] = datetime.now().isoformat()
-        
-        # Also update in the main payment record
-        for payment in payments_data:
-            if payment['workorder'] == workorder:
-                for worker in payment['workers']:
-                    if worker['phone'] == worker_phone:
-                        worker['payment_status'] = wp['payment_status']
-                        break
-                break
+        # Find worker payment record, locking its workorder while updating it
+        with store.lock(workorder):
+            wp = find_worker_payment(worker_phone, workorder)
+            if not wp:
+                return jsonify({"error": "Payment record not found"}), 404
+        
+            # Update payment status
+            if verified:
+                wp['payment_status'] = 'verified'
+            else:
+                wp['payment_status'] = 'pending'
+        
+            wp['updated_at'] = datetime.now().isoformat()
+            store.save_worker_payment(wp)
+        
+            # Also update every payment allocating this worker on the workorder
+            mirror_to_allocations(
+                worker_phone, workorder,
+                payment_status=wp['payment_status']
+            )
         
-        app.logger.info(f"Payment verification updated: {worker_phone} - {workorder} - {wp['payment_status']}")
+            notify('payment_verified', wp, wp['contractor'], [worker_phone])
         
-        return jsonify({
-            "message": f"Payment {'verified' if verified else 'marked as pending'}",
-            "payment_record": wp
-        }), 200
+            return jsonify({
+                "message": f"Payment {'verified' if verified else 'marked as pending'}",
+                "payment_record": wp
+            }), 200
         
+    except StoreConflict:
+        return conflict_response()
     except Exception as e:
-        app.logger.error(f"Error verifying payment: {str(e)}")
+        current_app.logger.error(f"Error verifying payment: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/worker/verify-payment-with-amount', methods=['POST'])
+@api.route('/api/worker/verify-payment-with-amount', methods=['POST'])
+@worker_limited(body_field('worker_phone'))
+@idempotent
 def verify_worker_payment_with_amount():
     """Worker verifies payment by entering actual received amount"""
     try:
@@ -446,42 +1128,45 @@ def verify_worker_payment_with_amount():
         if actual_received <= 0:
             return jsonify({"error": "Actual received amount must be greater than 0"}), 400
         
-        # Find worker payment record
-        wp = find_worker_payment(worker_phone, workorder)
-        if not wp:
-            return jsonify({"error": "Payment record not found"}), 404
-        
-        # Update payment record with actual received amount and verification
-        wp['actual_received_by_worker'] = actual_received
-        if verified:
-            wp['payment_status'] = 'verified'
-        else:
-            wp['payment_status'] = 'pending'
-        
-        wp['updated_at'] = datetime.now().isoformat()
-        
-        # Also update in the main payment record
-        for payment in payments_data:
-            if payment['workorder'] == workorder:
-                for worker in payment['workers']:
-                    if worker['phone'] == worker_phone:
-                        worker['payment_status'] = wp['payment_status']
-                        worker['actual_received_by_worker'] = actual_received
-                        break
-                break
+        # Find worker payment record, locking its workorder while updating it
+        with store.lock(workorder):
+            wp = find_worker_payment(worker_phone, workorder)
+            if not wp:
+                return jsonify({"error": "Payment record not found"}), 404
+        
+            # Update payment record with actual received amount and verification
+            wp['actual_received_by_worker'] = actual_received
+            if verified:
+                wp['payment_status'] = 'verified'
+            else:
+                wp['payment_status'] = 'pending'
+        
+            wp['updated_at'] = datetime.now().isoformat()
+            store.save_worker_payment(wp)
+        
+            # Also update every payment allocating this worker on the workorder
+            mirror_to_allocations(
+                worker_phone, workorder,
+                payment_status=wp['payment_status'],
+                actual_received_by_worker=actual_received
+            )
         
-        app.logger.info(f"Payment verified with amount: {worker_phone} - {workorder} - ₹{actual_received}")
+            notify('payment_verified', wp, wp['contractor'], [worker_phone])
         
-        return jsonify({
-            "message": f"Payment verified! Amount received: ₹{actual_received}",
-            "payment_record": wp
-        }), 200
+            return jsonify({
+                "message": f"Payment verified! Amount received: ₹{actual_received}",
+                "payment_record": wp
+            }), 200
         
+    except StoreConflict:
+        return conflict_response()
     except Exception as e:
-        app.logger.error(f"Error verifying payment with amount: {str(e)}")
+        current_app.logger.error(f"Error verifying payment with amount: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/worker/report-discrepancy', methods=['POST'])
+@api.route('/api/worker/report-discrepancy', methods=['POST'])
+@worker_limited(body_field('worker_phone'))
+@idempotent
 def report_payment_discrepancy():
     """Worker reports payment discrepancy"""
     try:
@@ -498,67 +1183,157 @@ def report_payment_discrepancy():
         if not worker_phone or not workorder:
             return jsonify({"error": "Worker phone and workorder are required"}), 400
         
-        # Find worker payment record
-        wp = find_worker_payment(worker_phone, workorder)
-        if not wp:
-            return jsonify({"error": "Payment record not found"}), 404
-        
-        # Update payment record with discrepancy
-        wp['payment_status'] = 'disputed'
-        wp['actual_received_by_worker'] = actual_received
-        wp['discrepancy_notes'] = notes
-        wp['discrepancy_reported_at'] = datetime.now().isoformat()
-        wp['updated_at'] = datetime.now().isoformat()
-        
-        # Also update in the main payment record
-        for payment in payments_data:
-            if payment['workorder'] == workorder:
-                for worker in payment['workers']:
-                    if worker['phone'] == worker_phone:
-                        worker['payment_status'] = 'disputed'
-                        worker['actual_received_by_worker'] = actual_received
-                        worker['discrepancy_notes'] = notes
-                        break
-                break
+        # Find worker payment record, locking its workorder while updating it
+        with store.lock(workorder):
+            wp = find_worker_payment(worker_phone, workorder)
+            if not wp:
+                return jsonify({"error": "Payment record not found"}), 404
+        
+            # Update payment record with discrepancy
+            wp['payment_status'] = 'disputed'
+            wp['actual_received_by_worker'] = actual_received
+            wp['discrepancy_notes'] = notes
+            wp['discrepancy_reported_at'] = datetime.now().isoformat()
+            wp['updated_at'] = datetime.now().isoformat()
+            store.save_worker_payment(wp)
+        
+            # Also update every payment allocating this worker on the workorder
+            mirror_to_allocations(
+                worker_phone, workorder,
+                payment_status='disputed',
+                actual_received_by_worker=actual_received,
+                discrepancy_notes=notes
+            )
         
-        app.logger.info(f"Payment discrepancy reported: {worker_phone} - {workorder}")
+            notify('payment_disputed', wp, wp['contractor'], [worker_phone])
         
-        return jsonify({
-            "message": "Payment discrepancy reported successfully. Admin will review this issue.",
-            "payment_record": wp
-        }), 200
+            return jsonify({
+                "message": "Payment discrepancy reported successfully. Admin will review this issue.",
+                "payment_record": wp
+            }), 200
         
+    except StoreConflict:
+        return conflict_response()
     except Exception as e:
-        app.logger.error(f"Error reporting discrepancy: {str(e)}")
+        current_app.logger.error(f"Error reporting discrepancy: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
         "service": "BCCL WPTS Backend",
         "timestamp": datetime.now().isoformat(),
-        "payments_count": len(payments_data),
-        "worker_payments_count": len(worker_payments)
+        "payments_count": store.count_payments(),
+        "worker_payments_count": store.count_worker_payments(),
+        "response_cache": response_cache.stats(),
+        "worker_limits": limiter.stats()
     }), 200
 
-@app.errorhandler(404)
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, store and record-count metrics in the Prometheus text format"""
+    return Response(metrics.expose(), content_type=CONTENT_TYPE)
+
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Endpoint not found"}), 404
 
-@app.errorhandler(405)
+@api.app_errorhandler(405)
 def method_not_allowed(error):
     return jsonify({"error": "Method not allowed"}), 405
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
-    app.logger.error(f"Internal server error: {str(error)}")
+    current_app.logger.error(f"Internal server error: {str(error)}")
     return jsonify({"error": "Internal server error"}), 500
 
+def create_app(config=None):
+    """Create the Flask app with its store, event fan-out and static assets"""
+    config = config or load_config()
+    
+    # Log at LOG_LEVEL (WARNING in production). Handlers pass log arguments
+    # separately so messages below the level are never formatted.
+    logging.basicConfig(level=config.LOG_LEVEL)
+    logging.getLogger().setLevel(config.LOG_LEVEL)
+    
+    app = Flask(__name__, static_folder=None)
+    app.config.from_object(config)
+    # Client IPs for the rate limits from the proxies' X-Forwarded-For
+    if config.PROXY_COUNT:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_COUNT, x_proto=config.PROXY_COUNT)
+    # JSON encoding through serialization.py (orjson when installed)
+    app.json = JSONProvider(app)
+    app.secret_key = config.SECRET_KEY
+    if config.SECRET_KEY == DEVELOPMENT_SECRET_KEY and config.ENV_NAME == 'production':
+        app.logger.warning("SESSION_SECRET is not set; using the development secret key")
+    
+    # CORS for the configured origins (all in development)
+    CORS(app, origins=config.CORS_ORIGINS)
+    
+    # Storage backend: the indexed in-memory store for MVP, or a SQL database
+    # (SQLite locally, Postgres in production) when DATABASE_URL is set
+    if config.STORAGE_BACKEND == "sql":
+        # SQLAlchemy is only imported when the SQL backend is used
+        from models import db
+        from sql_store import SQLIdempotencyStore, SQLStore, engine_options
+        
+        database_url = config.DATABASE_URL or "sqlite:///wpts.db"
+        app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+            database_url, config.DB_POOL_SIZE, config.DB_MAX_OVERFLOW, config.DB_POOL_TIMEOUT)
+        db.init_app(app)
+        app_store = SQLStore(db.session, discrepancy_tolerance=config.DISCREPANCY_TOLERANCE)
+        with app.app_context():
+            app_store.create_schema()
+        # Keys in the database, so a retry is recognized by every worker
+        idempotency = SQLIdempotencyStore(config.IDEMPOTENCY_TTL)
+    else:
+        app_store = InMemoryStore(discrepancy_tolerance=config.DISCREPANCY_TOLERANCE)
+        # Optional crash safety for the in-memory store: restore from and
+        # journal to JOURNAL_DIR
+        if config.JOURNAL_DIR:
+            journal = open_journal(app_store, config.JOURNAL_DIR, sync_interval=config.JOURNAL_SYNC_INTERVAL,
+                                   snapshot_every=config.JOURNAL_SNAPSHOT_EVERY)
+            atexit.register(journal.close)
+        # The in-memory store is served by a single process (gunicorn.conf.py)
+        idempotency = IdempotencyCache(config.IDEMPOTENCY_TTL, config.IDEMPOTENCY_MAX_KEYS)
+    
+    # Time store operations into wpts_store_operation_duration_seconds
+    instrument_store(app_store, store_latency, (
+        'get_payment', 'find_worker_payment', 'payments_allocated_to', 'payments_for_contractor',
+        'worker_payments_for_phone', 'worker_payments_for_workorders', 'query_payments',
+        'query_worker_payments', 'discrepancies', 'changes_since', 'is_allocated_worker', 'summary',
+        'get_version', 'add_payment', 'save_payment', 'add_worker_payment', 'save_worker_payment',
+        'commit', 'rollback',
+    ))
+    
+    # Write events are logged, audited and notified off the request path;
+    # queued events are delivered on shutdown
+    bus = EventBus(default_sinks(config.EVENT_AUDIT_FILE, config.EVENT_NOTIFICATIONS),
+                   max_queued=config.EVENT_QUEUE_SIZE, workers=config.EVENT_WORKERS,
+                   batch_size=config.EVENT_BATCH_SIZE)
+    atexit.register(bus.close)
+    
+    app.extensions['wpts'] = {
+        'store': app_store,
+        'broadcaster': Broadcaster(max_subscribers=config.SSE_MAX_SUBSCRIBERS),
+        'events': bus,
+        'static_assets': StaticAssets(config.STATIC_DIR, config.STATIC_MAX_AGE),
+        'idempotency': idempotency,
+        'responses': ResponseCache(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_TTL),
+        'limiter': open_limiter(
+            config.RATE_LIMIT_REDIS_URL, ip_limit=config.RATE_LIMIT_IP, phone_limit=config.RATE_LIMIT_PHONE,
+            login_limit=config.RATE_LIMIT_LOGIN, max_concurrent=config.WORKER_MAX_CONCURRENT),
+    }
+    app.register_blueprint(api)
+    return app
+
 if __name__ == '__main__':
+    app = create_app()
     app.logger.info("Starting BCCL WPTS Backend API Server...")
-    app.logger.info(f"Server will be available at: http://127.0.0.1:5000")
+    app.logger.info("Server will be available at: http://127.0.0.1:5000")
     app.logger.info("API endpoints:")
     app.logger.info("  POST /api/admin/payments - Create payment")
     app.logger.info("  GET  /api/admin/payments - Get all payments")
@@ -572,4 +1347,4 @@ if __name__ == '__main__':
     app.logger.info("  POST /api/worker/report-discrepancy - Report payment discrepancy")
     app.logger.info("  GET  /api/health - Health check")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=app.debug)
@@ -0,0 +1,235 @@
+"""
+ASGI entry point: serves the Flask app from gunicorn's asyncio worker.
+
+Ordinary requests run the WSGI app on a bounded thread pool, reading the
+request body from and streaming the response to the event loop, so they
+behave exactly as under a threaded server. Event streams (`/api/events`)
+are different: the handler subscribes with the worker's event loop and
+leaves the body to an async stream (broadcast.py), which this adapter
+sends from the loop. An open stream therefore holds a socket and a small
+queue but no thread, and thousands of idle dashboards cost the pool
+nothing.
+
+The same object is also a plain WSGI app, so the development server and
+tests, which speak WSGI, keep working; they serve streams on threads.
+"""
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('wpts.asgi')
+
+# Environ keys shared with the event stream handler in app.py: the loop a
+# stream subscribes on, and the async body the handler leaves behind
+EVENT_LOOP_KEY = 'wpts.event_loop'
+EVENT_STREAM_KEY = 'wpts.event_stream'
+
+# Bytes read from the request body per receive on the pool's behalf
+READ_BUFFER_SIZE = 64 * 1024
+
+
+class RequestBody(io.RawIOBase):
+    """`wsgi.input` of a request thread, pulling body chunks from the event loop"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = b''
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                # The client went away; the body ends here
+                self._more = False
+                break
+            self._chunk = message.get('body', b'')
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+class ResponseWriter:
+    """WSGI `start_response` of a request thread, sending to the event loop"""
+
+    def __init__(self, send, loop):
+        self._send = send
+        self._loop = loop
+        self._start = None
+        self.status = None
+        self.started = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.status = int(status.split(' ', 1)[0])
+        self._start = {
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }
+        return self.write
+
+    def write(self, data):
+        if not self.started:
+            self._call(self._start)
+            self.started = True
+        if data:
+            self._call({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    def _call(self, message):
+        asyncio.run_coroutine_threadsafe(self._send(message), self._loop).result()
+
+
+class ASGIApp:
+    """Serves a Flask app over ASGI (or WSGI) without a thread per event stream"""
+
+    def __init__(self, app, threads=16):
+        self.app = app
+        self.threads = threads
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='wsgi')
+        return self._executor
+
+    def __call__(self, *args):
+        # (environ, start_response) from a WSGI server, (scope, receive, send)
+        # from an ASGI one
+        if len(args) == 2:
+            return self.app(*args)
+        return self.handle(*args)
+
+    async def handle(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, io.BufferedReader(RequestBody(receive, loop), READ_BUFFER_SIZE))
+        environ[EVENT_LOOP_KEY] = loop
+        writer = ResponseWriter(send, loop)
+        try:
+            await loop.run_in_executor(self.executor, self._run_wsgi, environ, writer)
+        except Exception:
+            stream = environ.pop(EVENT_STREAM_KEY, None)
+            if stream is not None:
+                await stream.aclose()
+            logger.exception("Unhandled error serving %s %s", scope['method'], scope['path'])
+            if not writer.started:
+                await send({'type': 'http.response.start', 'status': 500,
+                            'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Internal Server Error' if not writer.started else b''})
+            return
+        stream = environ.get(EVENT_STREAM_KEY)
+        if stream is not None:
+            if writer.status == 200:
+                await self._stream(stream, receive, send)
+            else:
+                # An error page replaced the stream after it was opened
+                await stream.aclose()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def _run_wsgi(self, environ, writer):
+        """Run the WSGI app on a pool thread; the loop ends the response afterwards"""
+        body = self.app(environ, writer.start_response)
+        try:
+            for chunk in body:
+                writer.write(chunk)
+            writer.write(b'')
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def _stream(self, stream, receive, send):
+        """Send an event stream from the loop until it ends or the client goes away"""
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            async for chunk in _until(stream, disconnected):
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        finally:
+            disconnected.cancel()
+            await stream.aclose()
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _until(stream, done):
+    """Items of an async iterator until the `done` future completes"""
+    while not done.done():
+        item = asyncio.ensure_future(stream.__anext__())
+        await asyncio.wait((item, done), return_when=asyncio.FIRST_COMPLETED)
+        if not item.done():
+            item.cancel()
+            return
+        try:
+            yield item.result()
+        except StopAsyncIteration:
+            return
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
@@ -0,0 +1,282 @@
+"""
+Load test of the API's payment workflow.
+
+Seeds a synthetic dataset through the API itself and measures every step of
+the workflow as one operation: create payments, allocate them to workers,
+mark work complete, record payments, worker login, worker payment listing
+and worker verification. For each operation it reports throughput and
+p50/p99 latency.
+
+Two modes:
+
+- `client`: requests go through Flask's test client, in process and
+  sequentially; this measures the handlers and the store
+- `server`: the app is served by a threaded local HTTP server and driven
+  over keep-alive connections by `--concurrency` client threads; this adds
+  request parsing and the network stack
+- `both`: runs each mode in a fresh process
+
+The dataset has `--workorders` payments spread over `--contractors`
+contractors, each allocated to `--workers` workers drawn from a pool of
+`--worker-pool` phones. The storage backend is chosen by the usual
+environment variables (STORAGE_BACKEND / DATABASE_URL).
+
+Prints one JSON object, or writes it to `--output`. With `--baseline` the
+run is compared with a previous output file.
+
+    python benchmarks/bench_api.py --mode both --workorders 2000 --output run.json
+    python benchmarks/bench_api.py --mode both --workorders 2000 --baseline run.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def _percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class TestClientTarget:
+    """Sends requests through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+
+class ServerTarget:
+    """Serves the app on a local port and sends requests over HTTP/1.1 keep-alive"""
+
+    def __init__(self, app):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _run(target, requests, concurrency):
+    """Send (method, path, body) requests; returns latencies, error count and wall time"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        local_latencies = []
+        local_errors = 0
+        for method, path, body in chunk:
+            started = time.perf_counter()
+            status, _ = target.request(method, path, body)
+            local_latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        work(requests)
+    else:
+        threads = [threading.Thread(target=work, args=(requests[i::concurrency],)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return latencies, sum(errors), time.perf_counter() - started
+
+
+def _summarize(latencies, errors, seconds):
+    if not latencies:
+        return {'requests': 0}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def _dataset(args, prefix):
+    """Synthetic workorders: (workorder, contractor, [(phone, name)])"""
+    workorders = []
+    for i in range(args.workorders):
+        phones = [f'8{(i * args.workers + w) % args.worker_pool:09d}' for w in range(args.workers)]
+        workorders.append((f'BENCH-{prefix}-{i:07d}', f'Contractor {i % args.contractors}',
+                           [(phone, f'Worker {phone}') for phone in phones]))
+    return workorders
+
+
+def run_mode(mode, args):
+    # Production-like logging: handler messages are not formatted
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Every request comes from one IP and a few phones: lift the worker rate
+    # limits so the handlers are measured rather than the 429s
+    for name in ('RATE_LIMIT_IP', 'RATE_LIMIT_PHONE', 'RATE_LIMIT_LOGIN'):
+        os.environ.setdefault(name, '1000000000/1')
+    os.environ.setdefault('WORKER_MAX_CONCURRENT', '1000000')
+    from app import create_app
+    app = create_app()
+
+    target = ServerTarget(app) if mode == 'server' else TestClientTarget(app)
+    concurrency = args.concurrency if mode == 'server' else 1
+    # Mode-specific workorders, in case both runs share a database
+    workorders = _dataset(args, mode.upper())
+    results = {}
+
+    def measure(operation, requests):
+        results[operation] = _summarize(*_run(target, requests, concurrency))
+
+    # Creation runs sequentially so the new payment ids can be collected
+    payment_ids = []
+    latencies = []
+    started = time.perf_counter()
+    for workorder, contractor, _ in workorders:
+        request_started = time.perf_counter()
+        status, body = target.request('POST', '/api/admin/payments',
+                                      {'workorder': workorder, 'contractor': contractor, 'amount': 1000.0})
+        latencies.append(time.perf_counter() - request_started)
+        payment_ids.append(json.loads(body)['payment_id'] if status < 400 else None)
+    results['create'] = _summarize(latencies, payment_ids.count(None), time.perf_counter() - started)
+
+    measure('allocate', [
+        ('POST', f'/api/payments/{pid}/allocate', {'workers': [
+            {'name': name, 'phone': phone, 'promised_amount': 250.0} for phone, name in workers
+        ]})
+        for pid, (_, _, workers) in zip(payment_ids, workorders)
+    ])
+    measure('mark_complete', [('POST', f'/api/payments/{pid}/mark-complete', None) for pid in payment_ids])
+    measure('record_payments', [
+        ('POST', f'/api/admin/payments/{pid}/record-payments', {'worker_payments': [
+            {'worker_phone': phone, 'worker_name': name, 'promised_amount': 250.0, 'actual_paid': 250.0}
+            for phone, name in workers
+        ]})
+        for pid, (_, _, workers) in zip(payment_ids, workorders)
+    ])
+
+    phones = sorted({(phone, name) for _, _, workers in workorders for phone, name in workers})
+    measure('login', [('POST', '/api/worker/login', {'phone': phone, 'name': name}) for phone, name in phones])
+    measure('list_payments', [('GET', f'/api/worker/{phone}/payments', None) for phone, _ in phones])
+    measure('verify', [
+        ('POST', '/api/worker/verify-payment-with-amount',
+         {'worker_phone': phone, 'workorder': workorder, 'actual_received': 250.0, 'verified': True})
+        for workorder, _, workers in workorders for phone, _ in workers
+    ])
+
+    if mode == 'server':
+        target.close()
+    return {
+        'mode': mode,
+        'backend': app.config['STORAGE_BACKEND'],
+        'concurrency': concurrency,
+        'operations': results,
+    }
+
+
+def _compare(current, baseline):
+    """Ratios current / baseline of throughput and p99 per mode and operation"""
+    previous = {run['mode']: run['operations'] for run in baseline['runs']}
+    comparison = {}
+    for run in current['runs']:
+        for operation, stats in run['operations'].items():
+            before = previous.get(run['mode'], {}).get(operation)
+            if not before or not before.get('requests') or not stats.get('requests'):
+                continue
+            comparison[f"{run['mode']}.{operation}"] = {
+                'throughput_ratio': round(stats['throughput_rps'] / before['throughput_rps'], 3),
+                'p99_ratio': round(stats['p99_ms'] / before['p99_ms'], 3),
+            }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--contractors', type=int, default=20)
+    parser.add_argument('--workorders', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4, help='workers per allocation')
+    parser.add_argument('--worker-pool', type=int, default=None,
+                        help='distinct worker phones (default: a quarter of all allocations)')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads in server mode')
+    parser.add_argument('--output', help='write the JSON result to this file')
+    parser.add_argument('--baseline', help='compare with a previous JSON result')
+    args = parser.parse_args()
+    if args.worker_pool is None:
+        args.worker_pool = max(1, args.workorders * args.workers // 4)
+
+    if args.mode == 'both':
+        runs = []
+        for mode in ('client', 'server'):
+            command = [sys.executable, os.path.abspath(__file__), '--mode', mode]
+            for name in ('contractors', 'workorders', 'workers', 'worker_pool', 'concurrency'):
+                command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.extend(json.loads(output)['runs'])
+    else:
+        runs = [run_mode(args.mode, args)]
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'dataset': {
+            'contractors': args.contractors,
+            'workorders': args.workorders,
+            'workers_per_allocation': args.workers,
+            'worker_pool': args.worker_pool,
+        },
+        'runs': runs,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            result['comparison'] = _compare(result, json.load(f))
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
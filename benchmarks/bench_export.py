@@ -0,0 +1,111 @@
+"""
+Throughput and memory benchmark for the streaming ledger export.
+
+Seeds an InMemoryStore with `--rows` ledger rows (payments allocated to
+`--workers` workers each, with a worker payment record per worker), then
+streams the whole ledger in every available format and reports per format:
+
+- rows per second and output size (chunks are consumed and discarded, as
+  the WSGI server does when writing them to the socket)
+- peak memory allocated while exporting, measured with tracemalloc in a
+  second pass; it stays bounded by one page whatever the row count
+
+Prints one JSON object.
+
+    python benchmarks/bench_export.py --rows 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from export import EXPORT_FORMATS, export_ledger, parquet_available  # noqa: E402
+from store import InMemoryStore, ListQuery  # noqa: E402
+
+_START = datetime(2025, 1, 1, 8, 30)
+
+
+def _seed_store(rows, workers):
+    store = InMemoryStore()
+    for p in range(rows // workers):
+        workorder = f'WO-{p}'
+        contractor = f'Contractor {p % 500}'
+        created_at = (_START + timedelta(seconds=p)).isoformat()
+        phones = [f'9{(p * workers + w) % 200000:09d}' for w in range(workers)]
+        store.add_payment({
+            'workorder': workorder,
+            'contractor': contractor,
+            'amount': 1000.0 * workers,
+            'allocated': True,
+            'work_status': 'completed',
+            'workers': [{'name': f'Worker {phone}', 'phone': phone, 'promised_amount': 1000.0} for phone in phones],
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        for phone in phones:
+            store.add_worker_payment({
+                'worker_phone': phone,
+                'worker_name': f'Worker {phone}',
+                'workorder': workorder,
+                'contractor': contractor,
+                'promised_amount': 1000.0,
+                'actual_paid': 950.0 + p % 50,
+                'payment_status': 'pending',
+                'work_status': 'completed',
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+    return store
+
+
+def _drain(store, fmt):
+    size = 0
+    for chunk in export_ledger(store, ListQuery(), fmt):
+        size += len(chunk)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=4, help='workers per payment')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = _seed_store(args.rows, args.workers)
+    results = {
+        'rows': args.rows // args.workers * args.workers,
+        'seed_seconds': round(time.perf_counter() - started, 1),
+        'formats': {},
+    }
+    gc.collect()
+
+    for fmt in EXPORT_FORMATS:
+        if fmt == 'parquet' and not parquet_available():
+            continue
+        started = time.perf_counter()
+        size = _drain(store, fmt)
+        seconds = time.perf_counter() - started
+
+        tracemalloc.start()
+        _drain(store, fmt)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results['formats'][fmt] = {
+            'seconds': round(seconds, 2),
+            'rows_per_second': round(results['rows'] / seconds),
+            'megabytes': round(size / 1e6, 1),
+            'peak_memory_megabytes': round(peak / 1e6, 2),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Startup and write-latency benchmark for the journaled in-memory store.
+
+Seeds a store with `--records` records (half payments allocated to one
+worker, half their worker payment records) through the journal, then
+measures:
+
+- committed write latency (p50/p99) with `--threads` concurrent writers,
+  each write waiting for its fsync like a request does
+- snapshot time and size
+- startup time: snapshot load plus replay of the journal tail
+
+Prints one JSON object.
+
+    python benchmarks/bench_journal.py --records 1000000
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from journal import _segments, open_journal  # noqa: E402
+from store import InMemoryStore  # noqa: E402
+
+
+def _percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def _write_pair(store, i):
+    now = datetime.now().isoformat()
+    phone = f'9{i:09d}'
+    workorder = f'WO-{i}'
+    payment = store.add_payment({
+        'workorder': workorder,
+        'contractor': f'Contractor {i % 500}',
+        'amount': 1000.0 + i % 97,
+        'allocated': True,
+        'work_status': 'assigned',
+        'workers': [{'name': f'Worker {i}', 'phone': phone, 'promised_amount': 1000.0}],
+        'created_at': now,
+        'updated_at': now,
+    })
+    store.add_worker_payment({
+        'worker_phone': phone,
+        'worker_name': f'Worker {i}',
+        'workorder': workorder,
+        'contractor': payment['contractor'],
+        'promised_amount': 1000.0,
+        'actual_paid': 0,
+        'payment_status': 'allocated',
+        'work_status': 'assigned',
+        'created_at': now,
+        'updated_at': now,
+    })
+
+
+def _seed(store, records, chunk=500):
+    for start in range(0, records // 2, chunk):
+        for i in range(start, min(start + chunk, records // 2)):
+            _write_pair(store, i)
+        store.commit()
+
+
+def _measure_writes(store, writes, threads, offset):
+    latencies = []
+    lock = threading.Lock()
+
+    def writer(worker):
+        own = []
+        for n in range(worker, writes, threads):
+            started = time.perf_counter()
+            _write_pair(store, offset + n)
+            store.commit()
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=writer, args=(worker,)) for worker in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'writes': writes,
+        'threads': threads,
+        'writes_per_second': round(writes / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--writes', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--dir', help="journal directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='wpts-journal-')
+    results = {'records': args.records}
+    try:
+        store = InMemoryStore()
+        # Snapshot only when asked to below
+        journal = open_journal(store, directory, snapshot_every=float('inf'))
+        started = time.perf_counter()
+        _seed(store, args.records)
+        results['seed_seconds'] = round(time.perf_counter() - started, 2)
+
+        results['write_latency'] = _measure_writes(store, args.writes, args.threads, args.records)
+        results['write_latency_single_thread'] = _measure_writes(
+            store, min(args.writes, 1000), 1, args.records + args.writes)
+
+        started = time.perf_counter()
+        journal.snapshot()
+        results['snapshot_seconds'] = round(time.perf_counter() - started, 2)
+        results['snapshot_bytes'] = os.path.getsize(os.path.join(directory, 'snapshot.bin'))
+
+        # A journal tail on top of the snapshot, as after a crash
+        _measure_writes(store, args.writes, args.threads, args.records + 2 * args.writes)
+        journal.close()
+        results['tail_bytes'] = sum(os.path.getsize(path) for path in _segments(directory))
+
+        del store
+        started = time.perf_counter()
+        restored = InMemoryStore()
+        open_journal(restored, directory).close()
+        results['startup_seconds'] = round(time.perf_counter() - started, 2)
+        results['restored_records'] = restored.count_payments() + restored.count_worker_payments()
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Memory benchmark for the in-memory record representation.
+
+Builds `--records` worker payment records (and as many allocated workers)
+from the same input twice, as plain dicts (the previous representation) and
+in the compact form of records.py, and reports the bytes allocated per
+record of each, measured with tracemalloc. Also reports the bytes per
+payment/worker-payment pair of a fully indexed InMemoryStore.
+
+Prints one JSON object.
+
+    python benchmarks/bench_memory.py --records 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from records import AllocatedWorker, WorkerPaymentRecord  # noqa: E402
+from store import InMemoryStore  # noqa: E402
+
+_START = datetime(2025, 1, 1, 8, 30)
+
+
+def _worker_payment(i):
+    # Strings are built per record, as they are when parsed from requests
+    created_at = (_START + timedelta(seconds=i, microseconds=i % 1000)).isoformat()
+    return {
+        'id': i + 1,
+        'worker_phone': f'9{i:09d}',
+        'worker_name': f'Worker {i % 20000}',
+        'workorder': f'WO-{i // 4}',
+        'contractor': f'Contractor {i % 500}',
+        'promised_amount': 1000.0 + i % 97,
+        'actual_paid': 950.0,
+        'payment_status': 'pending',
+        'work_status': 'completed',
+        'created_at': created_at,
+        'updated_at': f'{created_at}',
+        'version': i + 1,
+    }
+
+
+def _worker(i):
+    return {'name': f'Worker {i % 20000}', 'phone': f'9{i:09d}', 'promised_amount': 1000.0}
+
+
+def _measure(build, records):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(records)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return round((after - before) / records, 1)
+
+
+def _seed_store(records):
+    store = InMemoryStore()
+    for i in range(records):
+        wp = _worker_payment(i)
+        store.add_payment({
+            'workorder': wp['workorder'],
+            'contractor': wp['contractor'],
+            'amount': 4000.0,
+            'allocated': True,
+            'work_status': 'completed',
+            'workers': [_worker(i)],
+            'created_at': wp['created_at'],
+            'updated_at': wp['updated_at'],
+        })
+        del wp['id'], wp['version']
+        store.add_worker_payment(wp)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1000000)
+    args = parser.parse_args()
+    n = args.records
+
+    results = {'records': n}
+    results['worker_payment_bytes'] = {
+        'dict': _measure(lambda n: [_worker_payment(i) for i in range(n)], n),
+        'compact': _measure(lambda n: [WorkerPaymentRecord(_worker_payment(i)) for i in range(n)], n),
+    }
+    results['allocated_worker_bytes'] = {
+        'dict': _measure(lambda n: [_worker(i) for i in range(n)], n),
+        'compact': _measure(lambda n: [AllocatedWorker(_worker(i)) for i in range(n)], n),
+    }
+    results['store_bytes_per_pair'] = _measure(_seed_store, n)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Server-Sent Events fan-out for payment and verification status changes.
+
+Request handlers publish events tagged with the scopes they touch (the
+global admin scope, a contractor, worker phones). Publishing only enqueues
+the pre-formatted event; a dedicated broadcaster thread routes it to the
+subscribers of those scopes, so handlers never wait on slow clients and
+idle connections cost nothing until an event for their scope arrives.
+
+Events are delivered within one process. With several gunicorn workers a
+client only sees events from writes handled by the worker it is connected
+to, and should catch up through `GET /api/changes` on reconnect.
+
+Under the ASGI worker (asgi.py) a stream is served by the worker's event
+loop: its subscription queue wakes a coroutine instead of a thread, so an
+idle stream holds only its socket and the threads stay free for requests.
+Elsewhere (the development server, tests) each stream holds a thread for as
+long as it is connected. Either way the number of streams per process is
+capped (`SSE_MAX_SUBSCRIBERS`) and a client over the cap is answered 503.
+"""
+import asyncio
+import queue
+import threading
+from collections import defaultdict, deque
+
+
+# Events buffered per subscriber before it is considered too slow and dropped
+MAX_QUEUED_EVENTS = 256
+
+# Streams open at once per process
+MAX_SUBSCRIBERS = 10000
+
+# Seconds a refused client waits before trying to open a stream again
+STREAM_RETRY_AFTER = 60
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+
+class LoopQueue:
+    """Bounded queue filled from any thread and read by a coroutine on an event loop
+
+    Mirrors the non-blocking half of `queue.Queue` (`put_nowait` and
+    `get_nowait` raise `queue.Full` and `queue.Empty`), so the broadcaster
+    thread treats both kinds of subscription alike.
+    """
+
+    def __init__(self, loop, maxsize):
+        self._loop = loop
+        self._maxsize = maxsize
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, item):
+        with self._lock:
+            if len(self._items) >= self._maxsize:
+                raise queue.Full
+            self._items.append(item)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The loop is closed: the worker is shutting down
+            pass
+
+    def get_nowait(self):
+        with self._lock:
+            if not self._items:
+                raise queue.Empty
+            return self._items.popleft()
+
+    async def get(self, timeout):
+        """Wait for the next item; raises asyncio.TimeoutError after `timeout` seconds"""
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                pass
+            self._ready.clear()
+            # An item queued before the clear would not wake us
+            with self._lock:
+                if self._items:
+                    continue
+            await asyncio.wait_for(self._ready.wait(), timeout)
+
+
+class Subscription:
+    """One connected event stream and its pending events
+
+    With an event loop the stream is read by a coroutine on that loop,
+    otherwise by the thread serving the request.
+    """
+
+    def __init__(self, scope, max_queued=MAX_QUEUED_EVENTS, loop=None):
+        self.scope = scope
+        if loop is None:
+            self.queue = queue.Queue(maxsize=max_queued)
+        else:
+            self.queue = LoopQueue(loop, max_queued)
+
+
+def format_event(event, payload, event_id=None):
+    """Format one event, its data already serialized to JSON bytes, in the text/event-stream wire format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {payload.decode()}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Broadcaster:
+    """Routes published events to subscribers by scope on a background thread"""
+
+    def __init__(self, max_queued=MAX_QUEUED_EVENTS, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_queued = max_queued
+        self.max_subscribers = max_subscribers
+        self.rejected = 0
+        self._count = 0
+        self._inbox = queue.SimpleQueue()
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='sse-broadcaster', daemon=True
+                    )
+                    self._thread.start()
+
+    def subscribe(self, scope, loop=None):
+        """Register a new stream for a scope; returns None when the cap is reached"""
+        self._ensure_started()
+        subscription = Subscription(scope, self.max_queued, loop)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self._subscribers[scope].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.scope)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.remove(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.scope]
+
+    def subscriber_count(self):
+        return self._count
+
+    def publish(self, event, payload, scopes, event_id=None):
+        """Queue an event for every subscriber of the given scopes
+
+        `payload` is the record serialized at commit (shared with the event
+        bus), so later changes to the record cannot leak into an event that
+        has not been sent yet.
+        """
+        if not self._subscribers:
+            return
+        self._inbox.put((format_event(event, payload, event_id), tuple(scopes)))
+
+    def _run(self):
+        while True:
+            message, scopes = self._inbox.get()
+            with self._lock:
+                targets = set()
+                for scope in scopes:
+                    targets.update(self._subscribers.get(scope, ()))
+            for subscription in targets:
+                try:
+                    subscription.queue.put_nowait(message)
+                except queue.Full:
+                    # The client is not keeping up: close its stream so it
+                    # reconnects and resynchronizes instead of blocking others
+                    self.unsubscribe(subscription)
+                    _close(subscription)
+
+    def stream(self, subscription, heartbeat=HEARTBEAT_INTERVAL):
+        """Yield the text/event-stream body for a subscription"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def stream_async(self, subscription, heartbeat=HEARTBEAT_INTERVAL):
+        """Async text/event-stream body for a subscription made with an event loop"""
+        return AsyncStream(self, subscription, heartbeat)
+
+
+class AsyncStream:
+    """Async iterator over the text/event-stream body of a subscription
+
+    Read on the event loop of the ASGI worker; `aclose()` unsubscribes, even
+    when the stream was never read.
+    """
+
+    def __init__(self, broadcaster, subscription, heartbeat=HEARTBEAT_INTERVAL):
+        self.broadcaster = broadcaster
+        self.subscription = subscription
+        self.heartbeat = heartbeat
+        self._started = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._started:
+            self._started = True
+            return "retry: 3000\n\n"
+        try:
+            message = await self.subscription.queue.get(self.heartbeat)
+        except asyncio.TimeoutError:
+            return ": keep-alive\n\n"
+        if message is None:
+            await self.aclose()
+            raise StopAsyncIteration
+        return message
+
+    async def aclose(self):
+        self.broadcaster.unsubscribe(self.subscription)
+
+
+def _close(subscription):
+    """Wake the stream with the end-of-stream marker, making room if needed"""
+    while True:
+        try:
+            subscription.queue.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                pass
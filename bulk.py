@@ -0,0 +1,125 @@
+"""
+Streaming parsers for bulk CSV and NDJSON uploads.
+
+Uploads are read from the request stream one line at a time, so the body is
+never held in memory as a whole. Each parser yields `(row_number, row)`
+pairs; a row that cannot be parsed is yielded as a `RowError` so the caller
+can report it alongside the rows that succeeded.
+"""
+import csv
+import io
+import json
+
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# Rows committed per transaction during bulk ingest
+CHUNK_SIZE = 500
+
+
+class RowError:
+    """A row that could not be parsed"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def upload_format(mimetype):
+    """Return 'csv' or 'ndjson' for an upload content type, or None"""
+    if mimetype in CSV_MIMETYPES:
+        return 'csv'
+    if mimetype in NDJSON_MIMETYPES:
+        return 'ndjson'
+    return None
+
+
+def _text_lines(stream):
+    if not isinstance(stream, io.BufferedIOBase):
+        stream = io.BufferedReader(stream)
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def _number(value):
+    """Convert a CSV cell to a number, leaving non-numeric text as is"""
+    if value is None or value.strip() == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def iter_csv(stream, numeric_fields=()):
+    """Yield rows of a CSV upload with a header line as dicts"""
+    reader = csv.DictReader(_text_lines(stream))
+    for row in reader:
+        if None in row:
+            yield reader.line_num, RowError("Row has more columns than the header")
+            continue
+        row = {key.strip(): (value.strip() if isinstance(value, str) else value)
+               for key, value in row.items()}
+        for field in numeric_fields:
+            if field in row:
+                row[field] = _number(row[field])
+        yield reader.line_num, row
+
+
+def iter_ndjson(stream):
+    """Yield the JSON objects of an NDJSON upload, skipping blank lines"""
+    for line_number, line in enumerate(_text_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, RowError("Invalid JSON")
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError("Each line must be a JSON object")
+            continue
+        yield line_number, row
+
+
+def iter_rows(stream, fmt, numeric_fields=()):
+    if fmt == 'csv':
+        return iter_csv(stream, numeric_fields)
+    return iter_ndjson(stream)
+
+
+def iter_allocations(rows):
+    """Group worker rows into allocations of one payment each
+
+    CSV allocation uploads have one row per worker (`payment_id`, `name`,
+    `phone`, `promised_amount`); consecutive rows with the same payment_id
+    form one allocation. An allocation replaces the payment's workers, so a
+    payment's rows must be consecutive: a later row for a payment whose
+    allocation was already yielded is a `RowError` rather than a second
+    allocation that drops the first. Rows that already carry a `workers`
+    list (NDJSON) pass through unchanged. Yields `(row_number, allocation)`
+    pairs.
+    """
+    group_row, group = None, None
+    # Payment ids whose CSV allocation was already yielded
+    done = set()
+    for row_number, row in rows:
+        worker_row = not isinstance(row, RowError) and 'workers' not in row
+        if worker_row and group is not None and group['payment_id'] == row.get('payment_id'):
+            group['workers'].append({key: value for key, value in row.items() if key != 'payment_id'})
+            continue
+
+        if group is not None:
+            done.add(group['payment_id'])
+            yield group_row, group
+            group_row, group = None, None
+        if not worker_row:
+            yield row_number, row
+        elif row.get('payment_id') in done:
+            yield row_number, RowError(f"Rows for payment {row.get('payment_id')} must be consecutive; "
+                                       f"its allocation was already applied")
+        else:
+            worker = {key: value for key, value in row.items() if key != 'payment_id'}
+            group_row, group = row_number, {'payment_id': row.get('payment_id'), 'workers': [worker]}
+
+    if group is not None:
+        yield group_row, group
@@ -0,0 +1,140 @@
+"""
+Application settings per environment.
+
+`load_config()` picks the class named by `APP_ENV` (`development` by
+default, `production` under gunicorn, see gunicorn.conf.py) and reads the
+environment when it is instantiated:
+
+- `LOG_LEVEL`: DEBUG in development, WARNING in production
+- `CORS_ORIGINS`: comma-separated origins allowed to call the API; `*` in
+  development, none in production, where the frontend is served by the app
+  itself
+- `DATABASE_URL` / `STORAGE_BACKEND`: storage backend selection (SQL when a
+  database URL is given, the in-memory store otherwise)
+- `JOURNAL_DIR`: journal directory for the in-memory store
+- `SESSION_SECRET`: Flask secret key
+- `FLASK_DEBUG=1`: debugger and reloader (development only)
+- `STATIC_MAX_AGE`: seconds browsers may cache fingerprinted static assets
+- `PROXY_COUNT`: reverse proxies in front of the app whose X-Forwarded-For
+  is trusted for the client IP; none in development, one in production
+- `RATE_LIMIT_REDIS_URL`: Redis shared by all workers for the rate limits
+  (see ratelimit.py); per-process limits otherwise
+- `SSE_MAX_SUBSCRIBERS`: event streams open at once per process (see
+  broadcast.py)
+- `REQUEST_THREADS`: threads running requests per process under the ASGI
+  worker (see asgi.py); event streams do not take one
+- `DB_POOL_SIZE`, `DB_MAX_OVERFLOW`, `DB_POOL_TIMEOUT`: database connection
+  pool (sql_store.py)
+- `JOURNAL_SYNC_INTERVAL`, `JOURNAL_SNAPSHOT_EVERY`: journal batching and
+  snapshot frequency (journal.py)
+- `DISCREPANCY_TOLERANCE`: largest amount difference still counted as a
+  match (discrepancies.py)
+- `IDEMPOTENCY_TTL`, `IDEMPOTENCY_MAX_KEYS`: idempotency keys (the key
+  limit applies to the in-memory store's cache only)
+  (idempotency.py)
+- `RESPONSE_CACHE_SIZE`, `RESPONSE_CACHE_TTL`: list response cache
+  (response_cache.py)
+- `EVENT_QUEUE_SIZE`, `EVENT_WORKERS`, `EVENT_BATCH_SIZE`: event bus;
+  `EVENT_AUDIT_FILE` and `EVENT_NOTIFICATIONS=1` enable its audit file and
+  notification sinks (events.py)
+- `RATE_LIMIT_IP`, `RATE_LIMIT_PHONE`, `RATE_LIMIT_LOGIN`,
+  `WORKER_MAX_CONCURRENT`: limits on the worker-facing endpoints
+  (ratelimit.py)
+
+The defaults of the component settings are the constants of their modules
+(the database pool's are here, so SQLAlchemy is only imported when used).
+"""
+import os
+
+import broadcast
+import discrepancies
+import events
+import idempotency
+import journal
+import ratelimit
+import response_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEVELOPMENT_SECRET_KEY = "default_secret_key_for_development"
+
+
+def _origins(value):
+    value = value.strip()
+    if value == '*':
+        return '*'
+    return [origin.strip() for origin in value.split(',') if origin.strip()]
+
+
+class Config:
+    """Settings shared by all environments"""
+
+    ENV_NAME = None
+    DEBUG = False
+    DEFAULT_LOG_LEVEL = 'INFO'
+    DEFAULT_CORS_ORIGINS = '*'
+    DEFAULT_PROXY_COUNT = 0
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        self.LOG_LEVEL = environ.get('LOG_LEVEL', self.DEFAULT_LOG_LEVEL).upper()
+        self.CORS_ORIGINS = _origins(environ.get('CORS_ORIGINS', self.DEFAULT_CORS_ORIGINS))
+        self.SECRET_KEY = environ.get('SESSION_SECRET', DEVELOPMENT_SECRET_KEY)
+        self.DATABASE_URL = environ.get('DATABASE_URL')
+        self.STORAGE_BACKEND = environ.get('STORAGE_BACKEND', 'sql' if self.DATABASE_URL else 'memory')
+        self.JOURNAL_DIR = environ.get('JOURNAL_DIR')
+        self.STATIC_DIR = environ.get('STATIC_DIR', BASE_DIR)
+        self.STATIC_MAX_AGE = int(environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))
+        self.PROXY_COUNT = int(environ.get('PROXY_COUNT', self.DEFAULT_PROXY_COUNT))
+        self.RATE_LIMIT_REDIS_URL = environ.get('RATE_LIMIT_REDIS_URL')
+        self.SSE_MAX_SUBSCRIBERS = int(environ.get('SSE_MAX_SUBSCRIBERS', broadcast.MAX_SUBSCRIBERS))
+        self.REQUEST_THREADS = int(environ.get('REQUEST_THREADS', 16))
+        self.DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', 5))
+        self.DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', 10))
+        self.DB_POOL_TIMEOUT = int(environ.get('DB_POOL_TIMEOUT', 30))
+        self.JOURNAL_SYNC_INTERVAL = float(environ.get('JOURNAL_SYNC_INTERVAL', journal.SYNC_INTERVAL))
+        self.JOURNAL_SNAPSHOT_EVERY = int(environ.get('JOURNAL_SNAPSHOT_EVERY', journal.SNAPSHOT_EVERY))
+        self.DISCREPANCY_TOLERANCE = float(
+            environ.get('DISCREPANCY_TOLERANCE', discrepancies.DISCREPANCY_TOLERANCE))
+        self.IDEMPOTENCY_TTL = float(environ.get('IDEMPOTENCY_TTL', idempotency.IDEMPOTENCY_TTL))
+        self.IDEMPOTENCY_MAX_KEYS = int(environ.get('IDEMPOTENCY_MAX_KEYS', idempotency.IDEMPOTENCY_MAX_KEYS))
+        self.RESPONSE_CACHE_SIZE = int(environ.get('RESPONSE_CACHE_SIZE', response_cache.RESPONSE_CACHE_SIZE))
+        self.RESPONSE_CACHE_TTL = float(environ.get('RESPONSE_CACHE_TTL', response_cache.RESPONSE_CACHE_TTL))
+        self.EVENT_QUEUE_SIZE = int(environ.get('EVENT_QUEUE_SIZE', events.EVENT_QUEUE_SIZE))
+        self.EVENT_WORKERS = int(environ.get('EVENT_WORKERS', events.EVENT_WORKERS))
+        self.EVENT_BATCH_SIZE = int(environ.get('EVENT_BATCH_SIZE', events.EVENT_BATCH_SIZE))
+        self.EVENT_AUDIT_FILE = environ.get('EVENT_AUDIT_FILE')
+        self.EVENT_NOTIFICATIONS = environ.get('EVENT_NOTIFICATIONS') == '1'
+        self.RATE_LIMIT_IP = environ.get('RATE_LIMIT_IP', ratelimit.RATE_LIMIT_IP)
+        self.RATE_LIMIT_PHONE = environ.get('RATE_LIMIT_PHONE', ratelimit.RATE_LIMIT_PHONE)
+        self.RATE_LIMIT_LOGIN = environ.get('RATE_LIMIT_LOGIN', ratelimit.RATE_LIMIT_LOGIN)
+        self.WORKER_MAX_CONCURRENT = int(environ.get('WORKER_MAX_CONCURRENT', ratelimit.WORKER_MAX_CONCURRENT))
+
+
+class DevelopmentConfig(Config):
+    ENV_NAME = 'development'
+    DEFAULT_LOG_LEVEL = 'DEBUG'
+
+    def __init__(self, environ=None):
+        super().__init__(environ)
+        # The debugger and reloader only on request (FLASK_DEBUG=1)
+        environ = os.environ if environ is None else environ
+        self.DEBUG = environ.get('FLASK_DEBUG', '0') == '1'
+
+
+class ProductionConfig(Config):
+    ENV_NAME = 'production'
+    DEFAULT_LOG_LEVEL = 'WARNING'
+    DEFAULT_CORS_ORIGINS = ''
+    DEFAULT_PROXY_COUNT = 1
+
+
+CONFIGS = {config.ENV_NAME: config for config in (DevelopmentConfig, ProductionConfig)}
+
+
+def load_config(name=None):
+    """Settings for the named environment (default: APP_ENV)"""
+    name = name or os.environ.get('APP_ENV', 'development')
+    if name not in CONFIGS:
+        raise ValueError(f"APP_ENV must be one of: {', '.join(CONFIGS)}")
+    return CONFIGS[name]()
@@ -0,0 +1,76 @@
+"""
+Automatic discrepancy detection for worker payment records.
+
+A record has an open discrepancy when the worker has stated what they
+received and that amount differs from what the contractor paid or promised
+by more than `DISCREPANCY_TOLERANCE`, or when the worker disputed it. Its
+shortfall is the larger of the paid and promised amounts minus what was
+received. Both stores keep open discrepancies ordered by shortfall, largest
+first, per contractor and overall, so the triage queue is read page by page
+instead of scanning worker payment records.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+
+from aggregates import ALL_CONTRACTORS, to_amount
+
+# Largest difference between received and paid/promised amounts that is
+# still considered a match
+DISCREPANCY_TOLERANCE = 1.0
+
+
+def open_shortfall(wp, tolerance=DISCREPANCY_TOLERANCE):
+    """Shortfall of a worker payment record's open discrepancy, or None if it has none"""
+    received = wp.get('actual_received_by_worker')
+    if received is None:
+        return None
+    received = to_amount(received)
+    promised = to_amount(wp.get('promised_amount'))
+    paid = to_amount(wp.get('actual_paid'))
+    mismatched = abs(received - paid) > tolerance or abs(received - promised) > tolerance
+    if not mismatched and wp.get('payment_status') != 'disputed':
+        return None
+    return round(max(promised, paid) - received, 2)
+
+
+def format_cursor(shortfall, record_id):
+    return f"{shortfall!r}:{record_id}"
+
+
+class DiscrepancyQueue:
+    """In-memory open discrepancies, ordered by shortfall (largest first) then id"""
+
+    def __init__(self):
+        # Scope (contractor key or ALL_CONTRACTORS) -> sorted (-shortfall, id)
+        self._queues = defaultdict(list)
+        # Record id -> (queue entry, contractor key, record)
+        self._entries = {}
+
+    def update(self, wp, key, shortfall):
+        """Place a record in, move it within, or remove it from the queue"""
+        previous = self._entries.get(wp['id'])
+        entry = (-shortfall, wp['id']) if shortfall is not None else None
+        if previous is not None:
+            if previous[0] == entry:
+                return
+            for scope in (previous[1], ALL_CONTRACTORS):
+                queue = self._queues[scope]
+                del queue[bisect_left(queue, previous[0])]
+                if not queue:
+                    del self._queues[scope]
+            del self._entries[wp['id']]
+        if entry is not None:
+            for scope in (key, ALL_CONTRACTORS):
+                insort(self._queues[scope], entry)
+            self._entries[wp['id']] = (entry, key, wp)
+
+    def page(self, scope, cursor=None, limit=None):
+        """Return [(shortfall, record)] after a (shortfall, id) cursor, plus the next cursor"""
+        queue = self._queues.get(scope, ())
+        start = bisect_right(queue, (-cursor[0], cursor[1])) if cursor is not None else 0
+        end = len(queue) if limit is None else start + limit
+        entries = queue[start:end]
+        page = [(-shortfall, self._entries[record_id][2]) for shortfall, record_id in entries]
+        if end < len(queue) and page:
+            return page, format_cursor(page[-1][0], page[-1][1]['id'])
+        return page, None
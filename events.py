@@ -0,0 +1,312 @@
+"""
+In-process event bus for side effects of writes.
+
+Write handlers publish domain events (payment created, allocated, work
+completed, payments recorded, verified, disputed) after their writes are
+committed, with the record serialized once at commit (the same bytes go to
+the event streams). Publishing puts the event on a bounded queue; it never
+waits on a sink. A small pool of worker threads
+drains the queue in batches and hands each batch to every sink:
+
+- `LogSink`: the application log lines for the events
+- `AuditFileSink`: an append-only JSON-lines audit trail, one write per batch
+- `NotificationSink`: stand-in for SMS/push messages to workers
+
+When the queue is full the event is dropped and counted rather than slowing
+the request down (`stats()`, exported in /metrics). Batches are delivered in
+order per worker; with several workers, batches may interleave, and every
+event carries the record's change version for ordering. `close()` drains
+the queue and flushes the sinks on shutdown.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from serialization import dumps, loads
+
+# Events buffered before new ones are dropped
+EVENT_QUEUE_SIZE = 10000
+
+# Worker threads draining the queue
+EVENT_WORKERS = 2
+
+# Events handed to the sinks at once
+EVENT_BATCH_SIZE = 200
+
+# Seconds a worker waits to fill a batch once it has an event
+EVENT_BATCH_WAIT = 0.01
+
+_STOP = object()
+
+logger = logging.getLogger('wpts.events')
+
+
+class Event:
+    """A committed change, with its record serialized at commit"""
+
+    __slots__ = ('name', 'payload', 'scopes', 'version', 'at')
+
+    def __init__(self, name, payload, scopes, version, at):
+        self.name = name
+        self.payload = payload
+        self.scopes = scopes
+        self.version = version
+        self.at = at
+
+    @property
+    def record(self):
+        return loads(self.payload)
+
+    def to_json(self):
+        """The event as one JSON line (bytes)"""
+        head = dumps({'at': self.at, 'event': self.name, 'scopes': self.scopes, 'version': self.version})
+        return head[:-1] + b',"record":' + self.payload + b'}\n'
+
+
+class LogSink:
+    """Writes the log line for each event"""
+
+    name = 'log'
+
+    # event -> (message, record -> message arguments)
+    MESSAGES = {
+        'payment_created': ("Payment created: ID %s, WorkOrder: %s, Contractor: %s, Amount: %s",
+                            lambda r: (r['id'], r['workorder'], r['contractor'], r['amount'])),
+        'payment_allocated': ("Payment %s allocated to %s workers", lambda r: (r['id'], len(r['workers']))),
+        'work_completed': ("Work marked as completed for payment %s", lambda r: (r['id'],)),
+        'payments_recorded': ("Recorded actual payments for payment %s", lambda r: (r['id'],)),
+        'payment_verified': ("Payment verification updated: %s - %s - %s",
+                             lambda r: (r['worker_phone'], r['workorder'], r['payment_status'])),
+        'payment_disputed': ("Payment discrepancy reported: %s - %s",
+                             lambda r: (r['worker_phone'], r['workorder'])),
+    }
+
+    def __init__(self, log=logger):
+        self.log = log
+
+    def write(self, events):
+        if not self.log.isEnabledFor(logging.INFO):
+            return
+        for event in events:
+            if event.name in self.MESSAGES:
+                message, arguments = self.MESSAGES[event.name]
+                self.log.info(message, *arguments(event.record))
+            else:
+                self.log.info("Event %s (version %s)", event.name, event.version)
+
+    def close(self):
+        pass
+
+
+class AuditFileSink:
+    """Appends events to a JSON-lines file"""
+
+    name = 'audit'
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def write(self, events):
+        data = b''.join(event.to_json() for event in events)
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class NotificationSink:
+    """Stand-in for worker notifications: logs the message it would send"""
+
+    name = 'notifications'
+
+    TEMPLATES = {
+        'payment_allocated': "You have been allocated to workorder {workorder}",
+        'payments_recorded': "Payment recorded for workorder {workorder}; please verify the amount received",
+        'payment_disputed': "Your discrepancy report for workorder {workorder} was received",
+    }
+
+    def __init__(self, latency=0.0, log=logging.getLogger('wpts.notifications')):
+        # Simulated delivery time per message, to exercise the worker pool
+        self.latency = latency
+        self.log = log
+        self.sent = 0
+
+    def write(self, events):
+        for event in events:
+            template = self.TEMPLATES.get(event.name)
+            if template is None:
+                continue
+            record = event.record
+            if 'workers' in record:
+                phones = [worker['phone'] for worker in record['workers']]
+            else:
+                phones = [record['worker_phone']]
+            for phone in phones:
+                if self.latency:
+                    time.sleep(self.latency)
+                self.log.info("SMS to %s: %s", phone, template.format(workorder=record.get('workorder')))
+                self.sent += 1
+
+    def close(self):
+        pass
+
+
+class EventBus:
+    """Bounded queue of events drained to sinks by a pool of worker threads"""
+
+    def __init__(self, sinks=(), max_queued=EVENT_QUEUE_SIZE, workers=EVENT_WORKERS,
+                 batch_size=EVENT_BATCH_SIZE, batch_wait=EVENT_BATCH_WAIT):
+        self.sinks = list(sinks)
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.published = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.batches = 0
+        self.high_watermark = 0
+        self.sink_errors = {sink.name: 0 for sink in self.sinks}
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._counts_lock = threading.Lock()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f'event-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads start with the first event, so a bus created before a
+        # gunicorn fork runs its workers in the child
+        if not self._started:
+            with self._start_lock:
+                if not self._started:
+                    for thread in self._threads:
+                        thread.start()
+                    self._started = True
+
+    def publish(self, name, payload, scopes=(), version=None):
+        """Queue an event for a record serialized to JSON bytes
+
+        Returns False if it was dropped because the queue is full.
+        """
+        if self._closed or not self.sinks:
+            return False
+        self._ensure_started()
+        event = Event(name, payload, tuple(scopes), version, datetime.now().isoformat())
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._counts_lock:
+                self.dropped += 1
+            return False
+        depth = self._queue.qsize()
+        with self._counts_lock:
+            self.published += 1
+            if depth > self.high_watermark:
+                self.high_watermark = depth
+        return True
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch first; the stop is taken again next round
+                self._queue.task_done()
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self._queue.task_done()
+                return
+            for sink in self.sinks:
+                try:
+                    sink.write(batch)
+                except Exception:
+                    with self._counts_lock:
+                        self.sink_errors[sink.name] += 1
+                    logger.exception("Event sink %s failed on %d events", sink.name, len(batch))
+            with self._counts_lock:
+                self.delivered += len(batch)
+                self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """Wait until every queued event was handed to the sinks; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Stop accepting events, deliver the queued ones and close the sinks"""
+        self._closed = True
+        if self._started:
+            stopping = self.flush(timeout)
+            for _ in self._threads:
+                try:
+                    self._queue.put_nowait(_STOP)
+                except queue.Full:
+                    # The flush timed out with the queue still full: leave
+                    # the (daemon) workers rather than block shutdown
+                    logger.warning("Event bus closed with %d events undelivered", self._queue.qsize())
+                    stopping = False
+                    break
+            if stopping:
+                for thread in self._threads:
+                    thread.join(timeout)
+        for sink in self.sinks:
+            sink.close()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'max_queued': self.max_queued,
+            'high_watermark': self.high_watermark,
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'sink_errors': dict(self.sink_errors),
+        }
+
+
+def default_sinks(audit_file=None, notifications=False):
+    """The log sink, plus the audit file and notifications when enabled"""
+    sinks = [LogSink()]
+    if audit_file:
+        sinks.append(AuditFileSink(audit_file))
+    if notifications:
+        sinks.append(NotificationSink())
+    return sinks
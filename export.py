@@ -0,0 +1,153 @@
+"""
+Streaming export of the payment ledger.
+
+The ledger has one row per payment and allocated worker (payments without
+workers get one row with empty worker columns), joined with the worker's
+payment record for the workorder. Rows are produced page by page through
+the store's keyset-paginated `query_payments`, so neither the rows nor the
+encoded file are ever held in memory as a whole.
+
+Formats:
+
+- `csv`: a header line, then one line per row
+- `ndjson`: one JSON object per row
+- `columnar`: NDJSON of row groups; the first line lists the columns, each
+  following line holds `rows` and one array per column (Parquet-style
+  column chunks without a dependency)
+- `parquet`: Apache Parquet, one row group per page (requires pyarrow)
+"""
+import csv
+import io
+
+from aggregates import to_amount
+from serialization import NDJSON_MIMETYPE, dumps
+from store import payment_status_of
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # pyarrow is optional; only the parquet format needs it
+    pyarrow = None
+
+LEDGER_COLUMNS = (
+    'payment_id', 'workorder', 'contractor', 'payment_amount', 'payment_status',
+    'payment_created_at', 'payment_completed_at',
+    'worker_name', 'worker_phone', 'promised_amount', 'actual_paid',
+    'actual_received_by_worker', 'worker_payment_status', 'discrepancy_notes',
+)
+_NUMERIC_COLUMNS = frozenset(('payment_amount', 'promised_amount', 'actual_paid', 'actual_received_by_worker'))
+_NO_WORKER = (None,) * 7
+
+# Payments read from the store per page; also the rows per chunk / row group
+PAGE_SIZE = 1000
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': (NDJSON_MIMETYPE, 'ndjson'),
+    'columnar': (NDJSON_MIMETYPE, 'columnar.ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def _payment_rows(payment, worker_payments):
+    head = (
+        payment['id'], payment['workorder'], payment['contractor'], payment['amount'],
+        payment_status_of(payment), payment['created_at'], payment.get('completed_at'),
+    )
+    if not payment['workers']:
+        yield head + _NO_WORKER
+        return
+    for worker in payment['workers']:
+        wp = worker_payments.get((worker['phone'], payment['workorder']), {})
+        yield head + (
+            worker.get('name'), worker['phone'], wp.get('promised_amount', worker.get('promised_amount')),
+            wp.get('actual_paid'), wp.get('actual_received_by_worker'),
+            wp.get('payment_status'), wp.get('discrepancy_notes'),
+        )
+
+
+def iter_ledger(store, query, page_size=PAGE_SIZE):
+    """Yield ledger pages (lists of row tuples in LEDGER_COLUMNS order) for a ListQuery"""
+    query.limit = page_size
+    while True:
+        payments, cursor = store.query_payments(query)
+        workorders = {payment['workorder'] for payment in payments}
+        worker_payments = {
+            (wp['worker_phone'], wp['workorder']): wp
+            for wp in store.worker_payments_for_workorders(workorders)
+        }
+        page = []
+        for payment in payments:
+            page.extend(_payment_rows(payment, worker_payments))
+        if page:
+            yield page
+        if cursor is None:
+            return
+        query.cursor = cursor
+
+
+def iter_csv(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(LEDGER_COLUMNS)
+    for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def iter_ndjson(pages):
+    for page in pages:
+        yield b''.join(dumps(dict(zip(LEDGER_COLUMNS, row))) + b'\n' for row in page)
+
+
+def iter_columnar(pages):
+    yield dumps({'columns': LEDGER_COLUMNS}) + b'\n'
+    for page in pages:
+        yield dumps({'rows': len(page), 'data': dict(zip(LEDGER_COLUMNS, zip(*page)))}) + b'\n'
+
+
+def _numbers(values):
+    return [None if value is None else to_amount(value) for value in values]
+
+
+def iter_parquet(pages):
+    string, number = pyarrow.string(), pyarrow.float64()
+    schema = pyarrow.schema([
+        (column, pyarrow.int64() if column == 'payment_id'
+         else number if column in _NUMERIC_COLUMNS else string)
+        for column in LEDGER_COLUMNS
+    ])
+    sink = io.BytesIO()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+    for page in pages:
+        columns = [
+            pyarrow.array(_numbers(values) if field.type == number else values, type=field.type)
+            for field, values in zip(schema, zip(*page))
+        ]
+        writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def export_ledger(store, query, fmt):
+    """Yield the encoded ledger of payments matching a ListQuery in an EXPORT_FORMATS format"""
+    pages = iter_ledger(store, query)
+    if fmt == 'csv':
+        return iter_csv(pages)
+    if fmt == 'ndjson':
+        return iter_ndjson(pages)
+    if fmt == 'columnar':
+        return iter_columnar(pages)
+    return iter_parquet(pages)
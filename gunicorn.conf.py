@@ -0,0 +1,67 @@
+"""
+Gunicorn settings for serving the app in production.
+
+`gunicorn main:app` reads this file from the working directory. Every
+setting can be overridden on the command line or through the environment
+variables below.
+
+- Worker class: asgi (gunicorn's asyncio worker, gunicorn 26 or later),
+  serving `main:app`, the ASGI adapter in asgi.py. Connections, idle
+  keep-alives and open event streams (`/api/events`) live on the worker's
+  event loop, up to `GUNICORN_CONNECTIONS` per worker, so a stream holds no
+  thread. Requests run on the adapter's thread pool (`REQUEST_THREADS`),
+  since handlers spend their time waiting on workorder locks, the database
+  or slow mine-site clients rather than on the CPU.
+- Workers: the in-memory store lives inside one process, so it is served
+  by a single worker; with the SQL backend one worker per CPU shares the
+  database.
+- Preload: with the SQL backend the app is imported once in the master and
+  forked, so workers start without re-importing it and fail fast on
+  errors. The in-memory store is not preloaded, because its journal writer
+  thread would not survive the fork.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('APP_ENV', 'production')
+
+_sql_backend = bool(os.environ.get('DATABASE_URL')) or os.environ.get('STORAGE_BACKEND') == 'sql'
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+worker_class = 'asgi'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() if _sql_backend else 1))
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', '10000'))
+
+preload_app = _sql_backend and os.environ['APP_ENV'] == 'production'
+
+# Longer than the idle timeout of the proxy in front, so it never reuses a
+# connection the worker is closing
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '75'))
+timeout = 60
+graceful_timeout = 30
+
+# Recycle workers now and then to bound memory growth; never with the
+# in-memory store, whose records would be lost
+max_requests = 10000 if _sql_backend else 0
+max_requests_jitter = 1000
+
+# Heartbeat files in memory rather than on a possibly slow disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Request timing and counts are in /metrics; only errors are logged
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'warning').lower()
+
+
+def post_fork(server, worker):
+    """Drop database connections the master opened before forking"""
+    if not preload_app:
+        return
+    from main import flask_app
+    from models import db
+
+    with flask_app.app_context():
+        db.engine.dispose(close=False)
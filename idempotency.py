@@ -0,0 +1,181 @@
+"""
+Idempotency keys for mutating endpoints.
+
+A client that may retry a write (a worker on a poor mine-site connection,
+an admin double-submitting a form) sends the same `Idempotency-Key` header
+with every attempt. The first request with a key executes and its response
+is kept for `IDEMPOTENCY_TTL` seconds; later requests with the key get that
+response back without executing again. A retry that arrives while the first
+attempt is still running waits for its result instead of running in
+parallel.
+
+Keys are scoped to the method and path, and tied to a fingerprint of the
+request body: reusing a key for a different request is an error. Responses
+that a retry should re-execute (server errors, conflicts) are not kept.
+
+Streamed uploads (bulk ingest) are not read ahead of the handler: their
+body is hashed while the handler parses it (`HashingReader`), and the
+fingerprint is recorded when the handler is done. A retry of a streamed
+upload is only hashed once it is known to be a replay.
+
+The cache holds at most `IDEMPOTENCY_MAX_KEYS` keys per process, oldest
+first out, and serves the in-memory store, which runs in one process. The
+SQL backend, whose workers share the database, keeps its keys in a table
+instead (`sql_store.SQLIdempotencyStore`).
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a response is kept for replay
+IDEMPOTENCY_TTL = 86400
+
+# Keys kept per process
+IDEMPOTENCY_MAX_KEYS = 10000
+
+# Seconds a retry waits for a concurrent first attempt to finish
+IDEMPOTENCY_WAIT = 30
+
+MAX_KEY_LENGTH = 255
+
+# Statuses a retry should re-execute rather than replay
+RETRYABLE_STATUSES = frozenset((409, 429))
+
+# Response headers not stored for replay
+_UNSTORED_HEADERS = frozenset(('content-length', 'date', 'set-cookie'))
+
+
+class IdempotencyMismatch(Exception):
+    """Raised when a key is reused for a different request"""
+
+
+class IdempotencyInProgress(Exception):
+    """Raised when the first request with a key is still running after the wait"""
+
+
+def request_fingerprint(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+class HashingReader(io.RawIOBase):
+    """Pass a stream through while computing its `request_fingerprint`"""
+
+    CHUNK = 64 * 1024
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        self._hash.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def finish(self):
+        """Read whatever the consumer left unread and return the fingerprint"""
+        while True:
+            data = self._stream.read(self.CHUNK)
+            if not data:
+                return self._hash.hexdigest()
+            self._hash.update(data)
+
+
+def stream_fingerprint(stream):
+    """Fingerprint of a body read from a stream in chunks"""
+    return HashingReader(stream).finish()
+
+
+def replayable(status):
+    return status < 500 and status not in RETRYABLE_STATUSES
+
+
+class IdempotencyEntry:
+    """One key: pending until its first request finishes, then its response"""
+
+    __slots__ = ('key', 'fingerprint', 'response', 'expires', 'done')
+
+    def __init__(self, key, fingerprint):
+        self.key = key
+        self.fingerprint = fingerprint
+        # (status, headers, body) once completed
+        self.response = None
+        self.expires = float('inf')
+        self.done = threading.Event()
+
+
+class IdempotencyCache:
+    """Bounded TTL map of idempotency keys to stored responses"""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.replays = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        # Entries are in completion order, so expired ones are at the front;
+        # a pending entry stops the scan until it completes
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry.expires > now:
+                return
+            del self._entries[entry.key]
+
+    def begin(self, key, fingerprint, timeout=IDEMPOTENCY_WAIT):
+        """Claim a key, or wait for the request that holds it.
+
+        Returns `(entry, True)` when the caller should execute the request
+        and later `complete` or `abandon` the entry, and `(entry, False)`
+        when `entry.response` holds the response to replay. A `fingerprint`
+        of None (streamed bodies) defers the comparison to the caller, who
+        sets `entry.fingerprint` before completing an entry it executed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._expire(time.monotonic())
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = IdempotencyEntry(key, fingerprint)
+                    if len(self._entries) > self.max_keys:
+                        self._entries.popitem(last=False)
+                    return entry, True
+                if fingerprint is not None and entry.fingerprint != fingerprint:
+                    raise IdempotencyMismatch(key)
+                if entry.response is not None:
+                    self.replays += 1
+                    return entry, False
+            # Another request is executing with this key; an abandoned entry
+            # is removed, so the next pass claims the key
+            if not entry.done.wait(max(0.0, deadline - time.monotonic())):
+                raise IdempotencyInProgress(key)
+
+    def complete(self, entry, status, headers, body):
+        """Store the response of a claimed key for replay"""
+        with self._lock:
+            entry.response = (status, headers, body)
+            entry.expires = time.monotonic() + self.ttl
+            if self._entries.get(entry.key) is entry:
+                self._entries.move_to_end(entry.key)
+        entry.done.set()
+
+    def abandon(self, entry):
+        """Release a claimed key without a response, so a retry executes again"""
+        with self._lock:
+            if self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+        entry.done.set()
+
+
+def stored_headers(headers):
+    return [(name, value) for name, value in headers.items() if name.lower() not in _UNSTORED_HEADERS]
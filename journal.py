@@ -0,0 +1,287 @@
+"""
+Write-ahead journal and snapshots for the in-memory store.
+
+Every change the store makes (the record as written, after its version is
+assigned) is appended to a journal segment as a length- and CRC-prefixed
+pickle frame. A background writer thread collects appended frames into
+batches and writes each batch with a single fsync (group commit); request
+handlers wait for their own frames in `store.commit()`, so an acknowledged
+write is on disk while concurrent writes share the cost of one fsync.
+
+Every `snapshot_every` changes all records are pickled into
+`snapshot.bin` and the journal moves on to a new segment; segments covered
+by the snapshot are then deleted. On startup the snapshot is loaded and the
+remaining segments are replayed, skipping changes the snapshot already
+contains and stopping at a torn frame at the end of a segment.
+
+If a write or fsync fails (disk full, I/O error) the writer stops: waiting
+requests and every later change get a `JournalError`, so writes fail
+instead of waiting for a flush that will never happen.
+
+The journal directory belongs to a single process.
+"""
+import gc
+import glob
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+SNAPSHOT_FILE = 'snapshot.bin'
+SNAPSHOT_MAGIC = b'WPTSSNAP1\n'
+
+# Frame header: payload length and CRC-32
+FRAME = struct.Struct('<II')
+
+# Seconds the writer waits for more changes before writing a batch; with 0
+# a batch is whatever was appended while the previous fsync ran
+SYNC_INTERVAL = 0
+
+# Changes journaled between snapshots
+SNAPSHOT_EVERY = 100000
+
+logger = logging.getLogger('wpts.journal')
+
+
+class JournalError(Exception):
+    """Raised when the snapshot cannot be read or the journal cannot be written"""
+
+
+def _segment_path(directory, start_version):
+    return os.path.join(directory, f'journal-{start_version:020d}.log')
+
+
+def _segments(directory):
+    return sorted(glob.glob(os.path.join(directory, 'journal-*.log')))
+
+
+def _frame(payload):
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_segment(path):
+    """Return the (kind, record) changes of a segment and the length of its valid prefix"""
+    changes = []
+    valid = 0
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(FRAME.size)
+            if len(header) < FRAME.size:
+                break
+            length, crc = FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            changes.append(pickle.loads(payload))
+            valid += FRAME.size + length
+    return changes, valid
+
+
+def write_snapshot(directory, data):
+    """Atomically replace the snapshot file"""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_frame(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    _fsync_directory(directory)
+
+
+def read_snapshot(directory):
+    """Return the state saved in the snapshot file, or None if there is none"""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise JournalError(f"{path} is not a snapshot file")
+        header = f.read(FRAME.size)
+        length, crc = FRAME.unpack(header) if len(header) == FRAME.size else (0, None)
+        data = f.read(length)
+    if len(data) < length or zlib.crc32(data) != crc:
+        raise JournalError(f"{path} is corrupt")
+    return pickle.loads(data)
+
+
+class Journal:
+    """Append-only change log with batched fsync and periodic snapshots"""
+
+    def __init__(self, directory, sync_interval=SYNC_INTERVAL, snapshot_every=SNAPSHOT_EVERY):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        self.store = None
+
+        # Pending frames, or segment paths marking a rotation point
+        self._buffer = []
+        self._appended = 0
+        self._synced = 0
+        self._since_snapshot = 0
+        self._snapshotting = False
+        self._closed = False
+        # Error that stopped the writer; changes can no longer be made durable
+        self._error = None
+        self._file = None
+        self._thread = None
+        self._condition = threading.Condition()
+
+    def start(self, store):
+        """Open a new segment after the store's current version and start writing"""
+        self.store = store
+        self._file = open(_segment_path(self.directory, store.version + 1), 'ab')
+        self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self._thread.start()
+        store.attach_journal(self)
+
+    def append(self, kind, record):
+        """Queue a change; returns its sequence number for `wait`"""
+        frame = _frame(pickle.dumps((kind, record), pickle.HIGHEST_PROTOCOL))
+        with self._condition:
+            self._check()
+            if not self._buffer:
+                self._condition.notify_all()
+            self._buffer.append(frame)
+            self._appended += 1
+            self._since_snapshot += 1
+            return self._appended
+
+    def wait(self, seq):
+        """Block until the change with sequence number `seq` is on disk"""
+        with self._condition:
+            while self._synced < seq and not self._closed:
+                self._check()
+                self._condition.wait()
+
+    def _check(self):
+        if self._error is not None:
+            raise JournalError(f"Journal writes failed: {self._error}") from self._error
+
+    def rotate(self, start_version):
+        """Continue in a new segment; changes queued so far stay in the current one"""
+        with self._condition:
+            self._buffer.append(_segment_path(self.directory, start_version))
+            self._since_snapshot = 0
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """Snapshot the store and delete the segments it covers"""
+        try:
+            version, data = self.store.dump_state()
+            write_snapshot(self.directory, data)
+            # Segments before the one started at the snapshot are covered by it
+            current = _segment_path(self.directory, version + 1)
+            for path in _segments(self.directory):
+                if path < current:
+                    os.remove(path)
+        finally:
+            with self._condition:
+                self._snapshotting = False
+
+    def close(self):
+        """Write out pending changes and stop the writer"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._buffer and not self._closed:
+                    self._condition.wait()
+                if not self._buffer:
+                    self._file.close()
+                    return
+            if self.sync_interval:
+                # Let concurrent writers join the batch
+                time.sleep(self.sync_interval)
+
+            with self._condition:
+                batch, self._buffer = self._buffer, []
+                seq = self._appended
+                start_snapshot = (self._since_snapshot >= self.snapshot_every
+                                  and not self._snapshotting and not self._closed)
+                if start_snapshot:
+                    self._snapshotting = True
+            try:
+                self._write(batch)
+            except OSError as e:
+                logger.critical("Journal write failed, writes are no longer accepted: %s", e)
+                with self._condition:
+                    self._error = e
+                    self._condition.notify_all()
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                return
+            with self._condition:
+                self._synced = seq
+                self._condition.notify_all()
+            if start_snapshot:
+                threading.Thread(target=self.snapshot, name='journal-snapshot', daemon=True).start()
+
+    def _write(self, batch):
+        frames = []
+        for item in batch:
+            if isinstance(item, bytes):
+                frames.append(item)
+                continue
+            # Rotation point: finish the current segment, continue in the next
+            self._sync(frames)
+            frames = []
+            self._file.close()
+            self._file = open(item, 'ab')
+            _fsync_directory(self.directory)
+        self._sync(frames)
+
+    def _sync(self, frames):
+        if frames:
+            self._file.write(b''.join(frames))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+def open_journal(store, directory, **options):
+    """Restore an empty store from `directory` and journal its changes from now on"""
+    os.makedirs(directory, exist_ok=True)
+    # Restoring allocates millions of long-lived objects; cyclic garbage
+    # collection passes over them would only slow it down
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        state = read_snapshot(directory)
+        if state is not None:
+            store.load_state(state)
+
+        for path in _segments(directory):
+            changes, valid = read_segment(path)
+            for kind, record in changes:
+                if record['version'] > store.version:
+                    store.replay_change(kind, record)
+            if valid < os.path.getsize(path):
+                # Drop a torn write at the end so later appends stay readable
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+    finally:
+        if collecting:
+            gc.enable()
+
+    journal = Journal(directory, **options)
+    journal.start(store)
+    return journal
@@ -0,0 +1,114 @@
+"""
+Query-string handling for the admin list endpoints.
+
+`GET /api/admin/payments` and `GET /api/admin/worker-payments` accept:
+
+- filters: `contractor`, `workorder`, `status`, `created_from`, `created_to`
+  (and `worker_phone` for worker payment records)
+- sorting: `sort=created_at` (oldest first, the default) or `sort=-created_at`
+- keyset pagination: `limit` and `cursor`; when more records follow, the
+  response carries the cursor for the next page in `X-Next-Cursor`
+- projection: `fields=id,workorder,...` to return only those keys
+
+Without `limit` the full matching list is returned, as before.
+
+`GET /api/admin/discrepancies` takes `contractor`, `limit` and `cursor`; its
+cursor is the `shortfall:id` of the last record of the previous page.
+
+`GET /api/admin/export/ledger` takes the payment filters and `sort`; it
+streams every matching payment, so `limit` does not apply.
+"""
+from datetime import datetime
+
+from store import ListQuery
+
+MAX_PAGE_SIZE = 1000
+
+PAYMENT_STATUSES = ('unallocated', 'assigned', 'completed')
+WORKER_PAYMENT_STATUSES = ('allocated', 'pending', 'verified', 'disputed')
+
+
+class ListQueryError(ValueError):
+    """Raised for an invalid list query parameter"""
+
+
+def _parse_timestamp(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ListQueryError(f"{name} must be an ISO 8601 date or timestamp")
+
+
+def _parse_positive_int(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ListQueryError(f"{name} must be a positive integer")
+    if number <= 0:
+        raise ListQueryError(f"{name} must be a positive integer")
+    return number
+
+
+def parse_list_query(args, statuses, allow_worker_phone=False):
+    """Build a ListQuery from request arguments, raising ListQueryError if invalid"""
+    status = args.get('status')
+    if status is not None and status not in statuses:
+        raise ListQueryError(f"status must be one of: {', '.join(statuses)}")
+
+    sort = args.get('sort', 'created_at')
+    if sort not in ('created_at', '-created_at'):
+        raise ListQueryError("sort must be created_at or -created_at")
+
+    limit = _parse_positive_int(args, 'limit')
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    return ListQuery(
+        contractor=args.get('contractor'),
+        workorder=args.get('workorder'),
+        status=status,
+        worker_phone=args.get('worker_phone') if allow_worker_phone else None,
+        created_from=_parse_timestamp(args, 'created_from'),
+        created_to=_parse_timestamp(args, 'created_to'),
+        descending=sort.startswith('-'),
+        cursor=_parse_positive_int(args, 'cursor'),
+        limit=limit,
+    )
+
+
+def parse_discrepancy_query(args):
+    """Build a ListQuery for the discrepancy queue, raising ListQueryError if invalid"""
+    cursor = args.get('cursor')
+    if cursor is not None:
+        try:
+            shortfall, record_id = cursor.rsplit(':', 1)
+            cursor = (float(shortfall), int(record_id))
+        except ValueError:
+            raise ListQueryError("cursor must be a value from X-Next-Cursor")
+
+    limit = _parse_positive_int(args, 'limit')
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    return ListQuery(contractor=args.get('contractor'), cursor=cursor, limit=limit)
+
+
+def parse_fields(args):
+    """Return the requested `fields=` projection as a tuple, or None for all fields"""
+    fields = args.get('fields')
+    if not fields:
+        return None
+    return tuple(field.strip() for field in fields.split(',') if field.strip())
+
+
+def project(records, fields):
+    """Restrict each record to the requested fields"""
+    if fields is None:
+        return records
+    return [{field: record[field] for field in fields if field in record} for record in records]
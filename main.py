@@ -1,4 +1,11 @@
-from app import app
+from app import create_app
+from asgi import ASGIApp
+
+flask_app = create_app()
+
+# Entry point: `gunicorn main:app` (settings in gunicorn.conf.py) serves it
+# over ASGI; it is also a WSGI app
+app = ASGIApp(flask_app, threads=flask_app.config['REQUEST_THREADS'])
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    flask_app.run(host='0.0.0.0', port=5000, debug=flask_app.debug)
@@ -0,0 +1,148 @@
+"""
+Relational schema for the SQL storage backend.
+
+Payments, the workers each payment is allocated to, and the per-worker
+payment records are kept in separate tables, indexed on the columns the
+API looks records up by (workorder, contractor, worker phone).
+"""
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    JSON, BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary,
+    String, Text, UniqueConstraint,
+)
+from sqlalchemy.orm import DeclarativeBase, relationship
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+db = SQLAlchemy(model_class=Base)
+
+
+class Payment(db.Model):
+    __tablename__ = 'payments'
+
+    id = Column(Integer, primary_key=True)
+    workorder = Column(String(128), nullable=False, index=True)
+    contractor = Column(String(256), nullable=False)
+    contractor_key = Column(String(256), nullable=False, index=True)
+    amount = Column(Float, nullable=False)
+    allocated = Column(Boolean, nullable=False, default=False)
+    work_status = Column(String(32), index=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+    updated_at = Column(DateTime, nullable=False)
+    completed_at = Column(DateTime)
+    version = Column(BigInteger, nullable=False, default=0, index=True)
+
+    # Optimistic concurrency: UPDATEs must match the version the row was
+    # read at; the store assigns new versions itself
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+    workers = relationship(
+        'PaymentWorker', back_populates='payment', order_by='PaymentWorker.position',
+        cascade='all, delete-orphan', lazy='selectin',
+    )
+
+
+class PaymentWorker(db.Model):
+    """A worker allocated to a payment; `data` holds the worker as submitted"""
+    __tablename__ = 'payment_workers'
+
+    id = Column(Integer, primary_key=True)
+    payment_id = Column(Integer, ForeignKey('payments.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    phone = Column(String(32), nullable=False)
+    name = Column(String(256), nullable=False)
+    name_key = Column(String(256), nullable=False)
+    data = Column(JSON, nullable=False)
+
+    payment = relationship('Payment', back_populates='workers')
+
+    __table_args__ = (
+        Index('ix_payment_workers_payment_position', 'payment_id', 'position'),
+        # Worker directory lookups (login by phone and case-insensitive name)
+        Index('ix_payment_workers_phone_name_key', 'phone', 'name_key'),
+    )
+
+
+class WorkerPayment(db.Model):
+    __tablename__ = 'worker_payments'
+
+    id = Column(Integer, primary_key=True)
+    worker_phone = Column(String(32), nullable=False, index=True)
+    worker_name = Column(String(256))
+    workorder = Column(String(128), nullable=False, index=True)
+    contractor = Column(String(256), nullable=False)
+    contractor_key = Column(String(256), nullable=False, index=True)
+    promised_amount = Column(Float, nullable=False, default=0)
+    actual_paid = Column(Float, nullable=False, default=0)
+    actual_received_by_worker = Column(Float)
+    payment_status = Column(String(32), nullable=False, index=True)
+    work_status = Column(String(32), nullable=False)
+    discrepancy_notes = Column(Text)
+    discrepancy_reported_at = Column(DateTime)
+    # Shortfall of an open discrepancy (see discrepancies.py), NULL if none
+    shortfall = Column(Float)
+    created_at = Column(DateTime, nullable=False, index=True)
+    updated_at = Column(DateTime, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('worker_phone', 'workorder', name='uq_worker_payments_phone_workorder'),
+        # Discrepancy queue, largest shortfall first, overall and per contractor
+        Index('ix_worker_payments_shortfall', 'shortfall', 'id'),
+        Index('ix_worker_payments_contractor_shortfall', 'contractor_key', 'shortfall', 'id'),
+    )
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+
+class StoreVersion(db.Model):
+    """Last change version of a scope (global, a worker phone or a contractor)"""
+    __tablename__ = 'store_versions'
+
+    scope = Column(String(300), primary_key=True)
+    version = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class SummaryTotal(db.Model):
+    """Running reconciliation totals of a contractor key, or '*' for all contractors"""
+    __tablename__ = 'summary_totals'
+
+    scope = Column(String(256), primary_key=True)
+    contractor = Column(String(256))
+    payments = Column(BigInteger, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    worker_payments = Column(BigInteger, nullable=False, default=0)
+    promised_amount = Column(Float, nullable=False, default=0)
+    actual_paid = Column(Float, nullable=False, default=0)
+    actual_received_by_worker = Column(Float, nullable=False, default=0)
+    received_count = Column(BigInteger, nullable=False, default=0)
+    received_paid = Column(Float, nullable=False, default=0)
+
+
+class SummaryCount(db.Model):
+    """Number of records per status within a summary scope"""
+    __tablename__ = 'summary_counts'
+
+    scope = Column(String(256), primary_key=True)
+    kind = Column(String(32), primary_key=True)
+    status = Column(String(32), primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+class IdempotencyKey(db.Model):
+    """An Idempotency-Key claimed by a request, seen by every worker (see idempotency.py)
+
+    Pending while `status` is NULL. `expires` (epoch seconds) ends the claim
+    of a request that never finished, or the replay window of its response.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key_hash = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64))
+    status = Column(Integer)
+    headers = Column(JSON)
+    body = Column(LargeBinary)
+    expires = Column(Float, nullable=False, index=True)
@@ -0,0 +1,253 @@
+"""
+Rate limiting and admission control for the worker-facing endpoints.
+
+Worker login, the per-worker payment list and the verification endpoints
+are public. At shift change thousands of phones call them at once, and
+retries pile on top; without limits they take every thread and the admin
+endpoints served by the same workers stall.
+
+Two checks run before a worker-facing handler:
+
+- Token buckets, one per client IP (`RATE_LIMIT_IP`) and one per worker
+  phone (`RATE_LIMIT_PHONE`, stricter for login: `RATE_LIMIT_LOGIN`). A
+  limit `"<count>/<seconds>"` allows bursts of `count` requests, refilled
+  evenly over `seconds`. An empty bucket is answered with 429 and a
+  Retry-After of the time until the next token.
+- A cap on worker-facing requests in progress (`WORKER_MAX_CONCURRENT`).
+  A request over the cap is answered at once with 503 and Retry-After
+  rather than queued, so the remaining threads stay free for admins.
+
+Buckets live in process memory (`LocalBuckets`): a check is a dict lookup
+and a few float operations under a lock. With several gunicorn workers
+each worker keeps its own buckets; set `RATE_LIMIT_REDIS_URL` to share
+them through Redis (`RedisBuckets`, one round trip per check), which falls
+back to the local buckets while Redis is unreachable. After a failed call
+Redis is left alone for `REDIS_RETRY_AFTER` seconds, so an outage costs one
+timeout per window rather than one per check.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    # redis is optional; only the shared backend needs it
+    redis = None
+
+# Default limits, as "<burst>/<seconds>"
+RATE_LIMIT_IP = '600/60'
+RATE_LIMIT_PHONE = '60/60'
+RATE_LIMIT_LOGIN = '10/60'
+
+# Worker-facing requests handled at once per process
+WORKER_MAX_CONCURRENT = 12
+
+# Buckets kept per process before the least recently used are dropped
+MAX_BUCKETS = 100000
+
+# Seconds a client over the concurrency cap is asked to wait
+OVERLOAD_RETRY_AFTER = 1
+
+# Seconds a Redis check may take before the local buckets are used
+REDIS_TIMEOUT = 0.05
+
+# Seconds the local buckets are used after a Redis failure before Redis is tried again
+REDIS_RETRY_AFTER = 5
+
+logger = logging.getLogger('wpts.ratelimit')
+
+
+class Limit:
+    """A token bucket size and refill rate"""
+
+    __slots__ = ('burst', 'rate')
+
+    def __init__(self, burst, period):
+        if burst < 1 or period <= 0:
+            raise ValueError("A limit needs a burst of at least 1 and a positive period")
+        self.burst = burst
+        # Tokens added per second
+        self.rate = burst / period
+
+    @classmethod
+    def parse(cls, text):
+        """Parse "<burst>/<seconds>", e.g. "60/60" for 60 a minute"""
+        burst, _, period = text.partition('/')
+        try:
+            return cls(int(burst), float(period or 1))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {text!r}, expected <count>/<seconds>") from None
+
+
+class LocalBuckets:
+    """Token buckets in process memory"""
+
+    name = 'local'
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        # key -> (tokens, last refill time); least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, limit):
+        """Take a token; returns 0 when allowed, else the seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = limit.burst
+            else:
+                tokens = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+                self._buckets.move_to_end(key)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / limit.rate
+            # A dropped bucket starts full again; only idle ones get this old
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+# Token bucket in a Redis hash; returns the wait in seconds (0 when allowed)
+_TAKE_SCRIPT = """
+local burst, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = burst
+if bucket[1] then
+    tokens = math.min(burst, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by all processes through Redis"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='wpts:ratelimit:', fallback=None, retry_after=REDIS_RETRY_AFTER):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT,
+                                           socket_connect_timeout=REDIS_TIMEOUT)
+        self.prefix = prefix
+        self.fallback = fallback or LocalBuckets()
+        self.retry_after = retry_after
+        self.errors = 0
+        # Until this monotonic time Redis is not called (circuit open)
+        self._retry_at = 0.0
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def __len__(self):
+        return len(self.fallback)
+
+    def take(self, key, limit):
+        if self._retry_at:
+            now = time.monotonic()
+            if now < self._retry_at:
+                return self.fallback.take(key, limit)
+            # This check probes Redis; concurrent ones stay local meanwhile
+            self._retry_at = now + self.retry_after
+        try:
+            wait = float(self._take(keys=[self.prefix + key], args=[limit.burst, limit.rate, time.time()]))
+        except redis.RedisError as e:
+            # Keep limiting per process rather than failing requests, and
+            # skip Redis for a while instead of waiting on it every check
+            self._retry_at = time.monotonic() + self.retry_after
+            self.errors += 1
+            if self.errors == 1 or self.errors % 1000 == 0:
+                logger.warning("Rate limit backend unavailable (%s errors), using local buckets: %s",
+                               self.errors, e)
+            return self.fallback.take(key, limit)
+        self._retry_at = 0.0
+        return wait
+
+
+class RateLimiter:
+    """Per-IP and per-phone token buckets plus a cap on concurrent requests"""
+
+    def __init__(self, buckets=None, ip_limit=RATE_LIMIT_IP, phone_limit=RATE_LIMIT_PHONE,
+                 login_limit=RATE_LIMIT_LOGIN, max_concurrent=WORKER_MAX_CONCURRENT):
+        self.buckets = buckets or LocalBuckets()
+        self.ip_limit = Limit.parse(ip_limit)
+        self.phone_limit = Limit.parse(phone_limit)
+        self.login_limit = Limit.parse(login_limit)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.allowed = 0
+        self.limited = {'ip': 0, 'phone': 0}
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def check(self, ip, phone=None, login=False):
+        """Take a token for the client IP and phone.
+
+        Returns `(None, 0)` when allowed, else the limit that was hit
+        ('ip' or 'phone') and the seconds to wait.
+        """
+        wait = self.buckets.take(f'ip:{ip}', self.ip_limit)
+        if wait:
+            return self._limited('ip', wait)
+        if phone:
+            if login:
+                wait = self.buckets.take(f'login:{phone}', self.login_limit)
+            else:
+                wait = self.buckets.take(f'phone:{phone}', self.phone_limit)
+            if wait:
+                return self._limited('phone', wait)
+        return None, 0
+
+    def _limited(self, reason, wait):
+        with self._lock:
+            self.limited[reason] += 1
+        return reason, wait
+
+    def admit(self):
+        """Start a request; returns False when the concurrency cap is reached"""
+        with self._lock:
+            if self.active >= self.max_concurrent:
+                self.shed += 1
+                return False
+            self.active += 1
+            self.allowed += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.buckets.name,
+                'buckets': len(self.buckets),
+                'active': self.active,
+                'max_concurrent': self.max_concurrent,
+                'allowed': self.allowed,
+                'limited': dict(self.limited),
+                'shed': self.shed,
+            }
+
+
+def open_limiter(redis_url=None, **limits):
+    """A RateLimiter on local buckets, or on Redis when a URL is given"""
+    if redis_url:
+        return RateLimiter(RedisBuckets(redis_url), **limits)
+    return RateLimiter(**limits)
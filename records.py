@@ -0,0 +1,188 @@
+"""
+Compact in-memory representation of worker payment records and of the
+workers allocated to a payment.
+
+With millions of records, plain dicts dominate resident memory: every record
+repeats its keys, ISO timestamp strings and contractor/workorder strings.
+The classes here keep the known fields in slots, intern the strings that
+repeat across records (phones, names, contractors, workorders, statuses)
+and hold naive timestamps as integer microseconds since the epoch.
+
+They behave as mutable mappings in the API shape, so handlers read and
+update them exactly like the dicts they replace: an unset slot is a missing
+key, timestamps read back as the ISO strings they were written as, and keys
+without a slot are kept in a small overflow dict. They are turned into
+plain dicts only when serialized (`to_dict`).
+"""
+import sys
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _to_epoch(value):
+    """Store a naive ISO timestamp as integer microseconds; anything else as is"""
+    if type(value) is not str:
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if moment.tzinfo is not None or moment.isoformat() != value:
+        return value
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def _from_epoch(value):
+    if type(value) is not int:
+        return value
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class CompactRecord(MutableMapping):
+    """Slotted mapping; subclasses list their fields in `FIELDS`"""
+
+    __slots__ = ('_extra',)
+
+    FIELDS = ()
+    INTERNED = frozenset()
+    TIMESTAMPS = frozenset()
+    _FIELD_SET = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, fields=(), **kwargs):
+        self._extra = None
+        self.update(fields, **kwargs)
+
+    @classmethod
+    def from_mapping(cls, fields):
+        """Return `fields` itself if it is already of this class, else a compact copy"""
+        return fields if type(fields) is cls else cls(fields)
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return _from_epoch(value) if key in self.TIMESTAMPS else value
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            if key in self.INTERNED:
+                value = _intern(value)
+            elif key in self.TIMESTAMPS:
+                value = _to_epoch(value)
+            setattr(self, key, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def clear(self):
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                delattr(self, field)
+        self._extra = None
+
+    def copy(self):
+        clone = type(self).__new__(type(self))
+        for field in self.FIELDS:
+            if hasattr(self, field):
+                setattr(clone, field, getattr(self, field))
+        clone._extra = dict(self._extra) if self._extra is not None else None
+        return clone
+
+    def to_dict(self):
+        """The record in its API (JSON) shape"""
+        return {key: self[key] for key in self}
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __getstate__(self):
+        return {field: getattr(self, field) for field in self.FIELDS if hasattr(self, field)}, self._extra
+
+    def __setstate__(self, state):
+        fields, self._extra = state
+        for field, value in fields.items():
+            setattr(self, field, _intern(value) if field in self.INTERNED else value)
+
+
+class WorkerPaymentRecord(CompactRecord):
+    """A worker's payment record for one workorder"""
+
+    FIELDS = (
+        'id', 'worker_phone', 'worker_name', 'workorder', 'contractor',
+        'promised_amount', 'actual_paid', 'actual_received_by_worker',
+        'payment_status', 'work_status', 'discrepancy_notes', 'discrepancy_reported_at',
+        'created_at', 'updated_at', 'version',
+    )
+    INTERNED = frozenset((
+        'worker_phone', 'worker_name', 'workorder', 'contractor', 'payment_status', 'work_status',
+    ))
+    TIMESTAMPS = frozenset(('discrepancy_reported_at', 'created_at', 'updated_at'))
+
+    __slots__ = FIELDS
+
+
+class AllocatedWorker(CompactRecord):
+    """A worker in a payment's `workers` list"""
+
+    FIELDS = (
+        'name', 'phone', 'promised_amount', 'actual_paid', 'payment_status',
+        'actual_received_by_worker', 'discrepancy_notes',
+    )
+    INTERNED = frozenset(('name', 'phone', 'payment_status'))
+
+    __slots__ = FIELDS
+
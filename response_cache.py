@@ -0,0 +1,126 @@
+"""
+Cache of serialized list responses for the per-worker and per-contractor
+endpoints.
+
+The worker tab polls `/api/worker/<phone>/payments` and the contractor view
+`/api/payments/contractor/<name>`; between writes every poll serializes the
+same records again. Responses are kept as their encoded body, keyed by the
+change scope (`phone:<phone>`, `contractor:<normalized name>`) and the
+request variant (URL and Accept header), together with the scope's version
+at the time they were built.
+
+Entries are dropped when a write commits to their scope (`invalidate`), and
+a lookup also checks the stored version against the store's current one, so
+writes made by another gunicorn worker are never served stale. At most
+`RESPONSE_CACHE_SIZE` entries are kept, least recently used first out, and
+each for at most `RESPONSE_CACHE_TTL` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Responses kept per process
+RESPONSE_CACHE_SIZE = 2048
+
+# Seconds a response is kept
+RESPONSE_CACHE_TTL = 300
+
+
+class ResponseCache:
+    """LRU/TTL map of (scope, variant) to a serialized response body"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # scope kind ('phone', 'contractor') -> [hits, misses]
+        self._lookups = {}
+        self.invalidations = 0
+        self.evictions = 0
+        self.bytes = 0
+        # (scope, variant) -> (version, expires, body, mimetype)
+        self._entries = OrderedDict()
+        # scope -> keys of its entries, for invalidation
+        self._by_scope = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= len(entry[2])
+        keys = self._by_scope[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_scope[key[0]]
+
+    def get(self, scope, variant, version):
+        """Return (body, mimetype) built at `version`, or None"""
+        key = (scope, variant)
+        with self._lock:
+            lookups = self._lookups.get(_kind(scope))
+            if lookups is None:
+                lookups = self._lookups[_kind(scope)] = [0, 0]
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                lookups[1] += 1
+                return None
+            self._entries.move_to_end(key)
+            lookups[0] += 1
+            return entry[2], entry[3]
+
+    def put(self, scope, variant, version, body, mimetype):
+        """Keep a response body built at the scope's `version`"""
+        key = (scope, variant)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, time.monotonic() + self.ttl, body, mimetype)
+            self._by_scope.setdefault(scope, set()).add(key)
+            self.bytes += len(body)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, scope):
+        """Drop the responses of a scope after a write to it"""
+        with self._lock:
+            keys = self._by_scope.get(scope)
+            if not keys:
+                return
+            for key in list(keys):
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self):
+        """Size, invalidations and evictions, with hits and hit rate per scope kind and overall"""
+        with self._lock:
+            entries = {}
+            for scope, keys in self._by_scope.items():
+                entries[_kind(scope)] = entries.get(_kind(scope), 0) + len(keys)
+            by_kind = {
+                kind: dict(_hit_stats(hits, misses), entries=entries.get(kind, 0))
+                for kind, (hits, misses) in sorted(self._lookups.items())
+            }
+            hits = sum(lookups[0] for lookups in self._lookups.values())
+            misses = sum(lookups[1] for lookups in self._lookups.values())
+            return dict(
+                _hit_stats(hits, misses),
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                bytes=self.bytes,
+                invalidations=self.invalidations,
+                evictions=self.evictions,
+                by_kind=by_kind,
+            )
+
+
+def _kind(scope):
+    return scope.partition(':')[0]
+
+
+def _hit_stats(hits, misses):
+    lookups = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / lookups, 4) if lookups else 0.0}
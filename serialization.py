@@ -0,0 +1,103 @@
+"""
+JSON serialization for API responses.
+
+`dumps` encodes with orjson when it is installed and with the standard
+library otherwise; both sort keys and accept the store's compact records
+(records.py). `JSONProvider` plugs it into Flask, so `jsonify` uses it too.
+
+Large lists are streamed instead of being encoded as one string: the body
+is produced in batches of `STREAM_BATCH` records, either as a JSON array or,
+when the client asks for it with `Accept: application/x-ndjson`, as one JSON
+object per line.
+"""
+import json
+from collections.abc import Mapping
+from itertools import islice
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the standard library encoder is used without it
+    orjson = None
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+NDJSON_MIMETYPES = (NDJSON_MIMETYPE, 'application/ndjson', 'application/jsonl')
+
+# Records encoded per chunk of a streamed body
+STREAM_BATCH = 500
+
+# Lists longer than this are streamed even as a JSON array
+STREAM_MIN_RECORDS = 1000
+
+
+def _default(value):
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    return DefaultJSONProvider.default(value)
+
+
+if orjson is not None:
+    def dumps(obj):
+        """Encode an object as compact JSON bytes"""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=_default)
+
+    def dumps(obj):
+        """Encode an object as compact JSON bytes"""
+        return _encoder.encode(obj).encode()
+
+    loads = json.loads
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by `dumps` / `loads`"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        response = self._app.response_class(dumps(obj) + b"\n", mimetype=self.mimetype)
+        # Kept so the body can be encoded again once the request's writes
+        # are committed (see commit_store in app.py)
+        response.json_source = obj
+        return response
+
+
+def wants_ndjson(accept_mimetypes):
+    """Whether the request's Accept header prefers NDJSON over a JSON array"""
+    best = accept_mimetypes.best_match(('application/json',) + NDJSON_MIMETYPES)
+    return best in NDJSON_MIMETYPES
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_json_array(records, batch=STREAM_BATCH):
+    """Yield a JSON array of records in chunks"""
+    yield b'['
+    separator = b''
+    for chunk in _batches(records, batch):
+        yield separator + b','.join(dumps(record) for record in chunk)
+        separator = b','
+    yield b']\n'
+
+
+def iter_ndjson(records, batch=STREAM_BATCH):
+    """Yield records as newline-delimited JSON in chunks"""
+    for chunk in _batches(records, batch):
+        yield b''.join(dumps(record) + b'\n' for record in chunk)
@@ -0,0 +1,726 @@
+"""
+SQL storage backend (Flask-SQLAlchemy).
+
+Implements the same interface as `store.InMemoryStore` on top of the schema
+in `models.py`, so several gunicorn workers can share one database. Records
+are handed to the request handlers as plain dicts in the API shape; handlers
+mutate them and call `save_payment` / `save_worker_payment` to write the
+changes back. Writes are flushed immediately and committed once per request
+(see `commit` / `rollback`).
+
+Concurrency across workers: `lock(workorder)` takes row locks (SELECT ...
+FOR UPDATE) on the workorder's payments and worker payment records until
+commit, and every UPDATE is checked against the version the row was read
+at, raising `StoreConflict` instead of silently overwriting a newer write.
+
+The shared rows every write changes (the global version counter, the scope
+versions and the summary totals) are only touched in `commit`: writes stage
+their records and summary deltas in the session, and `commit` locks the
+counter, stamps the staged records with consecutive versions, applies the
+summed deltas and commits at once. Transactions on different workorders
+therefore only queue for that short final step, versions still follow
+commit order, and since no transaction waits for workorder rows while it
+holds the counter, the two kinds of locks cannot deadlock. Until commit,
+written records keep the version they were read at (0 for new records);
+`commit` updates the record dicts, and reports that it did so, so that
+responses serialized before the commit can be encoded again.
+
+Idempotency keys (`SQLIdempotencyStore`) live in the database too, so a
+retry is deduplicated whichever worker it reaches.
+"""
+import hashlib
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+
+from aggregates import (
+    ALL_CONTRACTORS, TOTAL_FIELDS, RunningTotals, build_summary, contribution_deltas,
+    payment_contribution, worker_payment_contribution,
+)
+from discrepancies import DISCREPANCY_TOLERANCE, format_cursor, open_shortfall
+from idempotency import (
+    IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT, IdempotencyEntry, IdempotencyInProgress, IdempotencyMismatch,
+)
+from models import (
+    IdempotencyKey, Payment, PaymentWorker, StoreVersion, SummaryCount, SummaryTotal, WorkerPayment, db,
+)
+from store import (
+    GLOBAL_SCOPE, PAYMENT, WORKER_PAYMENT, StoreConflict, contractor_key, contractor_scope,
+    payment_status_of, phone_scope, worker_name_key,
+)
+
+logger = logging.getLogger('wpts.sql_store')
+
+# Seconds a claimed idempotency key stays pending before another request may
+# take it over (its worker died before storing the response)
+IDEMPOTENCY_LEASE = 2 * IDEMPOTENCY_WAIT
+
+# Seconds between checks while a retry waits for a first attempt elsewhere
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Claims between purges of expired idempotency keys
+IDEMPOTENCY_PURGE_EVERY = 100
+
+# Optional worker payment fields that are left out of the API shape until set
+WORKER_PAYMENT_OPTIONAL_FIELDS = (
+    'actual_received_by_worker', 'discrepancy_notes', 'discrepancy_reported_at',
+)
+
+
+def engine_options(database_url, pool_size, max_overflow, pool_timeout):
+    """Connection pool settings for the given database URL"""
+    if database_url.startswith('sqlite'):
+        # SQLite connections cannot be shared across threads by default
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _to_isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+class RowDict(dict):
+    """API-shaped record that remembers the row it was loaded from"""
+    __slots__ = ('row',)
+
+
+class SQLStore:
+    """Storage backend persisting payments and worker payments with SQLAlchemy"""
+
+    # rollback() discards the writes made since the last commit
+    transactional = True
+
+    def __init__(self, session=None, discrepancy_tolerance=DISCREPANCY_TOLERANCE):
+        self.session = session or db.session
+        self.discrepancy_tolerance = discrepancy_tolerance
+
+    def create_schema(self):
+        """Create missing tables and the global version counter"""
+        db.create_all()
+        if self.session.get(StoreVersion, GLOBAL_SCOPE) is None:
+            self.session.add(StoreVersion(scope=GLOBAL_SCOPE, version=0, updated_at=datetime.now(timezone.utc)))
+            try:
+                self.session.commit()
+            except IntegrityError:
+                # Another worker created it first
+                self.session.rollback()
+        if self.session.get(SummaryTotal, ALL_CONTRACTORS) is None:
+            self._rebuild_totals()
+            try:
+                self.session.commit()
+            except IntegrityError:
+                self.session.rollback()
+
+    def _rebuild_totals(self):
+        """Compute the summary tables from scratch (databases created before them)"""
+        totals = RunningTotals()
+        for row in self.session.scalars(select(Payment).execution_options(yield_per=1000)):
+            totals.update((PAYMENT, row.id), self._payment_contribution(row))
+        for row in self.session.scalars(select(WorkerPayment).execution_options(yield_per=1000)):
+            totals.update((WORKER_PAYMENT, row.id), self._worker_payment_contribution(row))
+        scopes = set()
+        for scope, contractor, vector, counts in totals.items():
+            scopes.add(scope)
+            self.session.add(SummaryTotal(scope=scope, contractor=contractor,
+                                          **dict(zip(TOTAL_FIELDS, vector))))
+            for (kind, status), count in counts.items():
+                self.session.add(SummaryCount(scope=scope, kind=kind, status=status, count=count))
+        if ALL_CONTRACTORS not in scopes:
+            self.session.add(SummaryTotal(scope=ALL_CONTRACTORS, **dict.fromkeys(TOTAL_FIELDS, 0)))
+
+    def _pending(self):
+        """Records and summary deltas staged by this transaction's writes"""
+        pending = self.session.info.get('wpts_pending')
+        if pending is None:
+            # row -> (scope, record dicts of the row); summary scope -> [contractor, totals, counts]
+            pending = self.session.info['wpts_pending'] = {'records': {}, 'totals': {}}
+        return pending
+
+    def _stage(self, row, record, scope):
+        """Mark a written record to be stamped with a version on commit"""
+        _, records = self._pending()['records'].setdefault(row, (scope, []))
+        if not any(staged is record for staged in records):
+            records.append(record)
+
+    def commit(self):
+        """Stamp versions and apply summary deltas of the staged writes, then commit
+
+        Returns whether records were given new versions, which responses
+        built before the commit do not show yet.
+        """
+        pending = self.session.info.pop('wpts_pending', None)
+        try:
+            if pending is not None:
+                self._stamp_versions(pending['records'])
+                self._apply_totals(pending['totals'])
+                self.session.flush()
+            self.session.commit()
+        except StaleDataError as e:
+            self.session.rollback()
+            raise StoreConflict(str(e))
+        return bool(pending and pending['records'])
+
+    @contextmanager
+    def lock(self, workorder):
+        """Row-lock a workorder's records for the rest of the transaction
+
+        Locked rows are reloaded, so records read inside the block are current.
+        """
+        for model in (Payment, WorkerPayment):
+            statement = (select(model).where(model.workorder == workorder).with_for_update()
+                         .execution_options(populate_existing=True))
+            self.session.scalars(statement).all()
+        yield
+
+    def _flush(self):
+        try:
+            self.session.flush()
+        except StaleDataError as e:
+            self.rollback()
+            raise StoreConflict(str(e))
+
+    def rollback(self):
+        self.session.info.pop('wpts_pending', None)
+        self.session.rollback()
+
+    def _stamp_versions(self, records):
+        """Give each staged record the next global version and mark its scope changed
+
+        The global row is locked from here until the commit right after, so
+        versions are assigned in commit order across all workers sharing
+        the database.
+        """
+        if not records:
+            return
+        now = datetime.now(timezone.utc)
+        counter = self.session.get(StoreVersion, GLOBAL_SCOPE, with_for_update=True,
+                                   populate_existing=True)
+        scopes = {}
+        for row, (scope, dicts) in records.items():
+            counter.version += 1
+            row.version = counter.version
+            for record in dicts:
+                record['version'] = counter.version
+            scopes[scope] = counter.version
+        counter.updated_at = now
+        # Scope rows are only created while holding the counter lock
+        for scope in sorted(scopes):
+            row = self.session.get(StoreVersion, scope, with_for_update=True)
+            if row is None:
+                row = StoreVersion(scope=scope)
+                self.session.add(row)
+            row.version = scopes[scope]
+            row.updated_at = now
+
+    def changes_since(self, since, limit=None, contractor=None):
+        """Return (payments, worker_payments, version, has_more) changed after `since`
+
+        Rows carry the version of their last write in an indexed column, so
+        the tables themselves are the change log and it never expires.
+        """
+        current, _ = self.get_version()
+        changed = []
+        for model, to_dict in ((Payment, self._payment_dict), (WorkerPayment, self._worker_payment_dict)):
+            statement = select(model).where(model.version > since, model.version <= current)
+            if contractor is not None:
+                statement = statement.where(model.contractor_key == contractor_key(contractor))
+            statement = statement.order_by(model.version)
+            if limit is not None:
+                statement = statement.limit(limit + 1)
+            changed.extend((row.version, model, to_dict(row)) for row in self.session.scalars(statement))
+
+        changed.sort(key=lambda change: change[0])
+        has_more = limit is not None and len(changed) > limit
+        if has_more:
+            changed = changed[:limit]
+            current = changed[-1][0]
+        payments = [record for _, model, record in changed if model is Payment]
+        worker_payments = [record for _, model, record in changed if model is WorkerPayment]
+        return payments, worker_payments, max(since, current), has_more
+
+    def get_version(self, scope=GLOBAL_SCOPE):
+        """Return (version, last_modified) of the last write in a scope"""
+        row = self.session.get(StoreVersion, scope)
+        if row is None:
+            return 0, None
+        updated_at = row.updated_at
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return row.version, updated_at
+
+    # Reconciliation summary
+
+    def _update_totals(self, old, new):
+        """Stage the change of a record's contribution to the summary tables"""
+        totals = self._pending()['totals']
+        for scope, contractor, vector, counts in contribution_deltas(old, new):
+            staged = totals.get(scope)
+            if staged is None:
+                totals[scope] = [contractor, list(vector), Counter(counts)]
+                continue
+            staged[0] = contractor
+            staged[1] = [total + delta for total, delta in zip(staged[1], vector)]
+            staged[2].update(counts)
+
+    def _apply_totals(self, totals):
+        """Apply the summed summary deltas of a transaction
+
+        Runs after `_stamp_versions`, so summary rows are only created while
+        holding the global counter lock, and in scope order.
+        """
+        for scope in sorted(totals):
+            contractor, vector, counts = totals[scope]
+            deltas = {getattr(SummaryTotal, field): getattr(SummaryTotal, field) + delta
+                      for field, delta in zip(TOTAL_FIELDS, vector) if delta}
+            statement = update(SummaryTotal).where(SummaryTotal.scope == scope)
+            result = self.session.execute(
+                statement.values({SummaryTotal.contractor: contractor, **deltas})
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                self.session.add(SummaryTotal(scope=scope, contractor=contractor,
+                                              **dict(zip(TOTAL_FIELDS, vector))))
+            for (kind, status), delta in counts.items():
+                if not delta:
+                    continue
+                statement = update(SummaryCount).where(
+                    SummaryCount.scope == scope, SummaryCount.kind == kind,
+                    SummaryCount.status == status,
+                ).values(count=SummaryCount.count + delta).execution_options(synchronize_session=False)
+                if self.session.execute(statement).rowcount == 0:
+                    self.session.add(SummaryCount(scope=scope, kind=kind, status=status, count=delta))
+
+    def _summary(self, row):
+        statement = select(SummaryCount).where(SummaryCount.scope == row.scope)
+        counts = {(count.kind, count.status): count.count for count in self.session.scalars(statement)}
+        contractor = row.contractor if row.scope != ALL_CONTRACTORS else None
+        return build_summary(contractor, [getattr(row, field) for field in TOTAL_FIELDS], counts)
+
+    def summary(self, contractor=None):
+        """Running totals of one contractor (None if unknown), or across all contractors"""
+        scope = ALL_CONTRACTORS if contractor is None else contractor_key(contractor)
+        row = self.session.get(SummaryTotal, scope)
+        return self._summary(row) if row is not None else None
+
+    def contractor_summaries(self):
+        """Running totals of every contractor, by contractor name"""
+        statement = select(SummaryTotal).where(SummaryTotal.scope != ALL_CONTRACTORS)
+        summaries = [self._summary(row) for row in self.session.scalars(statement)]
+        summaries.sort(key=lambda summary: summary['contractor'].casefold())
+        return summaries
+
+    def discrepancies(self, query):
+        """Return a page of (shortfall, record) open discrepancies, largest first, plus the next cursor"""
+        criteria = [WorkerPayment.shortfall.is_not(None)]
+        if query.contractor is not None:
+            criteria.append(WorkerPayment.contractor_key == contractor_key(query.contractor))
+        if query.cursor is not None:
+            shortfall, record_id = query.cursor
+            criteria.append(or_(
+                WorkerPayment.shortfall < shortfall,
+                and_(WorkerPayment.shortfall == shortfall, WorkerPayment.id > record_id),
+            ))
+        statement = (select(WorkerPayment).where(*criteria)
+                     .order_by(WorkerPayment.shortfall.desc(), WorkerPayment.id))
+        if query.limit is not None:
+            statement = statement.limit(query.limit + 1)
+        rows = list(self.session.scalars(statement))
+        next_cursor = None
+        if query.limit is not None and len(rows) > query.limit:
+            rows = rows[:query.limit]
+            next_cursor = format_cursor(rows[-1].shortfall, rows[-1].id)
+        return [(row.shortfall, self._worker_payment_dict(row)) for row in rows], next_cursor
+
+    # Payments
+
+    def _payment_contribution(self, row):
+        state = {'allocated': row.allocated}
+        if row.work_status is not None:
+            state['work_status'] = row.work_status
+        return payment_contribution(
+            {'amount': row.amount, 'contractor': row.contractor}, row.contractor_key,
+            payment_status_of(state),
+        )
+
+    def _payment_dict(self, row):
+        payment = RowDict(
+            id=row.id,
+            workorder=row.workorder,
+            contractor=row.contractor,
+            amount=row.amount,
+            allocated=row.allocated,
+            workers=[dict(worker.data) for worker in row.workers],
+            created_at=_to_isoformat(row.created_at),
+            updated_at=_to_isoformat(row.updated_at),
+            version=row.version,
+        )
+        if row.work_status is not None:
+            payment['work_status'] = row.work_status
+        if row.completed_at is not None:
+            payment['completed_at'] = _to_isoformat(row.completed_at)
+        payment.row = row
+        return payment
+
+    def _apply_payment(self, row, payment):
+        row.workorder = payment['workorder']
+        row.contractor = payment['contractor']
+        row.contractor_key = contractor_key(payment['contractor'])
+        row.amount = payment['amount']
+        row.allocated = payment['allocated']
+        row.work_status = payment.get('work_status')
+        row.created_at = _to_datetime(payment['created_at'])
+        row.updated_at = _to_datetime(payment['updated_at'])
+        row.completed_at = _to_datetime(payment.get('completed_at'))
+        self._stage(row, payment, contractor_scope(payment['contractor']))
+
+        workers = [dict(worker) for worker in payment['workers']]
+        if [worker.data for worker in row.workers] != workers:
+            row.workers = [
+                PaymentWorker(position=position, phone=worker['phone'], name=worker['name'],
+                              name_key=worker_name_key(worker['name']), data=worker)
+                for position, worker in enumerate(workers)
+            ]
+
+    def add_payment(self, payment):
+        """Store a new payment, assigning its ID"""
+        row = Payment()
+        # Stamped with its first version on commit
+        row.version = payment['version'] = 0
+        self._apply_payment(row, payment)
+        self.session.add(row)
+        self.session.flush()
+        payment['id'] = row.id
+        self._update_totals(None, self._payment_contribution(row))
+        return payment
+
+    def get_payment(self, payment_id):
+        """Return the payment with the given ID, or None"""
+        row = self.session.get(Payment, payment_id)
+        return self._payment_dict(row) if row is not None else None
+
+    def save_payment(self, payment):
+        """Write back changes made to a payment returned by this store"""
+        row = getattr(payment, 'row', None) or self.session.get(Payment, payment['id'])
+        previous = self._payment_contribution(row)
+        self._apply_payment(row, payment)
+        self._flush()
+        self._update_totals(previous, self._payment_contribution(row))
+        return payment
+
+    def _payments(self, *criteria):
+        query = select(Payment).where(*criteria).order_by(Payment.id)
+        return [self._payment_dict(row) for row in self.session.scalars(query)]
+
+    def list_payments(self):
+        """Return all payments in creation order"""
+        return self._payments()
+
+    def payments_for_workorder(self, workorder):
+        """Return all payments for a workorder"""
+        return self._payments(Payment.workorder == workorder)
+
+    def payments_allocated_to(self, worker_phone, workorder):
+        """Return the payments for a workorder that are allocated to a worker phone"""
+        allocated = select(PaymentWorker.payment_id).where(PaymentWorker.phone == worker_phone)
+        return self._payments(
+            Payment.workorder == workorder,
+            Payment.allocated.is_(True),
+            Payment.id.in_(allocated),
+        )
+
+    def payments_for_contractor(self, contractor):
+        """Return all payments for a contractor (case-insensitive)"""
+        return self._payments(Payment.contractor_key == contractor_key(contractor))
+
+    def _page(self, model, criteria, query):
+        """Run a keyset-paginated ListQuery, returning rows and the next cursor"""
+        if query.created_from is not None:
+            criteria.append(model.created_at >= _to_datetime(query.created_from))
+        if query.created_to is not None:
+            criteria.append(model.created_at <= _to_datetime(query.created_to))
+        if query.cursor is not None:
+            criteria.append(model.id < query.cursor if query.descending else model.id > query.cursor)
+        statement = select(model).where(*criteria)
+        statement = statement.order_by(model.id.desc() if query.descending else model.id)
+        if query.limit is not None:
+            statement = statement.limit(query.limit + 1)
+        rows = list(self.session.scalars(statement))
+        if query.limit is not None and len(rows) > query.limit:
+            rows = rows[:query.limit]
+            return rows, rows[-1].id
+        return rows, None
+
+    def query_payments(self, query):
+        """Return a page of payments matching a ListQuery, plus the next cursor"""
+        criteria = []
+        if query.contractor is not None:
+            criteria.append(Payment.contractor_key == contractor_key(query.contractor))
+        if query.workorder is not None:
+            criteria.append(Payment.workorder == query.workorder)
+        if query.status == 'unallocated':
+            criteria.append(Payment.allocated.is_(False))
+        elif query.status is not None:
+            criteria.append(Payment.allocated.is_(True))
+            criteria.append(func.coalesce(Payment.work_status, 'assigned') == query.status)
+        rows, cursor = self._page(Payment, criteria, query)
+        return [self._payment_dict(row) for row in rows], cursor
+
+    def count_payments(self):
+        return self.session.scalar(select(func.count(Payment.id)))
+
+    # Worker payment records
+
+    def _worker_payment_contribution(self, row):
+        return worker_payment_contribution({
+            'contractor': row.contractor,
+            'promised_amount': row.promised_amount,
+            'actual_paid': row.actual_paid,
+            'actual_received_by_worker': row.actual_received_by_worker,
+            'payment_status': row.payment_status,
+            'work_status': row.work_status,
+        }, row.contractor_key)
+
+    def _worker_payment_dict(self, row):
+        wp = RowDict(
+            id=row.id,
+            worker_phone=row.worker_phone,
+            worker_name=row.worker_name,
+            workorder=row.workorder,
+            contractor=row.contractor,
+            promised_amount=row.promised_amount,
+            actual_paid=row.actual_paid,
+            payment_status=row.payment_status,
+            work_status=row.work_status,
+            created_at=_to_isoformat(row.created_at),
+            updated_at=_to_isoformat(row.updated_at),
+            version=row.version,
+        )
+        for field in WORKER_PAYMENT_OPTIONAL_FIELDS:
+            value = getattr(row, field)
+            if value is not None:
+                wp[field] = _to_isoformat(value) if isinstance(value, datetime) else value
+        wp.row = row
+        return wp
+
+    def _apply_worker_payment(self, row, wp):
+        row.worker_phone = wp['worker_phone']
+        row.worker_name = wp['worker_name']
+        row.workorder = wp['workorder']
+        row.contractor = wp['contractor']
+        row.contractor_key = contractor_key(wp['contractor'])
+        row.promised_amount = wp['promised_amount']
+        row.actual_paid = wp['actual_paid']
+        row.payment_status = wp['payment_status']
+        row.work_status = wp['work_status']
+        row.actual_received_by_worker = wp.get('actual_received_by_worker')
+        row.discrepancy_notes = wp.get('discrepancy_notes')
+        row.discrepancy_reported_at = _to_datetime(wp.get('discrepancy_reported_at'))
+        row.shortfall = open_shortfall(wp, self.discrepancy_tolerance)
+        row.created_at = _to_datetime(wp['created_at'])
+        row.updated_at = _to_datetime(wp['updated_at'])
+        self._stage(row, wp, phone_scope(wp['worker_phone']))
+
+    def _find_worker_payment_row(self, worker_phone, workorder):
+        query = select(WorkerPayment).where(
+            WorkerPayment.worker_phone == worker_phone,
+            WorkerPayment.workorder == workorder,
+        )
+        return self.session.scalars(query).first()
+
+    def find_worker_payment(self, worker_phone, workorder):
+        """Return the worker payment record for a phone and workorder, or None"""
+        row = self._find_worker_payment_row(worker_phone, workorder)
+        return self._worker_payment_dict(row) if row is not None else None
+
+    def add_worker_payment(self, wp):
+        """Store a new worker payment record"""
+        row = WorkerPayment()
+        # Stamped with its first version on commit
+        row.version = wp['version'] = 0
+        self._apply_worker_payment(row, wp)
+        self.session.add(row)
+        self.session.flush()
+        wp['id'] = row.id
+        self._update_totals(None, self._worker_payment_contribution(row))
+        return wp
+
+    def save_worker_payment(self, wp):
+        """Write back changes made to a worker payment record returned by this store"""
+        row = getattr(wp, 'row', None) or self._find_worker_payment_row(wp['worker_phone'], wp['workorder'])
+        previous = self._worker_payment_contribution(row)
+        self._apply_worker_payment(row, wp)
+        self._flush()
+        self._update_totals(previous, self._worker_payment_contribution(row))
+        return wp
+
+    def _worker_payments(self, *criteria):
+        query = select(WorkerPayment).where(*criteria).order_by(WorkerPayment.id)
+        return [self._worker_payment_dict(row) for row in self.session.scalars(query)]
+
+    def list_worker_payments(self):
+        """Return all worker payment records in creation order"""
+        return self._worker_payments()
+
+    def worker_payments_for_phone(self, worker_phone):
+        """Return all worker payment records for a worker phone"""
+        return self._worker_payments(WorkerPayment.worker_phone == worker_phone)
+
+    def worker_payments_for_workorder(self, workorder):
+        """Return all worker payment records for a workorder"""
+        return self._worker_payments(WorkerPayment.workorder == workorder)
+
+    def worker_payments_for_workorders(self, workorders):
+        """Return the worker payment records for any of several workorders"""
+        if not workorders:
+            return []
+        return self._worker_payments(WorkerPayment.workorder.in_(list(workorders)))
+
+    def worker_payments_for_contractor(self, contractor):
+        """Return all worker payment records for a contractor (case-insensitive)"""
+        return self._worker_payments(WorkerPayment.contractor_key == contractor_key(contractor))
+
+    def query_worker_payments(self, query):
+        """Return a page of worker payment records matching a ListQuery, plus the next cursor"""
+        criteria = []
+        if query.contractor is not None:
+            criteria.append(WorkerPayment.contractor_key == contractor_key(query.contractor))
+        if query.workorder is not None:
+            criteria.append(WorkerPayment.workorder == query.workorder)
+        if query.worker_phone is not None:
+            criteria.append(WorkerPayment.worker_phone == query.worker_phone)
+        if query.status is not None:
+            criteria.append(WorkerPayment.payment_status == query.status)
+        rows, cursor = self._page(WorkerPayment, criteria, query)
+        return [self._worker_payment_dict(row) for row in rows], cursor
+
+    # Worker directory
+
+    def is_allocated_worker(self, worker_phone, name):
+        """Whether a phone is allocated to any payment under this name (case-insensitive)"""
+        statement = select(PaymentWorker.id).join(Payment).where(
+            PaymentWorker.phone == worker_phone,
+            PaymentWorker.name_key == worker_name_key(name),
+            Payment.allocated.is_(True),
+        ).limit(1)
+        return self.session.scalar(statement) is not None
+
+    def worker_workorders(self, worker_phone):
+        """Workorders a phone is currently allocated to"""
+        statement = select(Payment.workorder).join(PaymentWorker).where(
+            PaymentWorker.phone == worker_phone,
+            Payment.allocated.is_(True),
+        ).distinct()
+        return list(self.session.scalars(statement))
+
+    def count_worker_payments(self):
+        return self.session.scalar(select(func.count(WorkerPayment.id)))
+
+
+class SQLIdempotencyStore:
+    """Idempotency keys in the `idempotency_keys` table, shared by every worker
+
+    The same interface as `idempotency.IdempotencyCache`. A key is claimed
+    by inserting its row (the primary key makes exactly one claim succeed)
+    and the response is stored in it after the request commits, each in a
+    short transaction of its own; a retry on another worker polls the row
+    until the response is there. Rows expire after the TTL rather than by
+    count, and a claim whose request never finished expires after
+    `IDEMPOTENCY_LEASE`.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE):
+        self.ttl = ttl
+        self.lease = lease
+        self.replays = 0
+        self._claims = 0
+
+    def __len__(self):
+        with db.engine.connect() as connection:
+            return connection.scalar(select(func.count()).select_from(IdempotencyKey))
+
+    def begin(self, key, fingerprint, timeout=IDEMPOTENCY_WAIT):
+        """Claim a key, or wait for the request that holds it (see `IdempotencyCache.begin`)"""
+        key_hash = _key_hash(key)
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(IdempotencyKey).values(
+                        key_hash=key_hash, fingerprint=fingerprint, expires=now + self.lease))
+            except IntegrityError:
+                pass
+            else:
+                self._claimed(now)
+                return IdempotencyEntry(key, fingerprint), True
+
+            with db.engine.begin() as connection:
+                row = connection.execute(select(IdempotencyKey).where(IdempotencyKey.key_hash == key_hash)).first()
+                if row is not None and row.expires <= now:
+                    # Expired, or abandoned by a worker that died: claim it afresh
+                    connection.execute(delete(IdempotencyKey).where(
+                        IdempotencyKey.key_hash == key_hash, IdempotencyKey.expires == row.expires))
+                    continue
+            if row is None:
+                continue
+            if fingerprint is not None and row.fingerprint != fingerprint:
+                raise IdempotencyMismatch(key)
+            if row.status is not None:
+                self.replays += 1
+                entry = IdempotencyEntry(key, row.fingerprint)
+                entry.response = (row.status, [tuple(header) for header in row.headers], row.body)
+                return entry, False
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress(key)
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    def _claimed(self, now):
+        self._claims += 1
+        if self._claims % IDEMPOTENCY_PURGE_EVERY == 0:
+            with db.engine.begin() as connection:
+                connection.execute(delete(IdempotencyKey).where(IdempotencyKey.expires <= now))
+
+    def complete(self, entry, status, headers, body):
+        """Store the response of a claimed key for replay"""
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(update(IdempotencyKey).where(
+                    IdempotencyKey.key_hash == _key_hash(entry.key),
+                ).values(fingerprint=entry.fingerprint, status=status, headers=[list(header) for header in headers],
+                         body=body, expires=time.time() + self.ttl))
+        except SQLAlchemyError:
+            # The write is committed; a retry after the lease runs it again
+            logger.exception("Could not store the response for an idempotency key")
+        entry.done.set()
+
+    def abandon(self, entry):
+        """Release a claimed key without a response, so a retry executes again"""
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.key_hash == _key_hash(entry.key), IdempotencyKey.status.is_(None)))
+        except SQLAlchemyError:
+            logger.exception("Could not release an idempotency key; it expires with its lease")
+        entry.done.set()
+
+
+def _key_hash(key):
+    return hashlib.sha256(key.encode()).hexdigest()
@@ -0,0 +1,128 @@
+"""
+In-memory serving of the frontend's static assets.
+
+At startup every asset in the static directory (HTML, JS, CSS, images) is
+read once, fingerprinted with a content hash and, for text assets,
+precompressed with gzip (and Brotli when the `brotli` module is installed).
+References to the other assets inside `index.html` are rewritten to
+`name?v=<hash>`, so those URLs change whenever the file does and can be
+cached by browsers for `max_age` seconds as immutable. `index.html` itself
+and unversioned URLs are revalidated with their ETag on every load.
+
+Only files with a known asset extension are served; source files, the
+database and anything else in the directory are not.
+"""
+import gzip
+import hashlib
+import os
+import re
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; assets are precompressed with gzip only without it
+    brotli = None
+
+MIMETYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.jpeg': 'image/jpeg',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.ico': 'image/x-icon',
+    '.webp': 'image/webp',
+}
+COMPRESSIBLE = frozenset(('.html', '.js', '.css', '.svg'))
+
+# Smaller files are not worth a compressed variant
+MIN_COMPRESS_SIZE = 256
+
+INDEX = 'index.html'
+
+
+class Asset:
+    """One static file with its encoded variants"""
+
+    __slots__ = ('name', 'mimetype', 'version', 'variants')
+
+    def __init__(self, name, mimetype, data):
+        self.name = name
+        self.mimetype = mimetype
+        self.version = hashlib.sha256(data).hexdigest()[:12]
+        # encoding -> body; 'identity' is always present
+        self.variants = {'identity': data}
+
+    def compress(self):
+        data = self.variants['identity']
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        candidates = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates['br'] = brotli.compress(data, quality=11)
+        for encoding, body in candidates.items():
+            if len(body) < len(data):
+                self.variants[encoding] = body
+
+
+class StaticAssets:
+    """The frontend assets of a directory, loaded and compressed once"""
+
+    def __init__(self, directory, max_age):
+        self.max_age = max_age
+        self.assets = {}
+        for name in sorted(os.listdir(directory)):
+            extension = os.path.splitext(name)[1].lower()
+            path = os.path.join(directory, name)
+            if extension in MIMETYPES and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    self.assets[name] = Asset(name, MIMETYPES[extension], f.read())
+
+        index = self.assets.get(INDEX)
+        if index is not None:
+            self.assets[INDEX] = Asset(INDEX, index.mimetype, self._fingerprint(index.variants['identity']))
+        for name, asset in self.assets.items():
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                asset.compress()
+
+    def _fingerprint(self, html):
+        """Point the page's references to other assets at their versioned URLs"""
+        text = html.decode()
+        for name, asset in self.assets.items():
+            if name != INDEX:
+                pattern = re.compile(r'(["\'])' + re.escape(name) + r'\1')
+                text = pattern.sub(lambda m, n=name, v=asset.version: f'{m.group(1)}{n}?v={v}{m.group(1)}', text)
+        return text.encode()
+
+    def response(self, name, request):
+        """The response for an asset request, or None if there is no such asset"""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.variants and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        etag = f'{asset.version}-{encoding}'
+
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding], content_type=asset.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        if name != INDEX and request.args.get('v') == asset.version:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
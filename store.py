@@ -0,0 +1,638 @@
+"""
+Storage layer for the BCCL WPTS backend.
+
+Payments and worker payment records are kept in plain lists (so the API can
+return them in creation order) alongside hash indexes that the request
+handlers use for lookups, so no handler has to walk the full lists. Worker
+payment records and the workers allocated to a payment are kept in the
+compact form of `records.py`.
+
+Concurrency: the store's own bookkeeping (ids, indexes, versions, change
+log) is guarded by one short internal lock. Handlers that read, modify and
+save records hold `store.lock(workorder)` around that sequence; all records
+of a workorder (its payments and their worker payment records) share one
+lock, so concurrent updates of the same records are serialized while
+unrelated workorders proceed in parallel.
+"""
+import pickle
+import sys
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from aggregates import (
+    ALL_CONTRACTORS, RunningTotals, payment_contribution, worker_payment_contribution,
+)
+from discrepancies import DISCREPANCY_TOLERANCE, DiscrepancyQueue, open_shortfall
+from records import AllocatedWorker, WorkerPaymentRecord
+
+_record_id = itemgetter('id')
+_created_at = itemgetter('created_at')
+_entry_version = itemgetter(0)
+
+# Number of change log entries kept for delta sync
+CHANGE_LOG_RETENTION = 100000
+
+# Number of locks shared by all workorders
+LOCK_STRIPES = 256
+
+PAYMENT = 'payment'
+WORKER_PAYMENT = 'worker_payment'
+
+
+def contractor_key(contractor):
+    """Normalize a contractor name for case-insensitive lookups"""
+    # Interned: every record keeps its key in its totals contribution
+    return sys.intern((contractor or '').strip().casefold())
+
+
+# Change-version scopes: every write bumps the global scope, plus the scopes
+# of the worker phone or contractor it touches
+GLOBAL_SCOPE = 'all'
+
+
+def phone_scope(worker_phone):
+    return f'phone:{worker_phone}'
+
+
+def contractor_scope(contractor):
+    return f'contractor:{contractor_key(contractor)}'
+
+
+class StoreConflict(Exception):
+    """Raised when a record was changed by another request since it was read"""
+
+
+class StripedLock:
+    """A fixed pool of re-entrant locks, picked by hashing a key"""
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class ChangesExpired(Exception):
+    """Raised when the change log no longer reaches back to the requested version"""
+
+
+def worker_name_key(name):
+    """Normalize a worker name for case-insensitive login matching"""
+    return (name or '').strip().casefold()
+
+
+def payment_status_of(payment):
+    """Listing status of a payment: unallocated, assigned or completed"""
+    if not payment['allocated']:
+        return 'unallocated'
+    return payment.get('work_status', 'assigned')
+
+
+class ListQuery:
+    """Filters and keyset pagination for listing payments or worker payment records"""
+
+    def __init__(self, contractor=None, workorder=None, status=None, worker_phone=None,
+                 created_from=None, created_to=None, descending=False, cursor=None, limit=None):
+        self.contractor = contractor
+        self.workorder = workorder
+        self.status = status
+        self.worker_phone = worker_phone
+        self.created_from = created_from
+        self.created_to = created_to
+        self.descending = descending
+        self.cursor = cursor
+        self.limit = limit
+
+
+def _remove_sorted(records, record):
+    """Remove a record from a list kept sorted by id"""
+    index = bisect_left(records, record['id'], key=_record_id)
+    if index < len(records) and records[index] is record:
+        del records[index]
+
+
+def _page(candidates, predicates, query):
+    """Return one page of records from an id-ordered candidate list, plus the next cursor
+
+    Records are ordered by id, which follows creation order, so the created_at
+    range and the keyset cursor are both resolved by binary search.
+    """
+    lo, hi = 0, len(candidates)
+    if query.created_from is not None:
+        lo = bisect_left(candidates, query.created_from, key=_created_at)
+    if query.created_to is not None:
+        hi = bisect_right(candidates, query.created_to, key=_created_at)
+    if query.cursor is not None:
+        if query.descending:
+            hi = min(hi, bisect_left(candidates, query.cursor, key=_record_id))
+        else:
+            lo = max(lo, bisect_right(candidates, query.cursor, key=_record_id))
+
+    positions = range(hi - 1, lo - 1, -1) if query.descending else range(lo, hi)
+    items = []
+    for position in positions:
+        record = candidates[position]
+        if all(predicate(record) for predicate in predicates):
+            if query.limit is not None and len(items) == query.limit:
+                return items, items[-1]['id']
+            items.append(record)
+    return items, None
+
+
+def _payment_ids(allocated):
+    """Payment ids of an `_allocations_by_key` entry (a single id or a tuple)"""
+    return allocated if type(allocated) is tuple else (allocated,)
+
+
+class WorkerEntry:
+    """Worker directory entry for one phone number"""
+    __slots__ = ('names', 'workorders', 'records')
+
+    def __init__(self):
+        # Normalized names and workorders the phone is currently allocated
+        # under, counted per allocating payment
+        self.names = Counter()
+        self.workorders = Counter()
+        # The phone's worker payment records, in creation order
+        self.records = []
+
+
+def _decrement(counter, key):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class InMemoryStore:
+    """Indexed in-memory storage for payments and worker payment records"""
+
+    # Writes are applied immediately; rollback() cannot undo them
+    transactional = False
+
+    def __init__(self, change_log_retention=CHANGE_LOG_RETENTION,
+                 discrepancy_tolerance=DISCREPANCY_TOLERANCE):
+        self.discrepancy_tolerance = discrepancy_tolerance
+        self.payments = []
+        self.worker_payments = []
+        self.payment_id_counter = 1
+
+        # Payment indexes
+        self._payments_by_id = {}
+        self._payments_by_workorder = defaultdict(list)
+        self._payments_by_contractor = defaultdict(list)
+        self._payments_by_status = defaultdict(list)
+        self._payment_status = {}
+
+        # Worker payment indexes
+        self.worker_payment_id_counter = 1
+        self._worker_payments_by_key = {}
+        self._worker_payments_by_workorder = defaultdict(list)
+        self._worker_payments_by_contractor = defaultdict(list)
+        self._worker_payments_by_status = defaultdict(list)
+        self._worker_payment_status = {}
+
+        # Worker directory: phone -> WorkerEntry, kept in step with payment
+        # allocations (payment id -> tuple of (phone, name key)) on every write
+        self._workers = {}
+        self._payment_allocations = {}
+        # (worker phone, workorder) -> id of the payment allocating it, or a
+        # tuple of ids when several do; kept small as there is one per worker
+        self._allocations_by_key = {}
+
+        # Reconciliation totals per contractor, updated on every write
+        self._totals = RunningTotals()
+        # Open discrepancies of worker payment records, largest shortfall first
+        self._discrepancies = DiscrepancyQueue()
+
+        # Change versions: the global counter and, per scope, the
+        # (version, timestamp) of the last write that touched it
+        self.version = 0
+        self._scope_versions = {}
+
+        # Append-only change log of (version, kind, record), trimmed to the
+        # most recent `change_log_retention` entries
+        self.change_log_retention = change_log_retention
+        self._change_log = []
+
+        # Optional write-ahead journal (see journal.py); each thread remembers
+        # the sequence number of its last journaled change until commit
+        self._journal = None
+        self._journal_seq = threading.local()
+
+        self._lock = threading.RLock()
+        self._workorder_locks = StripedLock()
+
+    def lock(self, workorder):
+        """Lock guarding the payments and worker payment records of a workorder"""
+        return self._workorder_locks(workorder)
+
+    def commit(self):
+        """Wait until this thread's journaled writes are on disk
+
+        Writes are applied immediately; without a journal there is nothing to do.
+        """
+        seq = getattr(self._journal_seq, 'value', 0)
+        if seq:
+            self._journal_seq.value = 0
+            self._journal.wait(seq)
+
+    def rollback(self):
+        """Nothing to do; writes are applied immediately"""
+
+    def _bump_version(self, kind, record, *scopes):
+        """Stamp a written record with the next global version and log the change"""
+        self.version += 1
+        record['version'] = self.version
+        self._log_change(kind, record, scopes)
+        if self._journal is not None:
+            self._journal_seq.value = self._journal.append(kind, record)
+
+    def _log_change(self, kind, record, scopes):
+        stamp = (record['version'], datetime.now(timezone.utc))
+        self._scope_versions[GLOBAL_SCOPE] = stamp
+        for scope in scopes:
+            self._scope_versions[scope] = stamp
+
+        self._change_log.append((record['version'], kind, record))
+        # Trim in batches so appends stay amortized O(1)
+        if len(self._change_log) > 2 * self.change_log_retention:
+            del self._change_log[:-self.change_log_retention]
+
+    def changes_since(self, since, limit=None, contractor=None):
+        """Return (payments, worker_payments, version, has_more) changed after `since`
+
+        Each record appears once, in its current state. `version` is the
+        value to pass as `since` next time. Raises ChangesExpired when changes
+        after `since` have already been dropped from the log.
+        """
+        with self._lock:
+            log = self._change_log
+            if since < self.version and (not log or since < log[0][0] - 1):
+                raise ChangesExpired(since)
+            entries = log[bisect_right(log, since, key=_entry_version):]
+            current = self.version
+
+        key = contractor_key(contractor) if contractor is not None else None
+        changed = {PAYMENT: [], WORKER_PAYMENT: []}
+        count = 0
+        # Version of the last record returned, where a truncated page resumes
+        last_version = since
+        for version, kind, record in entries:
+            # Only the latest entry of a record is reported
+            if record['version'] != version:
+                continue
+            if key is not None and contractor_key(record['contractor']) != key:
+                continue
+            if limit is not None and count == limit:
+                return changed[PAYMENT], changed[WORKER_PAYMENT], last_version, True
+            changed[kind].append(record)
+            count += 1
+            last_version = version
+        return changed[PAYMENT], changed[WORKER_PAYMENT], max(since, current), False
+
+    def get_version(self, scope=GLOBAL_SCOPE):
+        """Return (version, last_modified) of the last write in a scope"""
+        return self._scope_versions.get(scope, (0, None))
+
+    # Payments
+
+    def next_payment_id(self):
+        """Allocate the next unique payment ID"""
+        with self._lock:
+            current_id = self.payment_id_counter
+            self.payment_id_counter += 1
+            return current_id
+
+    def add_payment(self, payment):
+        """Store a new payment, assigning its ID, and index it"""
+        with self._lock:
+            payment['id'] = self.next_payment_id()
+            self._insert_payment(payment)
+            self._bump_version(PAYMENT, payment, contractor_scope(payment['contractor']))
+            return payment
+
+    def _insert_payment(self, payment):
+        self.payments.append(payment)
+        self._payments_by_id[payment['id']] = payment
+        self._payments_by_workorder[payment['workorder']].append(payment)
+        self._payments_by_contractor[contractor_key(payment['contractor'])].append(payment)
+        self._reindex_payment(payment)
+
+    def get_payment(self, payment_id):
+        """Return the payment with the given ID, or None"""
+        return self._payments_by_id.get(payment_id)
+
+    def save_payment(self, payment):
+        """Persist changes made to a payment returned by this store"""
+        with self._lock:
+            # Records are shared by reference and id, workorder and contractor
+            # never change, so only the status and worker indexes need updating.
+            self._reindex_payment(payment)
+            self._bump_version(PAYMENT, payment, contractor_scope(payment['contractor']))
+            return payment
+
+    def _reindex_payment(self, payment):
+        # Workers are kept in their compact form (see records.py)
+        payment['workers'] = [AllocatedWorker.from_mapping(worker) for worker in payment['workers']]
+        self._index_payment_status(payment)
+        self._index_allocations(payment)
+
+    def _index_payment_status(self, payment):
+        status = payment_status_of(payment)
+        previous = self._payment_status.get(payment['id'])
+        if status != previous:
+            if previous is not None:
+                _remove_sorted(self._payments_by_status[previous], payment)
+            insort(self._payments_by_status[status], payment, key=_record_id)
+            self._payment_status[payment['id']] = status
+        self._totals.update((PAYMENT, payment['id']), payment_contribution(
+            payment, contractor_key(payment['contractor']), status))
+
+    def _worker_entry(self, worker_phone):
+        entry = self._workers.get(worker_phone)
+        if entry is None:
+            entry = self._workers[worker_phone] = WorkerEntry()
+        return entry
+
+    def _index_allocations(self, payment):
+        """Update the worker directory from a payment's current allocation"""
+        current = {
+            (worker['phone'], worker_name_key(worker['name'])) for worker in payment['workers']
+        } if payment['allocated'] else set()
+        previous = set(self._payment_allocations.get(payment['id'], ()))
+        if current == previous:
+            return
+
+        workorder = payment['workorder']
+        for phone, name in previous - current:
+            entry = self._workers[phone]
+            _decrement(entry.names, name)
+            _decrement(entry.workorders, workorder)
+        for phone, name in current - previous:
+            entry = self._worker_entry(phone)
+            entry.names[name] += 1
+            entry.workorders[workorder] += 1
+        if current:
+            self._payment_allocations[payment['id']] = tuple(current)
+        else:
+            self._payment_allocations.pop(payment['id'], None)
+
+        payment_id = payment['id']
+        previous_phones = {phone for phone, _ in previous}
+        current_phones = {phone for phone, _ in current}
+        for phone in previous_phones - current_phones:
+            key = (phone, workorder)
+            remaining = tuple(i for i in _payment_ids(self._allocations_by_key[key]) if i != payment_id)
+            if not remaining:
+                del self._allocations_by_key[key]
+            else:
+                self._allocations_by_key[key] = remaining[0] if len(remaining) == 1 else remaining
+        for phone in current_phones - previous_phones:
+            key = (phone, workorder)
+            allocated = self._allocations_by_key.get(key)
+            if allocated is None:
+                self._allocations_by_key[key] = payment_id
+            else:
+                self._allocations_by_key[key] = _payment_ids(allocated) + (payment_id,)
+
+    def list_payments(self):
+        """Return all payments in creation order"""
+        return self.payments
+
+    def payments_for_workorder(self, workorder):
+        """Return all payments for a workorder"""
+        return list(self._payments_by_workorder.get(workorder, ()))
+
+    def payments_allocated_to(self, worker_phone, workorder):
+        """Return the payments for a workorder that are allocated to a worker phone"""
+        allocated = self._allocations_by_key.get((worker_phone, workorder), ())
+        return [self._payments_by_id[payment_id] for payment_id in _payment_ids(allocated)]
+
+    def payments_for_contractor(self, contractor):
+        """Return all payments for a contractor (case-insensitive)"""
+        return list(self._payments_by_contractor.get(contractor_key(contractor), ()))
+
+    def query_payments(self, query):
+        """Return a page of payments matching a ListQuery, plus the next cursor"""
+        with self._lock:
+            indexed = [self.payments]
+            predicates = []
+            if query.contractor is not None:
+                key = contractor_key(query.contractor)
+                indexed.append(self._payments_by_contractor.get(key, ()))
+                predicates.append(lambda p: contractor_key(p['contractor']) == key)
+            if query.workorder is not None:
+                indexed.append(self._payments_by_workorder.get(query.workorder, ()))
+                predicates.append(lambda p: p['workorder'] == query.workorder)
+            if query.status is not None:
+                indexed.append(self._payments_by_status.get(query.status, ()))
+                predicates.append(lambda p: payment_status_of(p) == query.status)
+            # Walk the smallest index; the other filters are checked per record
+            candidates = min(indexed, key=len)
+            return _page(candidates, predicates, query)
+
+    def count_payments(self):
+        return len(self.payments)
+
+    # Worker payment records
+
+    def find_worker_payment(self, worker_phone, workorder):
+        """Return the worker payment record for a phone and workorder, or None"""
+        return self._worker_payments_by_key.get((worker_phone, workorder))
+
+    def add_worker_payment(self, wp):
+        """Store a new worker payment record, assigning its ID, and index it"""
+        with self._lock:
+            wp = WorkerPaymentRecord.from_mapping(wp)
+            wp['id'] = self.worker_payment_id_counter
+            self.worker_payment_id_counter += 1
+            self._insert_worker_payment(wp)
+            self._bump_version(WORKER_PAYMENT, wp, phone_scope(wp['worker_phone']))
+            return wp
+
+    def _insert_worker_payment(self, wp):
+        wp = WorkerPaymentRecord.from_mapping(wp)
+        self.worker_payments.append(wp)
+        self._worker_payments_by_key[(wp['worker_phone'], wp['workorder'])] = wp
+        self._worker_entry(wp['worker_phone']).records.append(wp)
+        self._worker_payments_by_workorder[wp['workorder']].append(wp)
+        self._worker_payments_by_contractor[contractor_key(wp['contractor'])].append(wp)
+        self._index_worker_payment_status(wp)
+        return wp
+
+    def save_worker_payment(self, wp):
+        """Persist changes made to a worker payment record returned by this store"""
+        with self._lock:
+            self._index_worker_payment_status(wp)
+            self._bump_version(WORKER_PAYMENT, wp, phone_scope(wp['worker_phone']))
+            return wp
+
+    def _index_worker_payment_status(self, wp):
+        status = wp['payment_status']
+        previous = self._worker_payment_status.get(wp['id'])
+        if status != previous:
+            if previous is not None:
+                _remove_sorted(self._worker_payments_by_status[previous], wp)
+            insort(self._worker_payments_by_status[status], wp, key=_record_id)
+            self._worker_payment_status[wp['id']] = status
+        key = contractor_key(wp['contractor'])
+        self._totals.update((WORKER_PAYMENT, wp['id']), worker_payment_contribution(wp, key))
+        self._discrepancies.update(wp, key, open_shortfall(wp, self.discrepancy_tolerance))
+
+    def list_worker_payments(self):
+        """Return all worker payment records in creation order"""
+        return self.worker_payments
+
+    def worker_payments_for_phone(self, worker_phone):
+        """Return all worker payment records for a worker phone"""
+        entry = self._workers.get(worker_phone)
+        return list(entry.records) if entry is not None else []
+
+    def worker_payments_for_workorder(self, workorder):
+        """Return all worker payment records for a workorder"""
+        return list(self._worker_payments_by_workorder.get(workorder, ()))
+
+    def worker_payments_for_workorders(self, workorders):
+        """Return the worker payment records for any of several workorders"""
+        with self._lock:
+            return [wp for workorder in workorders for wp in self._worker_payments_by_workorder.get(workorder, ())]
+
+    def worker_payments_for_contractor(self, contractor):
+        """Return all worker payment records for a contractor (case-insensitive)"""
+        return list(self._worker_payments_by_contractor.get(contractor_key(contractor), ()))
+
+    def query_worker_payments(self, query):
+        """Return a page of worker payment records matching a ListQuery, plus the next cursor"""
+        with self._lock:
+            indexed = [self.worker_payments]
+            predicates = []
+            if query.contractor is not None:
+                key = contractor_key(query.contractor)
+                indexed.append(self._worker_payments_by_contractor.get(key, ()))
+                predicates.append(lambda wp: contractor_key(wp['contractor']) == key)
+            if query.workorder is not None:
+                indexed.append(self._worker_payments_by_workorder.get(query.workorder, ()))
+                predicates.append(lambda wp: wp['workorder'] == query.workorder)
+            if query.worker_phone is not None:
+                entry = self._workers.get(query.worker_phone)
+                indexed.append(entry.records if entry is not None else ())
+                predicates.append(lambda wp: wp['worker_phone'] == query.worker_phone)
+            if query.status is not None:
+                indexed.append(self._worker_payments_by_status.get(query.status, ()))
+                predicates.append(lambda wp: wp['payment_status'] == query.status)
+            candidates = min(indexed, key=len)
+            return _page(candidates, predicates, query)
+
+    # Reconciliation summary
+
+    def summary(self, contractor=None):
+        """Running totals of one contractor (None if unknown), or across all contractors"""
+        with self._lock:
+            if contractor is None:
+                return self._totals.summary(ALL_CONTRACTORS)
+            return self._totals.summary(contractor_key(contractor))
+
+    def contractor_summaries(self):
+        """Running totals of every contractor, by contractor name"""
+        with self._lock:
+            return self._totals.contractors()
+
+    def discrepancies(self, query):
+        """Return a page of (shortfall, record) open discrepancies, largest first, plus the next cursor"""
+        with self._lock:
+            scope = ALL_CONTRACTORS if query.contractor is None else contractor_key(query.contractor)
+            return self._discrepancies.page(scope, query.cursor, query.limit)
+
+    # Worker directory
+
+    def is_allocated_worker(self, worker_phone, name):
+        """Whether a phone is allocated to any payment under this name (case-insensitive)"""
+        entry = self._workers.get(worker_phone)
+        return entry is not None and entry.names[worker_name_key(name)] > 0
+
+    def worker_workorders(self, worker_phone):
+        """Workorders a phone is currently allocated to"""
+        entry = self._workers.get(worker_phone)
+        return list(entry.workorders) if entry is not None else []
+
+    def count_worker_payments(self):
+        return len(self.worker_payments)
+
+    # Persistence (see journal.py)
+
+    def attach_journal(self, journal):
+        """Append every change from now on to a write-ahead journal"""
+        self._journal = journal
+
+    def dump_state(self):
+        """Serialize the records for a snapshot; returns (version, data)
+
+        Only the snapshot's version, the counters and the scope versions are
+        taken under the store lock, at which point the journal moves on to a
+        new segment. Records are then copied one by one without the lock, so
+        some may already reflect later writes; those writes are journaled in
+        the new segment and replayed over the snapshot, which yields the same
+        state. The indexes are rebuilt from the records on load.
+        """
+        with self._lock:
+            version = self.version
+            state = {
+                'version': version,
+                'payment_id_counter': self.payment_id_counter,
+                'worker_payment_id_counter': self.worker_payment_id_counter,
+                'scope_versions': dict(self._scope_versions),
+            }
+            payments = len(self.payments)
+            worker_payments = len(self.worker_payments)
+            if self._journal is not None:
+                self._journal.rotate(version + 1)
+
+        state['payments'] = [
+            dict(payment, workers=[worker.copy() for worker in payment['workers']])
+            for payment in self.payments[:payments]
+        ]
+        state['worker_payments'] = [wp.copy() for wp in self.worker_payments[:worker_payments]]
+        return version, pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def load_state(self, state):
+        """Rebuild an empty store from a snapshot's state"""
+        with self._lock:
+            for payment in state['payments']:
+                self._insert_payment(payment)
+            for wp in state['worker_payments']:
+                self._insert_worker_payment(wp)
+            self.payment_id_counter = state['payment_id_counter']
+            self.worker_payment_id_counter = state['worker_payment_id_counter']
+            self.version = state['version']
+            self._scope_versions = state['scope_versions']
+
+    def replay_change(self, kind, record):
+        """Re-apply a journaled change, keeping its id and version"""
+        with self._lock:
+            if kind == PAYMENT:
+                existing = self._payments_by_id.get(record['id'])
+                if existing is None:
+                    self._insert_payment(record)
+                    self.payment_id_counter = max(self.payment_id_counter, record['id'] + 1)
+                else:
+                    existing.clear()
+                    existing.update(record)
+                    self._reindex_payment(existing)
+                    record = existing
+                scopes = (contractor_scope(record['contractor']),)
+            else:
+                existing = self._worker_payments_by_key.get((record['worker_phone'], record['workorder']))
+                if existing is None:
+                    record = self._insert_worker_payment(record)
+                    self.worker_payment_id_counter = max(self.worker_payment_id_counter, record['id'] + 1)
+                else:
+                    existing.clear()
+                    existing.update(record)
+                    self._index_worker_payment_status(existing)
+                    record = existing
+                scopes = (phone_scope(record['worker_phone']),)
+            self.version = record['version']
+            self._log_change(kind, record, scopes)
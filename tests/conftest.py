@@ -0,0 +1,22 @@
+import pytest
+
+from app import create_app
+from config import DevelopmentConfig
+
+
+def make_app(backend, tmp_path, **environ):
+    environ.setdefault('LOG_LEVEL', 'WARNING')
+    environ['STORAGE_BACKEND'] = backend
+    if backend == 'sql':
+        environ.setdefault('DATABASE_URL', f"sqlite:///{tmp_path / 'wpts.db'}")
+    return create_app(DevelopmentConfig(environ))
+
+
+@pytest.fixture(params=['memory', 'sql'])
+def app(request, tmp_path):
+    return make_app(request.param, tmp_path)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,29 @@
+def test_worker_updates_reach_only_their_allocations(client):
+    ids = [client.post('/api/admin/payments', json={
+        'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 1,
+    }).json['payment_id'] for _ in range(3)]
+    client.post(f'/api/payments/{ids[0]}/allocate', json={'workers': [{'name': 'Asha', 'phone': '9000000001'}]})
+    client.post(f'/api/payments/{ids[1]}/allocate', json={'workers': [
+        {'name': 'Ram', 'phone': '9000000002'}, {'name': 'Bina', 'phone': '9000000003'},
+    ]})
+    client.post(f'/api/payments/{ids[2]}/allocate', json={'workers': [{'name': 'Ram', 'phone': '9000000002'}]})
+
+    assert client.post('/api/worker/report-discrepancy', json={
+        'worker_phone': '9000000002', 'workorder': 'WO-1', 'actual_received': 3, 'notes': 'Short',
+    }).status_code == 200
+    payments = {payment['id']: payment for payment in client.get('/api/admin/payments').json}
+    # Every payment allocating the worker on the workorder shows the report
+    assert payments[ids[1]]['workers'][0]['payment_status'] == 'disputed'
+    assert payments[ids[2]]['workers'][0]['discrepancy_notes'] == 'Short'
+    # Other workers and payments are left alone
+    assert 'payment_status' not in payments[ids[0]]['workers'][0]
+    assert 'payment_status' not in payments[ids[1]]['workers'][1]
+    untouched = payments[ids[0]]['version']
+
+    # A payment no longer allocating the worker stops receiving updates
+    client.post(f'/api/payments/{ids[2]}/allocate', json={'workers': [{'name': 'Gita', 'phone': '9000000004'}]})
+    client.post('/api/worker/verify-payment', json={'worker_phone': '9000000002', 'workorder': 'WO-1', 'verified': True})
+    payments = {payment['id']: payment for payment in client.get('/api/admin/payments').json}
+    assert payments[ids[1]]['workers'][0]['payment_status'] == 'verified'
+    assert 'payment_status' not in payments[ids[2]]['workers'][0]
+    assert payments[ids[0]]['version'] == untouched
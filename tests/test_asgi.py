@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from asgi import ASGIApp
+from conftest import make_app
+
+
+class Connection:
+    """One ASGI http connection: the request body, the messages sent back and a disconnect"""
+
+    def __init__(self, body=b''):
+        self.incoming = asyncio.Queue()
+        self.incoming.put_nowait({'type': 'http.request', 'body': body, 'more_body': False})
+        self.sent = []
+        self.changed = asyncio.Event()
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        self.sent.append(message)
+        self.changed.set()
+
+    def disconnect(self):
+        self.incoming.put_nowait({'type': 'http.disconnect'})
+
+    @property
+    def status(self):
+        return self.sent[0]['status']
+
+    @property
+    def body(self):
+        return b''.join(message.get('body', b'') for message in self.sent[1:])
+
+    async def wait_for(self, text, timeout=5):
+        while text.encode() not in self.body:
+            self.changed.clear()
+            await asyncio.wait_for(self.changed.wait(), timeout)
+
+
+def http_scope(method, path, query=b'', headers=()):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query, 'root_path': '',
+        'headers': list(headers), 'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+    }
+
+
+async def request(app, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else b''
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    connection = Connection(data)
+    await app(http_scope(method, path, headers=headers), connection.receive, connection.send)
+    assert connection.sent[-1].get('more_body') is False
+    return connection
+
+
+def test_requests_are_served_over_asgi(app):
+    async def scenario():
+        server = ASGIApp(app, threads=2)
+        created = await request(server, 'POST', '/api/admin/payments',
+                                {'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100})
+        assert created.status == 201
+        listed = await request(server, 'GET', '/api/admin/payments')
+        assert listed.status == 200
+        assert [payment['workorder'] for payment in json.loads(listed.body)] == ['WO-1']
+
+    asyncio.run(scenario())
+
+
+def test_event_streams_hold_no_thread(tmp_path):
+    flask_app = make_app('memory', tmp_path)
+    broadcaster = flask_app.extensions['wpts']['broadcaster']
+
+    async def scenario():
+        # One request thread, many more open streams
+        server = ASGIApp(flask_app, threads=1)
+        streams = [Connection() for _ in range(20)]
+        tasks = [asyncio.ensure_future(server(http_scope('GET', '/api/events'), stream.receive, stream.send))
+                 for stream in streams]
+        for stream in streams:
+            await stream.wait_for('retry:')
+        assert broadcaster.subscriber_count() == 20
+        assert [stream.status for stream in streams] == [200] * 20
+
+        # The thread is still free for requests, and every stream gets the change
+        assert (await request(server, 'GET', '/api/health')).status == 200
+        created = await request(server, 'POST', '/api/admin/payments',
+                                {'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100})
+        assert created.status == 201
+        for stream in streams:
+            await stream.wait_for('event: payment_created')
+
+        # Hanging up ends the stream and frees its subscription
+        for stream in streams:
+            stream.disconnect()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        assert broadcaster.subscriber_count() == 0
+
+    asyncio.run(scenario())
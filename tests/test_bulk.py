@@ -0,0 +1,72 @@
+import pytest
+
+import app as app_module
+from store import StoreConflict
+
+CSV = 'workorder,contractor,amount\n' + ''.join(f'WO-{i},Acme,{100 + i}\n' for i in range(1, 7))
+
+
+def fail_on_call(monkeypatch, store, name, call):
+    method = getattr(store, name)
+    calls = []
+
+    def failing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == call:
+            raise StoreConflict('row changed')
+        return method(*args, **kwargs)
+
+    monkeypatch.setattr(store, name, failing)
+
+
+def test_bulk_failure_after_committed_chunk_reports_rows(app, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'CHUNK_SIZE', 2)
+    store = app.extensions['wpts']['store']
+    fail_on_call(monkeypatch, store, 'add_payment', 4)
+
+    response = client.post('/api/admin/payments/bulk', data=CSV, content_type='text/csv')
+    assert response.status_code == 200
+    body = response.json
+    assert body['stopped_at_row'] == 5
+    statuses = [(result['row'], result['status']) for result in body['results']]
+    saved = [result['payment_id'] for result in body['results'] if result['status'] == 'created']
+
+    if store.transactional:
+        # Row 4 was in the chunk that was rolled back
+        assert statuses == [(2, 'created'), (3, 'created'), (4, 'error'), (5, 'error')]
+    else:
+        assert statuses == [(2, 'created'), (3, 'created'), (4, 'created'), (5, 'error')]
+    assert body['succeeded'] == len(saved)
+    monkeypatch.undo()
+    payments = client.get('/api/admin/payments').json
+    assert sorted(payment['id'] for payment in payments) == sorted(saved)
+
+
+def test_bulk_failure_before_any_commit_is_a_conflict(app, client, monkeypatch):
+    store = app.extensions['wpts']['store']
+    if not store.transactional:
+        pytest.skip('the in-memory store applies each row immediately')
+    fail_on_call(monkeypatch, store, 'add_payment', 2)
+    response = client.post('/api/admin/payments/bulk', data=CSV, content_type='text/csv')
+    assert response.status_code == 409
+    monkeypatch.undo()
+    assert client.get('/api/admin/payments').json == []
+
+
+def test_bulk_allocation_rejects_rows_of_a_payment_that_are_not_consecutive(client):
+    created = client.post('/api/admin/payments/bulk', data='workorder,contractor,amount\nWO-1,Acme,100\nWO-2,Acme,200\n',
+                          content_type='text/csv').json
+    assert [result['payment_id'] for result in created['results']] == [1, 2]
+
+    response = client.post('/api/payments/bulk-allocate', data='payment_id,name,phone\n1,A,101\n2,B,201\n1,C,102\n',
+                           content_type='text/csv')
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [(result['row'], result['status']) for result in results] == [
+        (2, 'allocated'), (3, 'allocated'), (4, 'error')]
+    assert 'consecutive' in results[2]['error']
+
+    payment = next(p for p in client.get('/api/admin/payments').json if p['id'] == 1)
+    assert [worker['phone'] for worker in payment['workers']] == ['101']
+    assert client.post('/api/worker/login', json={'phone': '101', 'name': 'A'}).status_code == 200
+    assert client.get('/api/worker/102/payments').json == []
@@ -0,0 +1,52 @@
+from conftest import make_app
+
+
+def create_payments(client, count):
+    return [client.post('/api/admin/payments', json={
+        'workorder': f'WO-{i}', 'contractor': ['Acme', 'Beta'][i % 2], 'amount': 10,
+    }).json['payment_id'] for i in range(count)]
+
+
+def test_changes_since_a_version(client):
+    start = int(client.get('/api/admin/payments').headers['X-Version'])
+    assert client.get(f'/api/changes?since={start}').json == {
+        'version': start, 'has_more': False, 'payments': [], 'worker_payments': [],
+    }
+
+    ids = create_payments(client, 4)
+    client.post(f'/api/payments/{ids[0]}/allocate', json={'workers': [{'name': 'Ram', 'phone': '9000000001'}]})
+    changes = client.get(f'/api/changes?since={start}').json
+    # Each record once, in its latest state
+    assert sorted(payment['id'] for payment in changes['payments']) == ids
+    assert [payment['allocated'] for payment in changes['payments'] if payment['id'] == ids[0]] == [True]
+    assert len(changes['worker_payments']) == 1
+
+    client.post('/api/worker/verify-payment', json={'worker_phone': '9000000001', 'workorder': 'WO-0', 'verified': True})
+    later = client.get(f"/api/changes?since={changes['version']}").json
+    assert [record['payment_status'] for record in later['worker_payments']] == ['verified']
+
+    beta = client.get(f'/api/changes?since={start}&contractor=beta').json
+    assert [payment['id'] for payment in beta['payments']] == [ids[1], ids[3]]
+
+
+def test_changes_are_paged_by_limit(client):
+    start = int(client.get('/api/admin/payments').headers['X-Version'])
+    create_payments(client, 5)
+    first = client.get(f'/api/changes?since={start}&limit=2').json
+    assert first['has_more'] and len(first['payments']) == 2
+    rest = client.get(f"/api/changes?since={first['version']}&limit=10").json
+    assert not rest['has_more'] and len(rest['payments']) == 3
+
+    assert client.get('/api/changes').status_code == 400
+    assert client.get(f'/api/changes?since={start}&limit=0').status_code == 400
+
+
+def test_changes_dropped_from_the_log_answer_410(tmp_path):
+    app = make_app('memory', tmp_path)
+    app.extensions['wpts']['store'].change_log_retention = 1
+    client = app.test_client()
+    create_payments(client, 5)
+    expired = client.get('/api/changes?since=1')
+    assert expired.status_code == 410
+    assert expired.json['version'] == 5
+    assert client.get('/api/changes?since=4').status_code == 200
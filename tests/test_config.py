@@ -0,0 +1,33 @@
+import response_cache
+from config import ProductionConfig
+from conftest import make_app
+
+
+def test_environment_settings_reach_the_components(tmp_path, monkeypatch):
+    # Settings come from the environment given to the config, not os.environ
+    monkeypatch.setenv('RESPONSE_CACHE_SIZE', '1')
+    app = make_app('memory', tmp_path, RESPONSE_CACHE_SIZE='7', RESPONSE_CACHE_TTL='2.5',
+                   IDEMPOTENCY_TTL='60', IDEMPOTENCY_MAX_KEYS='3', EVENT_QUEUE_SIZE='11',
+                   SSE_MAX_SUBSCRIBERS='4', RATE_LIMIT_LOGIN='2/10', WORKER_MAX_CONCURRENT='5')
+    components = app.extensions['wpts']
+    assert (components['responses'].max_entries, components['responses'].ttl) == (7, 2.5)
+    assert (components['idempotency'].ttl, components['idempotency'].max_keys) == (60, 3)
+    assert components['events'].max_queued == 11
+    assert components['broadcaster'].max_subscribers == 4
+    limiter = components['limiter']
+    assert (limiter.login_limit.burst, limiter.login_limit.rate) == (2, 0.2)
+    assert limiter.max_concurrent == 5
+
+    # Unset settings fall back to the module defaults
+    defaults = make_app('memory', tmp_path).extensions['wpts']['responses']
+    assert defaults.max_entries == response_cache.RESPONSE_CACHE_SIZE
+
+
+def test_sql_idempotency_takes_its_ttl_from_the_config(tmp_path):
+    app = make_app('sql', tmp_path, IDEMPOTENCY_TTL='90')
+    assert app.extensions['wpts']['idempotency'].ttl == 90
+
+
+def test_production_defaults():
+    config = ProductionConfig({})
+    assert (config.LOG_LEVEL, config.CORS_ORIGINS, config.PROXY_COUNT) == ('WARNING', [], 1)
@@ -0,0 +1,45 @@
+import threading
+
+from conftest import make_app
+
+
+def test_concurrent_update_of_same_row_is_a_conflict(tmp_path, monkeypatch):
+    app = make_app('sql', tmp_path)
+    client = app.test_client()
+    payment_id = client.post('/api/admin/payments', json={
+        'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100,
+    }).json['payment_id']
+    client.post(f'/api/payments/{payment_id}/allocate', json={
+        'workers': [{'name': 'Asha', 'phone': '9000000001', 'promised_amount': 100}],
+    })
+    client.post(f'/api/payments/{payment_id}/mark-complete')
+
+    store = app.extensions['wpts']['store']
+    find = store.find_worker_payment
+    competing = []
+
+    def find_then_race(worker_phone, workorder):
+        # The first request reads the record, then another session (a request
+        # on another thread) updates and commits it before it is saved
+        record = find(worker_phone, workorder)
+        if not competing:
+            thread = threading.Thread(target=lambda: competing.append(app.test_client().post(
+                '/api/worker/verify-payment',
+                json={'worker_phone': worker_phone, 'workorder': workorder, 'verified': True},
+            )))
+            competing.append(thread)
+            thread.start()
+            thread.join()
+        return record
+
+    monkeypatch.setattr(store, 'find_worker_payment', find_then_race)
+    response = client.post('/api/worker/verify-payment', json={
+        'worker_phone': '9000000001', 'workorder': 'WO-1', 'verified': False,
+    })
+    assert competing[1].status_code == 200
+    assert response.status_code == 409
+
+    # The committed update is kept and the rejected one left no trace
+    monkeypatch.undo()
+    records = client.get('/api/worker/9000000001/payments').json
+    assert records[0]['payment_status'] == 'verified'
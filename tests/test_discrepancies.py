@@ -0,0 +1,71 @@
+from conftest import make_app
+
+
+def paid_workorder(client, workorder, contractor, worker_payments):
+    payment_id = client.post('/api/admin/payments', json={
+        'workorder': workorder, 'contractor': contractor, 'amount': 1000,
+    }).json['payment_id']
+    client.post(f'/api/payments/{payment_id}/allocate', json={
+        'workers': [{'name': phone, 'phone': phone} for phone, _, _ in worker_payments],
+    })
+    client.post(f'/api/payments/{payment_id}/mark-complete')
+    client.post(f'/api/admin/payments/{payment_id}/record-payments', json={'worker_payments': [
+        {'worker_phone': phone, 'worker_name': phone, 'promised_amount': promised, 'actual_paid': paid}
+        for phone, promised, paid in worker_payments
+    ]})
+
+
+def verify(client, phone, workorder, received):
+    assert client.post('/api/worker/verify-payment-with-amount', json={
+        'worker_phone': phone, 'workorder': workorder, 'actual_received': received, 'verified': True,
+    }).status_code == 200
+
+
+def make_queue(client):
+    paid_workorder(client, 'WO-1', 'Acme', [('a', 100, 100), ('b', 100, 100), ('c', 100, 100)])
+    paid_workorder(client, 'WO-2', 'Beta', [('d', 200, 150)])
+    verify(client, 'a', 'WO-1', 100)
+    verify(client, 'b', 'WO-1', 70)
+    # Within the tolerance, but disputed
+    verify(client, 'c', 'WO-1', 99.5)
+    assert client.post('/api/worker/report-discrepancy', json={
+        'worker_phone': 'c', 'workorder': 'WO-1', 'actual_received': 99.5, 'notes': 'Short by 50 paise',
+    }).status_code == 200
+    # Received what was paid, but less than was promised
+    verify(client, 'd', 'WO-2', 150)
+
+
+def test_queue_lists_largest_shortfall_first(client):
+    make_queue(client)
+    queue = client.get('/api/admin/discrepancies').json
+    assert [(record['worker_phone'], record['shortfall']) for record in queue] == [('d', 50), ('b', 30), ('c', 0.5)]
+    acme = client.get('/api/admin/discrepancies?contractor=ACME').json
+    assert [record['worker_phone'] for record in acme] == ['b', 'c']
+
+
+def test_queue_pages_follow_the_cursor(client):
+    make_queue(client)
+    phones = []
+    response = client.get('/api/admin/discrepancies?limit=1')
+    while True:
+        phones.extend(record['worker_phone'] for record in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+        response = client.get(f'/api/admin/discrepancies?limit=1&cursor={cursor}')
+    assert phones == ['d', 'b', 'c']
+    assert client.get('/api/admin/discrepancies?cursor=zz').status_code == 400
+
+
+def test_resolved_shortfall_leaves_the_queue(client):
+    make_queue(client)
+    verify(client, 'b', 'WO-1', 100)
+    queue = client.get('/api/admin/discrepancies').json
+    assert [record['worker_phone'] for record in queue] == ['d', 'c']
+
+
+def test_tolerance_is_configurable(tmp_path):
+    client = make_app('memory', tmp_path, DISCREPANCY_TOLERANCE='0').test_client()
+    paid_workorder(client, 'WO-1', 'Acme', [('a', 100, 100)])
+    verify(client, 'a', 'WO-1', 99.5)
+    assert [record['shortfall'] for record in client.get('/api/admin/discrepancies').json] == [0.5]
@@ -0,0 +1,39 @@
+def test_unchanged_list_answers_304(client):
+    client.post('/api/admin/payments', json={'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 1000})
+    listed = client.get('/api/admin/payments')
+    etag = listed.headers['ETag']
+    assert 'Last-Modified' in listed.headers
+
+    cached = client.get('/api/admin/payments', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+    # Another view of the list has its own tag
+    assert client.get('/api/admin/payments?limit=1', headers={'If-None-Match': etag}).status_code == 200
+
+    client.post('/api/admin/payments', json={'workorder': 'WO-2', 'contractor': 'Acme', 'amount': 500})
+    changed = client.get('/api/admin/payments', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_worker_tag_changes_only_with_their_records(client):
+    payment_id = client.post('/api/admin/payments', json={
+        'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 1000,
+    }).json['payment_id']
+    client.post(f'/api/payments/{payment_id}/allocate', json={'workers': [{'name': 'Ram', 'phone': '9000000001'}]})
+    etag = client.get('/api/worker/9000000001/payments').headers['ETag']
+
+    # A write for someone else leaves the worker's tag alone
+    client.post('/api/admin/payments', json={'workorder': 'WO-2', 'contractor': 'Beta', 'amount': 500})
+    assert client.get('/api/worker/9000000001/payments', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/worker/verify-payment', json={'worker_phone': '9000000001', 'workorder': 'WO-1', 'verified': True})
+    changed = client.get('/api/worker/9000000001/payments', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.json[0]['payment_status'] == 'verified'
+
+
+def test_errors_carry_no_tag(client):
+    response = client.get('/api/admin/payments?status=x')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
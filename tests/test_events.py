@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+
+import pytest
+
+from conftest import make_app
+from events import EventBus
+from serialization import dumps
+
+
+def test_streams_over_the_cap_are_refused(tmp_path):
+    app = make_app('memory', tmp_path, SSE_MAX_SUBSCRIBERS='2')
+    client = app.test_client()
+    streams = [client.get('/api/events', buffered=False) for _ in range(2)]
+    assert [stream.status_code for stream in streams] == [200, 200]
+
+    refused = client.get('/api/events?phone=9000000001')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After']
+    # Requests are still served while the slots are taken
+    assert client.get('/api/health').status_code == 200
+
+    # Closing a stream frees its slot, even before anything was sent on it
+    streams[0].close()
+    stream = client.get('/api/events', buffered=False)
+    assert stream.status_code == 200
+    for response in streams[1:] + [stream]:
+        response.close()
+    assert app.extensions['wpts']['broadcaster'].subscriber_count() == 0
+
+
+class BlockedSink:
+    """Sink that blocks until released, so the queue fills up"""
+
+    name = 'blocked'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.events = []
+
+    def write(self, events):
+        self.release.wait()
+        self.events.extend(events)
+
+    def close(self):
+        pass
+
+
+def test_close_does_not_block_on_a_full_queue():
+    sink = BlockedSink()
+    bus = EventBus([sink], max_queued=2, workers=1, batch_size=1)
+    for version in range(1, 5):
+        bus.publish('payment_created', dumps({'id': version}), version=version)
+
+    closing = threading.Thread(target=bus.close, kwargs={'timeout': 0.1})
+    closing.start()
+    closing.join(timeout=2)
+    assert not closing.is_alive()
+    sink.release.set()
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sql'])
+def test_committed_writes_reach_the_audit_file(backend, tmp_path):
+    audit_file = tmp_path / 'audit.jsonl'
+    app = make_app(backend, tmp_path, EVENT_AUDIT_FILE=str(audit_file))
+    client = app.test_client()
+    payment_id = client.post('/api/admin/payments', json={
+        'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100,
+    }).json['payment_id']
+    client.post(f'/api/payments/{payment_id}/allocate', json={'workers': [{'name': 'Asha', 'phone': '9000000001'}]})
+    # A rejected write publishes nothing
+    assert client.post(f'/api/payments/{payment_id}/allocate', json={'workers': []}).status_code == 400
+
+    bus = app.extensions['wpts']['events']
+    assert bus.flush(timeout=5)
+    events = [json.loads(line) for line in audit_file.read_text().splitlines()]
+    assert [event['event'] for event in events] == ['payment_created', 'payment_allocated']
+    assert [event['version'] for event in events] == [1, 2]
+    assert events[1]['record']['workers'] == [{'name': 'Asha', 'phone': '9000000001'}]
+    assert bus.stats()['delivered'] == 2
+
+
+def test_full_queue_drops_events_and_counts_them():
+    sink = BlockedSink()
+    bus = EventBus([sink], max_queued=2, workers=1, batch_size=1)
+    assert bus.publish('payment_created', dumps({'id': 1}), version=1)
+    # Wait for the worker to take the first event into the blocked sink
+    deadline = time.monotonic() + 2
+    while bus.stats()['queued'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    accepted = [bus.publish('payment_created', dumps({'id': version}), version=version) for version in range(2, 6)]
+    assert accepted == [True, True, False, False]
+    assert bus.stats()['dropped'] == 2
+
+    sink.release.set()
+    assert bus.flush(timeout=2)
+    assert [event.record['id'] for event in sink.events] == [1, 2, 3]
+    bus.close()
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+
+import pytest
+
+import export
+
+
+def ledger(client):
+    for workorder, contractor, worker_payments in (
+        ('WO-1', 'Acme', [('a', 100, 100), ('b', 100, 90)]),
+        ('WO-2', 'Beta', [('d', 200, 150)]),
+        ('WO-3', 'Acme', []),
+    ):
+        payment_id = client.post('/api/admin/payments', json={
+            'workorder': workorder, 'contractor': contractor, 'amount': 1000,
+        }).json['payment_id']
+        if not worker_payments:
+            continue
+        client.post(f'/api/payments/{payment_id}/allocate', json={
+            'workers': [{'name': phone, 'phone': phone} for phone, _, _ in worker_payments],
+        })
+        client.post(f'/api/payments/{payment_id}/mark-complete')
+        client.post(f'/api/admin/payments/{payment_id}/record-payments', json={'worker_payments': [
+            {'worker_phone': phone, 'worker_name': phone, 'promised_amount': promised, 'actual_paid': paid}
+            for phone, promised, paid in worker_payments
+        ]})
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    # Exercise paging through the store with a few records
+    monkeypatch.setattr(export, 'PAGE_SIZE', 1)
+
+
+def test_csv_export_has_a_row_per_worker_payment(client):
+    ledger(client)
+    response = client.get('/api/admin/export/ledger')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    paid = [float(row['actual_paid']) if row['actual_paid'] else None for row in rows]
+    assert [(row['workorder'], row['worker_phone']) for row in rows] == [
+        ('WO-1', 'a'), ('WO-1', 'b'), ('WO-2', 'd'), ('WO-3', ''),
+    ]
+    assert paid == [100, 90, 150, None]
+
+
+def test_ndjson_export_filters_by_contractor(client):
+    ledger(client)
+    body = client.get('/api/admin/export/ledger?format=ndjson&contractor=ACME').get_data(as_text=True)
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [(row['workorder'], row['worker_phone']) for row in rows] == [('WO-1', 'a'), ('WO-1', 'b'), ('WO-3', None)]
+    assert [row['payment_status'] for row in rows] == ['completed', 'completed', 'unallocated']
+
+
+def test_columnar_export_sends_column_batches(client):
+    ledger(client)
+    body = client.get('/api/admin/export/ledger?format=columnar&sort=-created_at').get_data(as_text=True)
+    header, *batches = [json.loads(line) for line in body.splitlines()]
+    assert header['columns'][0] == 'payment_id'
+    assert sum(batch['rows'] for batch in batches) == 4
+    assert [workorder for batch in batches for workorder in batch['data']['workorder']] == [
+        'WO-3', 'WO-2', 'WO-1', 'WO-1',
+    ]
+
+
+def test_export_rejects_bad_parameters(client):
+    assert client.get('/api/admin/export/ledger?format=xml').status_code == 400
+    assert client.get('/api/admin/export/ledger?created_from=x').status_code == 400
+    assert client.get('/api/admin/export/ledger?created_from=2999-01-01&format=ndjson').get_data() == b''
+
+
+def test_parquet_export_when_pyarrow_is_installed(client):
+    ledger(client)
+    response = client.get('/api/admin/export/ledger?format=parquet')
+    if not export.parquet_available():
+        assert response.status_code == 400
+        return
+    import pyarrow.parquet
+
+    table = pyarrow.parquet.read_table(io.BytesIO(response.get_data()))
+    assert table.num_rows == 4
+    assert table.column('actual_paid').to_pylist() == [100, 90, 150, None]
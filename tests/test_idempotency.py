@@ -0,0 +1,88 @@
+import pytest
+
+from conftest import make_app
+from idempotency import IdempotencyInProgress
+
+CSV = 'workorder,contractor,amount\nWO-1,Acme,100\nWO-2,Acme,200\n'
+
+
+def test_bulk_upload_with_key_is_parsed_and_replayed(client):
+    headers = {'Idempotency-Key': 'bulk-1'}
+    first = client.post('/api/admin/payments/bulk', data=CSV, content_type='text/csv', headers=headers)
+    assert first.status_code == 200
+    assert first.json['succeeded'] == 2
+
+    retry = client.post('/api/admin/payments/bulk', data=CSV, content_type='text/csv', headers=headers)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == first.json
+    assert len(client.get('/api/admin/payments').json) == 2
+
+
+def test_bulk_upload_key_reused_for_other_body(client):
+    headers = {'Idempotency-Key': 'bulk-2'}
+    client.post('/api/admin/payments/bulk', data=CSV, content_type='text/csv', headers=headers)
+    other = client.post('/api/admin/payments/bulk', data=CSV + 'WO-3,Acme,300\n',
+                        content_type='text/csv', headers=headers)
+    assert other.status_code == 422
+    assert len(client.get('/api/admin/payments').json) == 2
+
+
+def test_bulk_allocate_with_key(client):
+    payment_id = client.post('/api/admin/payments',
+                             json={'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100}).json['payment_id']
+    body = '{"payment_id": %d, "workers": [{"name": "Asha", "phone": "9000000001"}]}\n' % payment_id
+    headers = {'Idempotency-Key': 'allocate-1'}
+    first = client.post('/api/payments/bulk-allocate', data=body, content_type='application/x-ndjson',
+                        headers=headers)
+    assert first.status_code == 200
+    assert first.json['succeeded'] == 1
+    retry = client.post('/api/payments/bulk-allocate', data=body, content_type='application/x-ndjson',
+                        headers=headers)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_sql_keys_are_shared_by_workers(tmp_path):
+    # Two apps on one database stand in for two gunicorn workers
+    first_worker = make_app('sql', tmp_path).test_client()
+    second_worker = make_app('sql', tmp_path).test_client()
+    body = {'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100}
+    headers = {'Idempotency-Key': 'create-1'}
+
+    first = first_worker.post('/api/admin/payments', json=body, headers=headers)
+    assert first.status_code == 201
+    retry = second_worker.post('/api/admin/payments', json=body, headers=headers)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == first.json
+    assert len(second_worker.get('/api/admin/payments').json) == 1
+
+    other = second_worker.post('/api/admin/payments', json=dict(body, amount=200), headers=headers)
+    assert other.status_code == 422
+
+
+
+def test_sql_keys_wait_for_and_take_over_claims_of_other_workers(tmp_path):
+    first_app, second_app = make_app('sql', tmp_path), make_app('sql', tmp_path)
+    first_keys = first_app.extensions['wpts']['idempotency']
+    second_keys = second_app.extensions['wpts']['idempotency']
+    with first_app.app_context():
+        entry, execute = first_keys.begin('POST /api/x key-1', 'abc')
+    assert execute
+
+    # Still running on the first worker: the retry waits, then gives up
+    with second_app.app_context():
+        with pytest.raises(IdempotencyInProgress):
+            second_keys.begin('POST /api/x key-1', 'abc', timeout=0.2)
+    with first_app.app_context():
+        first_keys.complete(entry, 201, [('Content-Type', 'application/json')], b'{}')
+    with second_app.app_context():
+        replay, execute = second_keys.begin('POST /api/x key-1', 'abc')
+    assert not execute
+    assert replay.response == (201, [('Content-Type', 'application/json')], b'{}')
+
+    # A claim whose worker died is taken over once its lease runs out
+    first_keys.lease = 0
+    with first_app.app_context():
+        first_keys.begin('POST /api/x key-2', 'abc')
+    with second_app.app_context():
+        _, execute = second_keys.begin('POST /api/x key-2', 'abc', timeout=0)
+    assert execute
@@ -0,0 +1,106 @@
+import errno
+import json
+import os
+import threading
+
+from conftest import make_app
+from journal import _segments
+
+READS = ('/api/admin/payments', '/api/admin/worker-payments', '/api/admin/summary',
+         '/api/admin/discrepancies')
+
+
+def write_payments(client, first, count):
+    for i in range(first, first + count):
+        payment_id = client.post('/api/admin/payments', json={
+            'workorder': f'WO-{i}', 'contractor': f'Contractor {i % 3}', 'amount': 100 + i,
+        }).json['payment_id']
+        client.post(f'/api/payments/{payment_id}/allocate', json={
+            'workers': [{'name': 'Asha', 'phone': f'90000{i:05d}', 'promised_amount': 100 + i}],
+        })
+    client.post('/api/worker/report-discrepancy', json={
+        'worker_phone': f'90000{first:05d}', 'workorder': f'WO-{first}', 'actual_received': 50,
+        'notes': 'short',
+    })
+
+
+def state(client):
+    return json.dumps([client.get(path).json for path in READS], sort_keys=True)
+
+
+def open_app(tmp_path):
+    app = make_app('memory', tmp_path, JOURNAL_DIR=str(tmp_path / 'journal'))
+    store = app.extensions['wpts']['store']
+    return app, store, store._journal
+
+
+def test_snapshot_and_tail_replay(tmp_path):
+    app, store, journal = open_app(tmp_path)
+    client = app.test_client()
+    write_payments(client, 1, 5)
+    journal.snapshot()
+    write_payments(client, 6, 5)
+    before = state(client)
+    journal.close()
+
+    directory = tmp_path / 'journal'
+    assert (directory / 'snapshot.bin').exists()
+    # Segments covered by the snapshot were removed
+    assert len(_segments(str(directory))) == 1
+
+    app, store, journal = open_app(tmp_path)
+    assert state(app.test_client()) == before
+    journal.close()
+
+
+def test_torn_frame_is_truncated_and_appends_continue(tmp_path):
+    app, store, journal = open_app(tmp_path)
+    client = app.test_client()
+    write_payments(client, 1, 3)
+    before = state(client)
+    journal.close()
+
+    segment = _segments(str(tmp_path / 'journal'))[-1]
+    valid_size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        # Header of a 64-byte frame followed by only part of its payload
+        f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00partial')
+
+    app, store, journal = open_app(tmp_path)
+    client = app.test_client()
+    assert os.path.getsize(segment) == valid_size
+    assert state(client) == before
+    write_payments(client, 4, 2)
+    after = state(client)
+    journal.close()
+
+    app, store, journal = open_app(tmp_path)
+    assert state(app.test_client()) == after
+    assert len(app.test_client().get('/api/admin/payments').json) == 5
+    journal.close()
+
+
+def test_failed_journal_write_fails_requests_instead_of_hanging(tmp_path, monkeypatch):
+    app, store, journal = open_app(tmp_path)
+    client = app.test_client()
+    write_payments(client, 1, 1)
+
+    def disk_full(frames):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(journal, '_sync', disk_full)
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(client.post('/api/admin/payments', json={
+        'workorder': 'WO-2', 'contractor': 'Acme', 'amount': 100,
+    })))
+    request.start()
+    request.join(timeout=5)
+    assert not request.is_alive()
+    assert responses[0].status_code == 500
+
+    # Later writes fail at once; reads are still served
+    assert client.post('/api/admin/payments', json={
+        'workorder': 'WO-3', 'contractor': 'Acme', 'amount': 100,
+    }).status_code == 500
+    assert client.get('/api/health').status_code == 200
+    journal.close()
@@ -0,0 +1,42 @@
+def create_payments(client, count):
+    for i in range(count):
+        payment_id = client.post('/api/admin/payments', json={
+            'workorder': f'WO-{i % 5}', 'contractor': ['Acme', 'Beta'][i % 2], 'amount': 100 + i,
+        }).json['payment_id']
+        if i % 3 == 0:
+            client.post(f'/api/payments/{payment_id}/allocate', json={
+                'workers': [{'name': 'Asha', 'phone': f'90000000{i:02d}'}],
+            })
+
+
+def test_payments_are_paged_by_cursor(client):
+    create_payments(client, 25)
+    first = client.get('/api/admin/payments?limit=10')
+    assert [payment['id'] for payment in first.json] == list(range(1, 11))
+    assert first.headers['X-Next-Cursor'] == '10'
+    last = client.get('/api/admin/payments?limit=10&cursor=20')
+    assert [payment['id'] for payment in last.json] == [21, 22, 23, 24, 25]
+    assert 'X-Next-Cursor' not in last.headers
+
+    newest = client.get('/api/admin/payments?limit=3&sort=-created_at&cursor=5')
+    assert [payment['id'] for payment in newest.json] == [4, 3, 2]
+
+
+def test_payments_are_filtered_and_projected(client):
+    create_payments(client, 25)
+    assigned = client.get('/api/admin/payments?contractor=acme&status=assigned&fields=id,contractor').json
+    assert assigned == [{'id': i + 1, 'contractor': 'Acme'} for i in range(25) if i % 2 == 0 and i % 3 == 0]
+    unallocated = client.get('/api/admin/payments?workorder=WO-1&status=unallocated&fields=id').json
+    assert unallocated == [{'id': i + 1} for i in range(25) if i % 5 == 1 and i % 3]
+
+    assert client.get('/api/admin/payments?created_from=2000-01-01&created_to=2000-01-02').json == []
+    assert len(client.get('/api/admin/payments?created_from=2000-01-01').json) == 25
+    assert client.get('/api/admin/payments?status=bogus').status_code == 400
+
+
+def test_worker_payments_are_paged_and_filtered(client):
+    create_payments(client, 25)
+    page = client.get('/api/admin/worker-payments?status=allocated&limit=2')
+    assert len(page.json) == 2
+    assert page.headers['X-Next-Cursor'] == '2'
+    assert len(client.get('/api/admin/worker-payments?worker_phone=9000000003').json) == 1
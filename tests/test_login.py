@@ -0,0 +1,27 @@
+def login(client, phone, name):
+    return client.post('/api/worker/login', json={'phone': phone, 'name': name}).status_code
+
+
+def test_login_follows_allocations(client):
+    first = client.post('/api/admin/payments', json={'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 1}).json
+    second = client.post('/api/admin/payments', json={'workorder': 'WO-2', 'contractor': 'Acme', 'amount': 1}).json
+    assert login(client, '9000000001', 'Ram Kumar') == 404
+
+    client.post(f"/api/payments/{first['payment_id']}/allocate", json={'workers': [
+        {'name': 'Ram Kumar', 'phone': '9000000001'}, {'name': 'Sita', 'phone': '9000000002'},
+    ]})
+    client.post(f"/api/payments/{second['payment_id']}/allocate", json={'workers': [
+        {'name': 'ram kumar', 'phone': '9000000001'},
+    ]})
+    # Names match case-insensitively, but only with their own phone
+    assert login(client, '9000000001', 'RAM KUMAR') == 200
+    assert login(client, '9000000002', 'sita') == 200
+    assert login(client, '9000000001', 'Sita') == 404
+
+    # Reallocating the first payment drops Sita, and Ram keeps the second
+    client.post(f"/api/payments/{first['payment_id']}/allocate", json={'workers': [
+        {'name': 'Gita', 'phone': '9000000003'},
+    ]})
+    assert login(client, '9000000002', 'Sita') == 404
+    assert login(client, '9000000001', 'Ram Kumar') == 200
+    assert login(client, '9000000003', 'gita') == 200
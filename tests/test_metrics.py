@@ -0,0 +1,38 @@
+def scrape(client):
+    """Samples of /metrics by name and labels"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            sample, value = line.rsplit(' ', 1)
+            samples[sample] = float(value)
+    return samples
+
+
+def test_metrics_count_requests_and_store_operations(client):
+    # The registry is shared by every app in the process: compare with a baseline
+    before = scrape(client)
+    client.post('/api/admin/payments', json={'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 100})
+    client.get('/api/admin/payments')
+    client.get('/api/admin/payments')
+    client.get('/nope')
+    # A streamed response (which queries payments too) is counted out of the
+    # in-flight gauge once
+    client.get('/api/admin/export/ledger').get_data()
+    after = scrape(client)
+
+    def increase(sample):
+        return after.get(sample, 0) - before.get(sample, 0)
+
+    # Requests are labelled by route template, not by URL
+    assert increase('wpts_http_requests_total{method="GET",route="/api/admin/payments",status="200"}') == 2
+    assert increase('wpts_http_requests_total{method="POST",route="/api/admin/payments",status="201"}') == 1
+    assert increase('wpts_http_requests_total{method="GET",route="/<path:filename>",status="404"}') == 1
+    assert increase('wpts_http_request_duration_seconds_bucket{method="GET",route="/api/admin/payments",le="+Inf"}') == 2
+    assert increase('wpts_store_operation_duration_seconds_count{operation="add_payment"}') == 1
+    assert increase('wpts_store_operation_duration_seconds_count{operation="query_payments"}') == 3
+    assert after['wpts_store_records{kind="payment"}'] == 1
+    # The scrape itself is in flight
+    assert after['wpts_http_requests_in_flight'] == 1
@@ -0,0 +1,92 @@
+import time
+import types
+
+import ratelimit
+from conftest import make_app
+from ratelimit import OVERLOAD_RETRY_AFTER, Limit, RedisBuckets
+
+
+class FailingRedis:
+    """Redis client whose every call fails after a delay, like a black-holed server"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = True
+
+    def register_script(self, script):
+        def run(keys, args):
+            self.calls += 1
+            if self.fail:
+                time.sleep(0.01)
+                raise FakeRedisError('timed out')
+            return '0'
+        return run
+
+
+class FakeRedisError(Exception):
+    pass
+
+
+def failing_buckets(monkeypatch, retry_after):
+    client = FailingRedis()
+    fake = types.SimpleNamespace(
+        RedisError=FakeRedisError,
+        Redis=types.SimpleNamespace(from_url=lambda url, **options: client),
+    )
+    monkeypatch.setattr(ratelimit, 'redis', fake)
+    return RedisBuckets('redis://unreachable', retry_after=retry_after), client
+
+
+def test_redis_failure_falls_back_to_local_buckets_for_a_while(monkeypatch):
+    buckets, client = failing_buckets(monkeypatch, retry_after=0.2)
+    limit = Limit.parse('2/60')
+
+    # The first check waits on Redis once; later ones go straight to the local buckets
+    assert buckets.take('ip:1', limit) == 0
+    started = time.perf_counter()
+    assert buckets.take('ip:1', limit) == 0
+    assert buckets.take('ip:1', limit) > 0
+    assert time.perf_counter() - started < 0.01
+    assert client.calls == 1
+
+    # After the window Redis is tried again, and used while it answers
+    time.sleep(0.25)
+    client.fail = False
+    assert buckets.take('ip:2', limit) == 0
+    assert buckets.take('ip:2', limit) == 0
+    assert client.calls == 3
+
+
+def test_worker_over_the_phone_limit_gets_429_with_retry_after(tmp_path):
+    client = make_app('memory', tmp_path, RATE_LIMIT_PHONE='3/30').test_client()
+    statuses = [client.get('/api/worker/9000000001/payments').status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    limited = client.get('/api/worker/9000000001/payments')
+    assert limited.status_code == 429
+    assert limited.headers['Retry-After'] == '10'
+
+    # Other phones and the admin endpoints are not limited by it
+    assert client.get('/api/worker/9000000002/payments').status_code == 200
+    assert client.get('/api/admin/payments').status_code == 200
+
+
+def test_client_ip_over_its_limit_gets_429(tmp_path):
+    client = make_app('memory', tmp_path, RATE_LIMIT_IP='2/60').test_client()
+    for phone in ('9000000001', '9000000002'):
+        assert client.get(f'/api/worker/{phone}/payments').status_code == 200
+    assert client.get('/api/worker/9000000003/payments').status_code == 429
+    other_ip = {'REMOTE_ADDR': '10.0.0.9'}
+    assert client.get('/api/worker/9000000003/payments', environ_base=other_ip).status_code == 200
+
+
+def test_worker_requests_over_the_concurrency_cap_get_503(tmp_path):
+    app = make_app('memory', tmp_path, WORKER_MAX_CONCURRENT='1')
+    limiter = app.extensions['wpts']['limiter']
+    client = app.test_client()
+    # A request in flight holds the only slot
+    assert limiter.admit()
+    busy = client.get('/api/worker/9000000001/payments')
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == str(OVERLOAD_RETRY_AFTER)
+    limiter.release()
+    assert client.get('/api/worker/9000000001/payments').status_code == 200
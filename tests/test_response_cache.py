@@ -0,0 +1,54 @@
+def allocated_payment(client, workorder, contractor, phone):
+    payment_id = client.post('/api/admin/payments', json={
+        'workorder': workorder, 'contractor': contractor, 'amount': 100,
+    }).json['payment_id']
+    client.post(f'/api/payments/{payment_id}/allocate', json={'workers': [{'name': 'Asha', 'phone': phone}]})
+
+
+def test_repeated_lists_are_served_from_the_cache(app):
+    cache = app.extensions['wpts']['responses']
+    client = app.test_client()
+    allocated_payment(client, 'WO-1', 'Acme', '9000000001')
+
+    first = client.get('/api/worker/9000000001/payments')
+    second = client.get('/api/worker/9000000001/payments')
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert cache.stats()['by_kind']['phone']['hits'] == 1
+
+    # Contractor names share an entry however they are written
+    contractor = client.get('/api/payments/contractor/Acme')
+    assert client.get('/api/payments/contractor/ACME').data == contractor.data
+    assert cache.stats()['by_kind']['contractor']['hits'] == 1
+
+
+def test_writes_drop_the_entries_they_touch(app):
+    cache = app.extensions['wpts']['responses']
+    client = app.test_client()
+    allocated_payment(client, 'WO-1', 'Acme', '9000000001')
+    allocated_payment(client, 'WO-2', 'Beta', '9000000002')
+    before = client.get('/api/worker/9000000001/payments').json
+    client.get('/api/payments/contractor/Acme')
+    client.get('/api/worker/9000000002/payments')
+    client.get('/api/payments/contractor/Beta')
+    assert len(cache) == 4
+
+    assert client.post('/api/worker/report-discrepancy', json={
+        'worker_phone': '9000000001', 'workorder': 'WO-1', 'actual_received': 1, 'notes': 'Short',
+    }).status_code == 200
+    # The worker's and the contractor's entries go, the others stay
+    assert len(cache) == 2
+    after = client.get('/api/worker/9000000001/payments').json
+    assert after[0]['payment_status'] != before[0]['payment_status']
+    misses = cache.stats()['by_kind']['contractor']['misses']
+    client.get('/api/payments/contractor/Acme')
+    assert cache.stats()['by_kind']['contractor']['misses'] == misses + 1
+
+
+def test_ndjson_lists_are_not_cached(app):
+    cache = app.extensions['wpts']['responses']
+    client = app.test_client()
+    allocated_payment(client, 'WO-1', 'Acme', '9000000001')
+    response = client.get('/api/worker/9000000001/payments', headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(cache) == 0
@@ -0,0 +1,27 @@
+from store import InMemoryStore
+
+
+def allocate(store, payment, *phones):
+    payment['allocated'] = bool(phones)
+    payment['workers'] = [{'name': f'Worker {phone}', 'phone': phone, 'promised_amount': 100}
+                          for phone in phones]
+    store.save_payment(payment)
+
+
+def test_allocations_follow_reallocation():
+    store = InMemoryStore()
+    first, second = (store.add_payment({'workorder': 'WO-1', 'contractor': 'Acme', 'amount': 200,
+                                        'allocated': False, 'workers': []}) for _ in range(2))
+    allocate(store, first, '9000000001', '9000000002')
+    allocate(store, second, '9000000001')
+
+    assert store.payments_allocated_to('9000000001', 'WO-1') == [first, second]
+    assert store.payments_allocated_to('9000000002', 'WO-1') == [first]
+    assert store.is_allocated_worker('9000000002', 'Worker 9000000002')
+
+    allocate(store, first, '9000000002')
+    assert store.payments_allocated_to('9000000001', 'WO-1') == [second]
+    allocate(store, second)
+    assert store.payments_allocated_to('9000000001', 'WO-1') == []
+    assert not store.is_allocated_worker('9000000001', 'Worker 9000000001')
+    assert store.payments_allocated_to('9000000002', 'WO-1') == [first]
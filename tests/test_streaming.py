@@ -0,0 +1,36 @@
+import json
+
+import app as app_module
+
+
+def create_payments(client, count):
+    for i in range(count):
+        client.post('/api/admin/payments', json={'workorder': f'WO-{i}', 'contractor': 'Acme', 'amount': 1 + i})
+
+
+def test_large_lists_are_streamed(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'STREAM_MIN_RECORDS', 5)
+    create_payments(client, 7)
+
+    streamed = client.get('/api/admin/payments')
+    assert streamed.mimetype == 'application/json'
+    assert 'Content-Length' not in streamed.headers
+    assert [payment['workorder'] for payment in json.loads(streamed.data)] == [f'WO-{i}' for i in range(7)]
+
+    small = client.get('/api/admin/payments?limit=3')
+    assert 'Content-Length' in small.headers
+    assert len(small.json) == 3
+
+
+def test_ndjson_is_served_when_accepted(client):
+    create_payments(client, 3)
+    json_list = client.get('/api/admin/payments')
+    ndjson = client.get('/api/admin/payments', headers={'Accept': 'application/x-ndjson'})
+    assert ndjson.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in ndjson.data.splitlines()] == [1, 2, 3]
+    # Each representation has its own tag
+    assert ndjson.headers['ETag'] != json_list.headers['ETag']
+    assert 'Accept' in ndjson.headers['Vary']
+
+    contractor = client.get('/api/payments/contractor/acme', headers={'Accept': 'application/x-ndjson'})
+    assert contractor.data.count(b'\n') == 3
@@ -0,0 +1,52 @@
+def create_payment(client, workorder, contractor, amount):
+    return client.post('/api/admin/payments', json={
+        'workorder': workorder, 'contractor': contractor, 'amount': amount,
+    }).json['payment_id']
+
+
+def record(client, payment_id, *worker_payments):
+    response = client.post(f'/api/admin/payments/{payment_id}/record-payments', json={'worker_payments': [
+        {'worker_phone': phone, 'worker_name': phone, 'promised_amount': promised, 'actual_paid': paid}
+        for phone, promised, paid in worker_payments
+    ]})
+    assert response.status_code == 200
+
+
+def test_summary_totals_follow_writes(client):
+    assert client.get('/api/admin/summary').json['totals']['payments']['count'] == 0
+
+    payment_id = create_payment(client, 'WO-1', 'Acme', 100)
+    create_payment(client, 'WO-2', 'acme ', 50)
+    create_payment(client, 'WO-3', 'Beta', 70)
+    client.post(f'/api/payments/{payment_id}/allocate', json={'workers': [
+        {'name': '9000000001', 'phone': '9000000001'}, {'name': '9000000002', 'phone': '9000000002'},
+    ]})
+    client.post(f'/api/payments/{payment_id}/mark-complete')
+    record(client, payment_id, ('9000000001', 60, 55), ('9000000002', 40, 40))
+    assert client.post('/api/worker/verify-payment-with-amount', json={
+        'worker_phone': '9000000001', 'workorder': 'WO-1', 'actual_received': 50, 'verified': True,
+    }).status_code == 200
+    # Recording a worker again moves the totals instead of adding to them
+    record(client, payment_id, ('9000000002', 40, 35))
+
+    totals = client.get('/api/admin/summary').json['totals']
+    assert totals['payments'] == {'count': 3, 'total_amount': 220, 'by_status': {'completed': 1, 'unallocated': 2}}
+    worker_payments = totals['worker_payments']
+    assert worker_payments['count'] == 2
+    assert (worker_payments['promised_amount'], worker_payments['actual_paid']) == (100, 90)
+    assert (worker_payments['actual_received_by_worker'], worker_payments['received_count']) == (50, 1)
+    assert (worker_payments['unpaid_amount'], worker_payments['unreceived_amount']) == (10, 5)
+    assert sum(worker_payments['by_payment_status'].values()) == 2
+
+
+def test_summary_per_contractor(client):
+    create_payment(client, 'WO-1', 'Acme', 100)
+    create_payment(client, 'WO-2', 'acme ', 50)
+    create_payment(client, 'WO-3', 'Beta', 70)
+
+    summary = client.get('/api/admin/summary').json
+    assert len(summary['contractors']) == 2
+    # Contractor names are matched case- and whitespace-insensitively
+    acme = client.get('/api/admin/summary?contractor=ACME').json
+    assert (acme['payments']['count'], acme['payments']['total_amount']) == (2, 150)
+    assert client.get('/api/admin/summary?contractor=nobody').status_code == 404